@@ -0,0 +1,66 @@
+import time
+from matplotlib import animation
+
+# Default target frame rate for animations
+ANIMATION_FPS = 20.0
+
+
+class AnimationEngine:
+    """Plays simulation steps at a target frame rate, skipping steps when rendering falls behind"""
+    def __init__(self, fig, step_n, update, init=None, fps=ANIMATION_FPS, smoothing=0.2):
+        self.fig = fig
+        self.step_n = step_n
+        self.update = update  # update(step) moves the persistent artists to a step and returns them
+        self.fps = fps
+        self.smoothing = smoothing
+
+        # Frame timing, frame_time is a smoothed wall time between rendered frames
+        self.frame_time = 1.0 / fps
+        self.last_frame = None
+        self.stride = 1
+        self.rendered = 0
+        self.skipped = 0
+
+        self.animation = animation.FuncAnimation(fig, self.draw_frame, frames=self.frames, init_func=init,
+                                                 interval=1000 / fps, blit=True, cache_frame_data=False)
+
+    # Simulation steps to draw, advancing by the current stride and always ending on the last step
+    def frames(self):
+        self.last_frame = None
+        step = 0
+        while step < self.step_n - 1:
+            yield step
+            step += self.stride
+        if self.step_n > 0:
+            yield self.step_n - 1
+
+    # Draw one step and adapt the stride so simulated time keeps moving at the target rate
+    def draw_frame(self, step):
+        now = time.perf_counter()
+        if self.last_frame is not None:
+            self.frame_time += self.smoothing * ((now - self.last_frame) - self.frame_time)
+        self.last_frame = now
+
+        self.stride = max(1, int(round(self.frame_time * self.fps)))
+        self.skipped += self.stride - 1
+        self.rendered += 1
+
+        return self.update(step)
+
+    # Frames per second actually being drawn
+    def achieved_fps(self):
+        return 1.0 / self.frame_time
+
+    # Achieved vs target frame rate, for display
+    def report(self):
+        return f"{self.achieved_fps():.1f}/{self.fps:g} fps"
+
+    # Timer driving the animation
+    @property
+    def event_source(self):
+        return self.animation.event_source
+
+    # Stop the animation
+    def stop(self):
+        if self.animation.event_source is not None:
+            self.animation.event_source.stop()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import numpy as np
+import frames as ft
+
+# Source text asset and the binary asset generated from it
+COASTLINE_CSV = os.path.join('Spice', 'coastlines.csv')
+COASTLINE_NPY = os.path.join('Spice', 'coastlines.npy')
+
+# Columns of the binary asset: longitude and latitude in degrees, then the unit-sphere ECEF position
+LONG, LAT, X, Y, Z = range(5)
+
+# Memory map of the binary asset, loaded on first use and shared by every plot in the process
+coastline_data = None
+
+
+# Parse the CSV once and write the binary asset, renamed into place so concurrent readers never see a partial file
+def build_coastline_asset(csv_path=COASTLINE_CSV, npy_path=COASTLINE_NPY):
+    longlat = np.genfromtxt(csv_path, delimiter=',')  # [point, [long, lat]]
+
+    data = np.empty((len(longlat), 5))
+    data[:, [LONG, LAT]] = longlat
+    ft.lat2rec(np.column_stack((longlat[:, 1], longlat[:, 0], np.ones(len(longlat)))), out=data[:, X:Z + 1])
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(npy_path) or '.')
+    with os.fdopen(fd, 'wb') as file:
+        np.save(file, data)
+    os.replace(tmp_path, npy_path)
+
+
+# The full resolution asset, rebuilt only when missing or older than the CSV
+def load_coastlines():
+    global coastline_data
+
+    if coastline_data is None:
+        stale = not os.path.exists(COASTLINE_NPY) or (
+            os.path.exists(COASTLINE_CSV) and os.path.getmtime(COASTLINE_CSV) > os.path.getmtime(COASTLINE_NPY))
+        if stale:
+            build_coastline_asset()
+        coastline_data = np.load(COASTLINE_NPY, mmap_mode='r')
+
+    return coastline_data
+
+
+# Coastline points at a level of detail, level n keeps every 2^n-th point (a view, nothing is copied)
+def coastlines(level=0):
+    return load_coastlines()[::2 ** level]
+
+
+# (n, 2) [long, lat] in degrees, for ground track maps
+def longlat(level=0):
+    return coastlines(level)[:, [LONG, LAT]]
+
+
+# (n, 3) Earth fixed positions on a sphere of the given radius, for 3D plots
+def ecef(level=0, radius=1.0):
+    return radius * coastlines(level)[:, X:Z + 1]
@@ -0,0 +1,229 @@
+import numpy as np
+from collections import OrderedDict
+
+# Default number of points drawn per trajectory when no view sizes the budget
+DECIMATION_BUDGET = 4000
+
+# Fewest points per trajectory when a view's budget is shared between many orbits
+MIN_BUDGET = 256
+
+# Refinement passes of lttb after the first, each re-scores only the buckets whose anchor moved
+LTTB_PASSES = 8
+
+# Points (tracks x steps x dimensions) scored at once by lttb_rows, bounds its scratch arrays for large catalogs
+LTTB_BLOCK_POINTS = 2 * 1024 ** 2
+
+# Bytes of decimated output kept, entries are small so this holds every orbit of a catalog-size scenario's views
+DECIMATION_CACHE_BYTES = 64 * 1024 ** 2
+
+
+class DecimationCache:
+    """LRU cache of read-only decimated trajectories, bounded by the bytes they hold rather than their number"""
+    def __init__(self, max_bytes=DECIMATION_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    # Cached array for key, or None on a miss
+    def get(self, key):
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    # Store a decimated array under key, it is made read-only as every caller shares it
+    def put(self, key, result):
+        self.discard(key)
+        result.flags.writeable = False
+        self.entries[key] = result
+        self.nbytes += result.nbytes
+        self.evict(keep=key)
+
+    # Drop a single entry if present
+    def discard(self, key):
+        result = self.entries.pop(key, None)
+        if result is not None:
+            self.nbytes -= result.nbytes
+
+    # Drop least recently used entries until the cache fits its budget, keep (the entry just stored) always stays
+    def evict(self, keep=None):
+        for key in list(self.entries):
+            if self.nbytes <= self.max_bytes:
+                break
+            if key != keep:
+                self.discard(key)
+
+    # Remove every entry
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+# Cache shared by every view
+decimation_cache = DecimationCache()
+
+
+# Indices of the points kept by largest-triangle-three-buckets, points is (n, d) with any d >= 1
+def lttb(points, budget):
+    points = np.asarray(points, dtype=float)
+    if points.ndim == 1:
+        points = points[:, None]
+    return lttb_rows(points[None], budget)[0]
+
+
+# Indices (m, budget) of the points kept in each of m tracks sharing one length, points is (m, n, d)
+# Buckets of every track are scored together, first against the previous bucket's mean, then buckets whose previous
+# choice changed are scored again against it, which settles on the sequential result within a few passes on smooth
+# tracks. Tracks are processed LTTB_BLOCK_POINTS points at a time so catalogs never need a full size scratch grid
+def lttb_rows(points, budget):
+    points = np.asarray(points, dtype=float)
+    m, n = points.shape[:2]
+    if n <= budget:
+        return np.tile(np.arange(n), (m, 1))
+    budget = max(budget, 3)
+
+    # First and last points are kept, points 1 to n - 2 are split into budget - 2 buckets
+    edges = np.linspace(1, n - 1, budget - 1).astype(int)
+    starts, stops = edges[:-1], edges[1:]
+
+    # Bucket sizes differ by at most one, so candidates fit a (buckets, widest) grid with the overhang masked
+    candidates = starts[:, None] + np.arange((stops - starts).max())
+    overhang = candidates >= stops[:, None]
+    candidates = np.minimum(candidates, n - 2)
+
+    keep = np.empty((m, budget), dtype=int)
+    keep[:, 0], keep[:, -1] = 0, n - 1
+    block = max(LTTB_BLOCK_POINTS // (n * points.shape[2]), 1)
+    for first in range(0, m, block):
+        keep[first:first + block, 1:-1] = lttb_buckets(points[first:first + block], candidates, overhang,
+                                                        starts, stops)
+    return keep
+
+
+# Candidate making the largest triangle with its anchor and the following bucket's mean, for any leading shape
+# grid is (..., widest, d), anchors and following (..., d), overhang (..., widest) and starts (...) the buckets' first
+# points, the overhang is never chosen so the candidate is the bucket start plus its column
+def largest_triangle(grid, anchors, following, overhang, starts):
+    u = grid - anchors[..., None, :]
+    v = following - anchors
+    area2 = (np.einsum('...kd,...kd->...k', u, u) * np.einsum('...d,...d->...', v, v)[..., None]
+             - np.einsum('...kd,...d->...k', u, v) ** 2)
+    area2 = np.where(overhang, -np.inf, area2)
+    return starts + np.argmax(area2, axis=-1)
+
+
+# Chosen point of every bucket of every track, see lttb_rows
+def lttb_buckets(points, candidates, overhang, starts, stops):
+    m = len(points)
+    buckets_n = len(starts)
+    tracks = np.arange(m)[:, None]
+    grid = points[:, candidates]
+
+    # Mean of every bucket from running sums, the bucket after the last one is the final point
+    sums = np.concatenate((np.zeros((m, 1, points.shape[2])), np.cumsum(points, axis=1)), axis=1)
+    means = (sums[:, stops] - sums[:, starts]) / (stops - starts)[:, None]
+    following = np.concatenate((means[:, 1:], points[:, -1:]), axis=1)
+
+    # Every bucket against the previous bucket's mean, then every bucket after the first against the previous
+    # choice, both as dense slices
+    anchors = np.concatenate((points[:, :1], means[:, :-1]), axis=1)
+    chosen = largest_triangle(grid, anchors, following, overhang, starts)
+    if buckets_n < 2:
+        return chosen
+    selected = largest_triangle(grid[:, 1:], points[tracks, chosen[:, :-1]], following[:, 1:], overhang[1:],
+                                starts[1:])
+    changed = selected != chosen[:, 1:]
+    chosen[:, 1:] = selected
+
+    # Later passes only re-score the buckets following one whose choice changed
+    tracks, buckets = np.nonzero(changed)
+    buckets += 1
+    for _ in range(LTTB_PASSES - 1):
+        following_bucket = buckets < buckets_n - 1
+        tracks, buckets = tracks[following_bucket], buckets[following_bucket] + 1
+        if len(buckets) == 0:
+            break
+        selected = largest_triangle(grid[tracks, buckets], points[tracks, chosen[tracks, buckets - 1]],
+                                    following[tracks, buckets], overhang[buckets], starts[buckets])
+        changed = selected != chosen[tracks, buckets]
+        chosen[tracks, buckets] = selected
+        tracks, buckets = tracks[changed], buckets[changed]
+
+    return chosen
+
+
+# Decimate a 3D trajectory (n, >=3) to budget points, the path's shape is kept in position space
+def decimate_path(state, budget=DECIMATION_BUDGET):
+    return decimate_paths(state[None], budget)[0]
+
+
+# Decimate m trajectories (m, n, >=3) sharing one length to (m, budget, >=3) in one vectorized pass
+def decimate_paths(states, budget=DECIMATION_BUDGET):
+    keep = lttb_rows(states[:, :, :3], budget)
+    return np.take_along_axis(states, keep[:, :, None], axis=1)
+
+
+# Decimate a ground track (n, [lat, long, ...]) in degrees, split with NaN rows where it wraps at +-180 deg
+def decimate_groundtrack(latlong, budget=DECIMATION_BUDGET):
+    return decimate_groundtracks(latlong[None], budget)[0]
+
+
+# Decimate m ground tracks (m, n, [lat, long, ...]) sharing one length, returns a list of [lat, long] tracks
+# broken where they wrap, their lengths differ by the number of wraps
+def decimate_groundtracks(latlongs, budget=DECIMATION_BUDGET):
+    lat, long = latlongs[:, :, 0], latlongs[:, :, 1]
+
+    # Unwrapped longitude is continuous so the wrap does not look like a feature to the decimation
+    keep = lttb_rows(np.stack((lat, np.unwrap(long, period=360, axis=1)), axis=2), budget)
+    tracks = np.stack((np.take_along_axis(lat, keep, axis=1), np.take_along_axis(long, keep, axis=1)), axis=2)
+    return [break_wraps(track)[0] for track in tracks]
+
+
+# Insert NaN rows where a [lat, long] track wraps at +-180 deg, also returns the row each sample moved to
+def break_wraps(track):
+    wraps = np.nonzero(np.abs(np.diff(track[:, 1])) > 180)[0] + 1
+    samples = np.arange(len(track))
+    rows = samples + np.searchsorted(wraps, samples, side='right')
+    return np.insert(track, wraps, np.nan, axis=0), rows
+
+
+# Cached decimation of one of an orbit's result channels ('state' or 'latlong')
+def decimated(orbit, channel, budget=DECIMATION_BUDGET):
+    return decimated_orbits([orbit], channel, budget)[0]
+
+
+# Cached decimations of a channel of many orbits, cache misses with the same number of steps (every object of a
+# catalog, or orbits sharing a time window) are decimated together in one vectorized pass
+def decimated_orbits(orbits, channel, budget=DECIMATION_BUDGET):
+    keys = [(orbit.cache_key(), channel, budget) for orbit in orbits]
+    results = [decimation_cache.get(key) for key in keys]
+
+    groups = {}
+    for index, (orbit, result) in enumerate(zip(orbits, results)):
+        if result is None:
+            groups.setdefault(len(getattr(orbit, channel)), []).append(index)
+
+    for indices in groups.values():
+        stacked = np.stack([getattr(orbits[index], channel) for index in indices])
+        if channel == 'latlong':
+            decimations = decimate_groundtracks(stacked, budget)
+        else:
+            decimations = decimate_paths(stacked, budget)
+
+        for index, result in zip(indices, decimations):
+            result = np.ascontiguousarray(result)
+            decimation_cache.put(keys[index], result)
+            results[index] = result
+
+    return results
+
+
+# Point budget for a view, a few points per pixel across the axes at their current size
+def view_budget(ax, points_per_pixel=2):
+    return max(int(ax.bbox.width * points_per_pixel), 3)
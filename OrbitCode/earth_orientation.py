@@ -0,0 +1,158 @@
+import hashlib
+import numpy as np
+import spiceypy as spice
+from spiceypy.utils.exceptions import SpiceyError
+from collections import OrderedDict
+
+# Fidelity levels, from full ITRF93 to a kernel free analytic model
+FIDELITIES = ('spice', 'interpolated', 'analytic')
+
+# TT - UT1 [s] used when no leapseconds kernel is loaded (value for 2020)
+DEFAULT_DELTA_T = 69.184
+
+ARCSEC = np.pi / (180 * 3600)
+
+
+# Frame rotation about z for an array of angles, (n, 3, 3)
+def rot3(a):
+    c, s = np.cos(a), np.sin(a)
+    zeros, ones = np.zeros_like(a), np.ones_like(a)
+    return np.stack((np.stack((c, s, zeros), -1), np.stack((-s, c, zeros), -1), np.stack((zeros, zeros, ones), -1)), -2)
+
+
+# Frame rotation about y for an array of angles, (n, 3, 3)
+def rot2(a):
+    c, s = np.cos(a), np.sin(a)
+    zeros, ones = np.zeros_like(a), np.ones_like(a)
+    return np.stack((np.stack((c, zeros, -s), -1), np.stack((zeros, ones, zeros), -1), np.stack((s, zeros, c), -1)), -2)
+
+
+# TT - UT1 [s] at epoch et, from SPICE (ET - UTC, taking UT1 as UTC) when a leapseconds kernel is loaded
+def delta_t(et):
+    try:
+        return spice.deltet(float(et), 'ET')
+    except SpiceyError:
+        return DEFAULT_DELTA_T
+
+
+# ET - UTC [s] for an array of epochs given as 'ET' or 'UTC' seconds past J2000, it only changes at leap seconds
+# so SPICE is asked once per calendar day
+def delta_ets(epochs, eptype='ET'):
+    epochs = np.asarray(epochs, dtype=float)
+    days, rows = np.unique(np.floor((epochs.ravel() + 43200) / 86400), return_inverse=True)
+    try:
+        offsets = np.array([spice.deltet(day * 86400, eptype) for day in days])
+    except SpiceyError:
+        offsets = np.full(len(days), DEFAULT_DELTA_T)
+    return offsets[rows].reshape(epochs.shape)
+
+
+# Greenwich mean sidereal time [rad] (IAU 1982) at ET seconds past J2000
+def gmst(et):
+    et = np.asarray(et, dtype=float)
+    t_ut1 = (et - delta_t(et.ravel()[0] if et.size else 0.0)) / (86400 * 36525)
+    seconds = (67310.54841 + (876600 * 3600 + 8640184.812866) * t_ut1
+               + 0.093104 * t_ut1 ** 2 - 6.2e-6 * t_ut1 ** 3)
+    return np.mod(seconds, 86400) * 2 * np.pi / 86400
+
+
+# IAU 1976 precession matrices from J2000 to mean-of-date, (n, 3, 3)
+def precession(et):
+    t = np.asarray(et, dtype=float) / (86400 * 36525)
+    zeta = (2306.2181 * t + 0.30188 * t ** 2 + 0.017998 * t ** 3) * ARCSEC
+    z = (2306.2181 * t + 1.09468 * t ** 2 + 0.018203 * t ** 3) * ARCSEC
+    theta = (2004.3109 * t - 0.42665 * t ** 2 - 0.041833 * t ** 3) * ARCSEC
+    return rot3(-z) @ rot2(theta) @ rot3(-zeta)
+
+
+# Analytic J2000 to Earth fixed rotation (precession and GMST, no nutation or polar motion), (n, 3, 3)
+def analytic_matrices(et):
+    et = np.asarray(et, dtype=float).ravel()
+    return rot3(gmst(et)) @ precession(et)
+
+
+# Full SPICE rotation from frame to ITRF93 at every epoch, (n, 3, 3)
+def spice_matrices(et, frame='J2000'):
+    et = np.asarray(et, dtype=float).ravel()
+    matrices = np.zeros((len(et), 3, 3))
+    for step, t in enumerate(et):
+        matrices[step] = spice.pxform(frame, 'ITRF93', t)
+    return matrices
+
+
+# SPICE rotations sampled every sample_step seconds, the slowly varying part is interpolated between samples
+def interpolated_matrices(et, frame='J2000', sample_step=3600.0):
+    et = np.asarray(et, dtype=float).ravel()
+    if len(et) == 0:
+        return np.zeros((0, 3, 3))
+
+    sample_n = max(int(np.ceil((et.max() - et.min()) / sample_step)) + 1, 2)
+    samples = np.linspace(et.min(), et.max(), sample_n)
+
+    # Remove the fast sidereal spin so only precession, nutation and polar motion remain
+    slow = rot3(-gmst(samples)) @ spice_matrices(samples, frame)
+    slow_t = np.stack([np.interp(et, samples, slow[:, i, j]) for i in range(3) for j in range(3)], -1)
+
+    return rot3(gmst(et)) @ slow_t.reshape(-1, 3, 3)
+
+
+class EarthRotation:
+    """Inertial to Earth fixed rotation matrices for whole time grids, cached per grid"""
+    def __init__(self, fidelity='spice', sample_step=3600.0, cache_size=16):
+        self.fidelity = fidelity
+        self.sample_step = sample_step
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    # Requested fidelity, or the service default, checked against the frame
+    def check_fidelity(self, fidelity, frame):
+        fidelity = fidelity or self.fidelity
+        if fidelity not in FIDELITIES:
+            raise ValueError(f"Unknown Earth rotation fidelity '{fidelity}', expected one of {FIDELITIES}")
+        if fidelity == 'analytic' and frame != 'J2000':
+            raise ValueError("The analytic Earth rotation is only defined from J2000")
+        return fidelity
+
+    # Rotation matrices (n, 3, 3) from frame to ITRF93 at every epoch in et
+    def matrices(self, et, frame='J2000', fidelity=None):
+        fidelity = self.check_fidelity(fidelity, frame)
+
+        et = np.asarray(et, dtype=float).ravel()
+        key = (fidelity, frame, self.sample_step, len(et), hashlib.sha1(et.tobytes()).hexdigest())
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        if fidelity == 'spice':
+            matrices = spice_matrices(et, frame)
+        elif fidelity == 'interpolated':
+            matrices = interpolated_matrices(et, frame, self.sample_step)
+        else:
+            matrices = analytic_matrices(et)
+
+        matrices.flags.writeable = False
+        self.cache[key] = matrices
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return matrices
+
+    # Single rotation matrix from frame to ITRF93 at epoch et, not cached so per-frame lookups never evict grids
+    def matrix(self, et, frame='J2000', fidelity=None):
+        fidelity = self.check_fidelity(fidelity, frame)
+        if fidelity == 'analytic':
+            return analytic_matrices([et])[0]
+        return spice.pxform(frame, 'ITRF93', et)
+
+    # Rotate (n, 3) inertial positions, one per epoch, into the Earth fixed frame
+    def eci2ecef(self, r_states, et, frame='J2000', fidelity=None):
+        return np.einsum('nij,nj->ni', self.matrices(et, frame, fidelity), r_states)
+
+    # Rotate (n, 3) Earth fixed positions, one per epoch, back to the inertial frame
+    def ecef2eci(self, r_states, et, frame='J2000', fidelity=None):
+        return np.einsum('nji,nj->ni', self.matrices(et, frame, fidelity), r_states)
+
+
+# Service shared by frames and plotting
+rotation = EarthRotation()
@@ -0,0 +1,71 @@
+import numpy as np
+from collections import OrderedDict
+import spice_tools as s
+
+# Fitted ephemerides shared by every orbit with the same body and time window
+EPHEMERIS_CACHE_SIZE = 32
+ephemeris_cache = OrderedDict()
+
+
+class ChebyshevEphemeris:
+    """Piecewise Chebyshev fit of a body's state, evaluated at any epoch inside its window"""
+    def __init__(self, target, observer, frame, et_start, et_stop, segment=86400.0, degree=12):
+        self.target = target
+        self.observer = observer
+        self.frame = frame
+        self.et_start = float(et_start)
+        self.segment = float(segment)
+        self.degree = degree
+
+        # Segments covering the window, the last one may run past et_stop
+        self.segment_n = max(int(np.ceil((float(et_stop) - self.et_start) / self.segment)), 1)
+        self.et_stop = self.et_start + self.segment_n * self.segment
+
+        # Chebyshev nodes on [-1, 1], SPICE is only sampled here
+        nodes = np.cos(np.pi * (np.arange(degree + 1) + 0.5) / (degree + 1))
+        starts = self.et_start + self.segment * np.arange(self.segment_n)
+        times = (starts[:, None] + (nodes[None, :] + 1) * self.segment / 2).ravel()
+
+        # One vectorized spkezr call for every node of every segment
+        states = s.get_ephemeris_states(target, times, frame, observer).reshape(self.segment_n, degree + 1, 6)
+
+        # Fit all segments and all six components at once, coeffs is (segments, degree + 1, 6)
+        vander = np.polynomial.chebyshev.chebvander(nodes, degree)
+        self.coeffs = np.linalg.solve(vander, states.transpose(1, 0, 2).reshape(degree + 1, -1))
+        self.coeffs = self.coeffs.reshape(degree + 1, self.segment_n, 6).transpose(1, 0, 2)
+
+    # States (n, 6) at an array of epochs [ET seconds], a scalar epoch returns a single (6,) state
+    def states(self, et):
+        et = np.asarray(et, dtype=float)
+        scalar = et.ndim == 0
+        et = et.ravel()
+
+        # Segment and local coordinate of every epoch
+        idx = np.clip(((et - self.et_start) // self.segment).astype(int), 0, self.segment_n - 1)
+        x = np.clip(2 * (et - self.et_start - idx * self.segment) / self.segment - 1, -1.0, 1.0)
+
+        # T_k(x) = cos(k arccos(x)), then weight each epoch's segment coefficients
+        chebyshev = np.cos(np.arange(self.degree + 1) * np.arccos(x)[:, None])
+        result = np.einsum('nk,nkc->nc', chebyshev, self.coeffs[idx])
+
+        return result[0] if scalar else result
+
+    # Positions (n, 3) at an array of epochs, or a single (3,) position
+    def positions(self, et):
+        return self.states(et)[..., :3]
+
+
+# Returns the shared fitted ephemeris of target with respect to observer covering [et_start, et_stop]
+def get_ephemeris(target, et_start, et_stop, frame, observer, segment=86400.0, degree=12):
+    key = (target, observer, frame, float(et_start), float(et_stop), segment, degree)
+
+    if key in ephemeris_cache:
+        ephemeris_cache.move_to_end(key)
+        return ephemeris_cache[key]
+
+    ephemeris = ChebyshevEphemeris(target, observer, frame, et_start, et_stop, segment, degree)
+    ephemeris_cache[key] = ephemeris
+    if len(ephemeris_cache) > EPHEMERIS_CACHE_SIZE:
+        ephemeris_cache.popitem(last=False)
+
+    return ephemeris
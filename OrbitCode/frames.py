@@ -1,6 +1,7 @@
 import numpy as np
 import spiceypy as spice
 import planet_data as pd
+import earth_orientation as eo
 
 # x-axis rotation
 def xr(a):
@@ -68,31 +69,106 @@ def plot_frame(ax, reference_frames):
         ax.text(reference[0, 2], reference[1, 2], reference[2, 2], 'Z', color='w')
 
 
-def eci2ecef(r_states, tspan, frame='J2000'):
-    # Preallocate arrays
-    steps = r_states.shape[0]
-    rotation_m = np.zeros((steps, 3, 3))
-    nr_states = np.zeros(r_states.shape)
-
-    for step in range(steps):
-        rotation_m[step, :, :] = spice.pxform(frame, 'ITRF93', tspan[step])
-        #Preform matrix multiplication to apply rotation matrix
-        nr_states[step, :] = np.dot(rotation_m[step, :, :], r_states[step, :])
-
-    return nr_states
+# Rotate inertial positions into ITRF93, one epoch per row, fidelity is 'spice', 'interpolated' or 'analytic'
+def eci2ecef(r_states, tspan, frame='J2000', fidelity=None):
+    return eo.rotation.eci2ecef(r_states, tspan, frame, fidelity)
 
 ### Coordinate Conversions
-def ecef2latlong(r_states, tspan, frame='J2000'):
-    steps = r_states.shape[0]
-    latlongs = np.zeros((steps, 3))
-    r_ecef_states = eci2ecef(r_states, tspan, frame)
+def ecef2latlong(r_states, tspan, frame='J2000', fidelity=None, model='spherical'):
+    r_ecef_states = eci2ecef(r_states, tspan, frame, fidelity)
 
-    for step in range(steps):
-        r_normal, long, lat = spice.reclat(r_ecef_states[step, :])
-        latlongs[step, :] = [np.rad2deg(lat), np.rad2deg(long), r_normal]
+    if model == 'geodetic':
+        latlongs = rec2geo(r_ecef_states)
+    else:
+        latlongs = rec2lat(r_ecef_states)
 
     return latlongs, r_ecef_states
 
+# Rectangular (n, 3) to spherical [lat, long, radius] in degrees, the vectorized form of spice.reclat
+def rec2lat(r_states, out=None):
+    r_states = np.asarray(r_states, dtype=float).reshape(-1, 3)
+    if out is None:
+        out = np.empty((len(r_states), 3))
+
+    x, y, z = r_states[:, 0], r_states[:, 1], r_states[:, 2]
+    rho = np.hypot(x, y)
+    np.hypot(rho, z, out=out[:, 2])
+    np.rad2deg(np.arctan2(z, rho), out=out[:, 0])
+    np.rad2deg(np.arctan2(y, x), out=out[:, 1])
+
+    return out
+
+# Spherical [lat, long, radius] in degrees to rectangular (n, 3), the vectorized form of spice.latrec
+def lat2rec(latlongs, out=None):
+    latlongs = np.asarray(latlongs, dtype=float).reshape(-1, 3)
+    if out is None:
+        out = np.empty((len(latlongs), 3))
+
+    lat = np.deg2rad(latlongs[:, 0])
+    lon = np.deg2rad(latlongs[:, 1])
+    radius_cos_lat = latlongs[:, 2] * np.cos(lat)
+    np.multiply(radius_cos_lat, np.cos(lon), out=out[:, 0])
+    np.multiply(radius_cos_lat, np.sin(lon), out=out[:, 1])
+    np.multiply(latlongs[:, 2], np.sin(lat), out=out[:, 2])
+
+    return out
+
+# Rectangular (n, 3) to geodetic [lat, long, altitude] in degrees on the body's ellipsoid (closed form, Heikkinen)
+def rec2geo(r_states, cb=pd.Earth, out=None):
+    r_states = np.asarray(r_states, dtype=float).reshape(-1, 3)
+    if out is None:
+        out = np.empty((len(r_states), 3))
+
+    a = cb['equatorial_radius']
+    f = cb['flattening']
+    b = a * (1 - f)
+    e2 = f * (2 - f)
+    ep2 = (a ** 2 - b ** 2) / b ** 2
+
+    x, y, z = r_states[:, 0], r_states[:, 1], r_states[:, 2]
+    p = np.hypot(x, y)
+    z2 = z ** 2
+
+    F = 54 * b ** 2 * z2
+    G = p ** 2 + (1 - e2) * z2 - e2 * (a ** 2 - b ** 2)
+    c = e2 ** 2 * F * p ** 2 / G ** 3
+    s = np.cbrt(1 + c + np.sqrt(c ** 2 + 2 * c))
+    k = s + 1 + 1 / s
+    P = F / (3 * k ** 2 * G ** 2)
+    Q = np.sqrt(1 + 2 * e2 ** 2 * P)
+    r0 = (-P * e2 * p / (1 + Q)
+          + np.sqrt(np.maximum(a ** 2 / 2 * (1 + 1 / Q) - P * (1 - e2) * z2 / (Q * (1 + Q)) - P * p ** 2 / 2, 0)))
+    U = np.hypot(p - e2 * r0, z)
+    V = np.sqrt((p - e2 * r0) ** 2 + (1 - e2) * z2)
+    z0 = b ** 2 * z / (a * V)
+
+    np.multiply(U, 1 - b ** 2 / (a * V), out=out[:, 2])
+    np.rad2deg(np.arctan2(z + ep2 * z0, p), out=out[:, 0])
+    np.rad2deg(np.arctan2(y, x), out=out[:, 1])
+
+    return out
+
+# Geodetic [lat, long, altitude] in degrees to rectangular (n, 3) on the body's ellipsoid, like spice.georec
+def geo2rec(latlongs, cb=pd.Earth, out=None):
+    latlongs = np.asarray(latlongs, dtype=float).reshape(-1, 3)
+    if out is None:
+        out = np.empty((len(latlongs), 3))
+
+    a = cb['equatorial_radius']
+    e2 = cb['flattening'] * (2 - cb['flattening'])
+
+    lat = np.deg2rad(latlongs[:, 0])
+    lon = np.deg2rad(latlongs[:, 1])
+    alt = latlongs[:, 2]
+    sin_lat = np.sin(lat)
+    N = a / np.sqrt(1 - e2 * sin_lat ** 2)  # Prime vertical radius of curvature
+
+    np.multiply((N + alt) * np.cos(lat), np.cos(lon), out=out[:, 0])
+    np.multiply((N + alt) * np.cos(lat), np.sin(lon), out=out[:, 1])
+    np.multiply(N * (1 - e2) + alt, sin_lat, out=out[:, 2])
+
+    return out
+
 def eci2perifocal(an, aop, i):
     i_vec = np.array([
         np.cos(an) * np.cos(aop) - np.sin(an) * np.sin(aop) * np.cos(i),
@@ -112,108 +188,199 @@ def eci2perifocal(an, aop, i):
 
     return np.array([i_vec, j_vec, k_vec])
 
-def latlong2ecef(r_states):
-    steps = r_states.shape[0]
-    r_ecef_states = np.zeros((steps, 3))
+# Lat/long (n, 3) rows of [lat, long, radius] (spherical) or [lat, long, altitude] (geodetic) to ECEF
+def latlong2ecef(r_states, model='spherical', out=None):
+    if model == 'geodetic':
+        return geo2rec(r_states, out=out)
+    return lat2rec(r_states, out=out)
 
-    for step in range(steps):
-        radius = r_states[step, 2]
-        lat = np.deg2rad(r_states[step, 0])    # Latitude in radians
-        lon = np.deg2rad(r_states[step, 1])    # Longitude in radians
-        x, y, z = spice.latrec(radius, lon, lat)
-        r_ecef_states[step, :] = [x, y, z]
-
-    return r_ecef_states
-
-def ecef2eci(r_states, time, frame='ITRF93'):
+def ecef2eci(r_states, time, frame='ITRF93', fidelity=None, out=None):
     # r_states is an array of shape (N, 3)
     # time is a scalar representing the time at which to perform the transformation
+    # out is an optional (N, 3) array that receives the result instead of a new allocation
 
     # Get the rotation matrix from ECEF to ECI at the given time
-    rotation_m = spice.pxform(frame, 'J2000', time)
+    if frame == 'ITRF93':
+        rotation_m = eo.rotation.matrix(time, 'J2000', fidelity).T
+    else:
+        rotation_m = spice.pxform(frame, 'J2000', time)
     # Apply rotation to all positions
-    nr_states = np.dot(r_states, rotation_m.T)
+    nr_states = np.dot(r_states, rotation_m.T, out=out)
     return nr_states
 
+# SGP4 TEME states (..., n, 6) at n ET epochs to J2000, nutation is neglected (at most about 1e-4 rad, below SGP4's
+# own error) so with the analytic Earth rotation the ground track is exactly the TEME one
+def teme2j2000(states, et):
+    matrices = eo.precession(et)  # J2000 to mean of date
+    j2000 = np.empty_like(states)
+    j2000[..., :3] = np.einsum('nji,...nj->...ni', matrices, states[..., :3])
+    j2000[..., 3:] = np.einsum('nji,...nj->...ni', matrices, states[..., 3:])
+    return j2000
+
 # Position and velocity to KOE
 def rv2koe(r, v, mu, degrees=False):
-    normal_r = np.linalg.norm(r)
-    normal_v = np.linalg.norm(v)
+    return list(rv2koe_array(np.concatenate((r, v), axis=None), mu, degrees)[0])
+
+# Koe to position and velocity
+def koe2rv(koe, cb=pd.Earth):
+    state = koe2rv_array(koe, cb)[0]
+    return state[:3], state[3:]
+
+# Position and velocity (N, 6) to KOE (N, 6) with rows [a, e, i, ta, aop, an]
+def rv2koe_array(states, mu, degrees=False):
+    states = np.asarray(states, dtype=float).reshape(-1, 6)
+    r = states[:, :3]
+    v = states[:, 3:]
+    normal_r = np.linalg.norm(r, axis=1)
+    normal_v = np.linalg.norm(v, axis=1)
+    r_dot_v = np.einsum('ij,ij->i', r, v)
 
     # Angular momentum vector and its norm
     h = np.cross(r, v)
-    normal_h = np.linalg.norm(h)
-
-    # Inclination
-    i = np.arccos(h[2] / normal_h)
+    normal_h = np.linalg.norm(h, axis=1)
 
     # Eccentricity vector and its norm
-    e = ((normal_v ** 2 - mu / normal_r) * r - np.dot(r, v) * v) / mu
-    normal_e = np.linalg.norm(e)
-
-    # Ascending Node vector and its norm
-    N = np.cross([0, 0, 1], h)
-    normal_N = np.linalg.norm(N)
-
-    # Ascending Node (Right Ascension of the Ascending Node, RAAN)
-    if normal_N != 0:
-        an = np.arccos(N[0] / normal_N)
-        if N[1] < 0:
-            an = 2 * np.pi - an
-    else:
-        an = 0  # Edge case for equatorial orbit
+    e = ((normal_v ** 2 - mu / normal_r)[:, None] * r - r_dot_v[:, None] * v) / mu
+    normal_e = np.linalg.norm(e, axis=1)
 
-    # Argument of Perigee
-    if normal_N != 0 and normal_e != 0:
-        aop = np.arccos(np.dot(N, e) / (normal_N * normal_e))
-        if np.dot(N, e) < 0:
-            aop = 2 * np.pi - aop
-    else:
-        aop = 0  # Edge case for circular or equatorial orbit
+    # Ascending Node vector (k x h) and its norm
+    N = np.column_stack((-h[:, 1], h[:, 0], np.zeros(len(h))))
+    normal_N = np.linalg.norm(N, axis=1)
 
-    # True Anomaly
-    if normal_e != 0:
-        ta = np.arccos(np.dot(e, r) / (normal_e * normal_r))
-        if np.dot(r, v) < 0:
-            ta = 2 * np.pi - ta
-    else:
-        ta = 0  # Edge case for circular orbit
+    # Edge cases: equatorial orbits have no node, circular orbits have no perigee
+    has_N = normal_N != 0
+    has_e = normal_e != 0
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Inclination
+        i = np.arccos(np.clip(h[:, 2] / normal_h, -1, 1))
+
+        # Ascending Node (Right Ascension of the Ascending Node, RAAN)
+        an = np.where(has_N, np.arccos(np.clip(N[:, 0] / normal_N, -1, 1)), 0.0)
+        an = np.where(has_N & (N[:, 1] < 0), 2 * np.pi - an, an)
+
+        # Argument of Perigee
+        N_dot_e = np.einsum('ij,ij->i', N, e)
+        aop = np.where(has_N & has_e, np.arccos(np.clip(N_dot_e / (normal_N * normal_e), -1, 1)), 0.0)
+        aop = np.where(has_N & has_e & (e[:, 2] < 0), 2 * np.pi - aop, aop)
+
+        # True Anomaly
+        e_dot_r = np.einsum('ij,ij->i', e, r)
+        ta = np.where(has_e, np.arccos(np.clip(e_dot_r / (normal_e * normal_r), -1, 1)), 0.0)
+        ta = np.where(has_e & (r_dot_v < 0), 2 * np.pi - ta, ta)
 
     # Semi-Major Axis using the vis-viva equation
     a = 1 / ((2 / normal_r) - (normal_v ** 2 / mu))
 
+    koe = np.column_stack((a, normal_e, i, ta, aop, an))
+
     # Convert angles to degrees if requested
     if degrees:
-        return [a, normal_e, np.rad2deg(i), np.rad2deg(ta), np.rad2deg(aop), np.rad2deg(an)]
-    else:
-        return [a, normal_e, i, ta, aop, an]
+        koe[:, 2:] = np.rad2deg(koe[:, 2:])
 
-# Koe to position and velocity
-def koe2rv(koe, cb=pd.Earth):
-    mu = cb['mu']
-    a, e, i, an, aop, ta = koe
+    return koe
+
+# KOE (N, 6) with rows [a, e, i, an, aop, ta] in degrees to position and velocity (N, 6)
+def koe2rv_array(koes, cb=pd.Earth):
+    koes = np.asarray(koes, dtype=float).reshape(-1, 6)
+    a, e, i, an, aop, ta = koes.T
+
+    return elements2rv(a, e, np.radians(i), np.radians(an), np.radians(aop), np.radians(ta), cb['mu'])
+
+# Eccentric anomaly from mean anomaly, solves Kepler's equation for arrays with Newton's method
+def solve_kepler(M, e, tol=1e-12, max_iter=50):
+    M = np.asarray(M, dtype=float)
+    E = np.where(e < 0.8, M, np.pi)  # Starting guess that converges for high eccentricity
+
+    for _ in range(max_iter):
+        dE = (E - e * np.sin(E) - M) / (1 - e * np.cos(E))
+        E = E - dE
+        if np.max(np.abs(dE), initial=0.0) < tol:
+            break
+
+    return E
 
-    # Convert angles from degrees to radians
-    i = np.radians(i)
-    an = np.radians(an)
-    aop = np.radians(aop)
-    ta = np.radians(ta)
+# Mean anomaly from true anomaly (radians, elliptic orbits)
+def true2mean(ta, e):
+    E = 2 * np.arctan2(np.sqrt(1 - e) * np.sin(ta / 2), np.sqrt(1 + e) * np.cos(ta / 2))
+    return E - e * np.sin(E)
 
-    # Compute radius in the perifocal frame
+# True anomaly from mean anomaly (radians, elliptic orbits)
+def mean2true(M, e):
+    E = solve_kepler(np.mod(M, 2 * np.pi), e)
+    return 2 * np.arctan2(np.sqrt(1 + e) * np.sin(E / 2), np.sqrt(1 - e) * np.cos(E / 2))
+
+# Position and velocity from elements in radians, every argument may be an array of epochs
+def elements2rv(a, e, i, an, aop, ta, mu):
+    a, e, i, an, aop, ta = np.broadcast_arrays(*map(np.atleast_1d, (a, e, i, an, aop, ta)))
+
+    # Position and velocity in perifocal coordinates, same as koe2rv
+    p = a * (1 - e ** 2)
+    cos_ta, sin_ta = np.cos(ta), np.sin(ta)
+    r_normal = p / (1 + e * cos_ta)
+    v_normal = np.sqrt(mu / p)
+
+    # Perifocal x and y axes in ECI, the first two columns of eci2perifocal (the z component is always zero)
+    cos_an, sin_an = np.cos(an), np.sin(an)
+    cos_aop, sin_aop = np.cos(aop), np.sin(aop)
+    cos_i, sin_i = np.cos(i), np.sin(i)
+    P = np.stack((cos_an * cos_aop - sin_an * sin_aop * cos_i,
+                  sin_an * cos_aop + cos_an * sin_aop * cos_i,
+                  sin_aop * sin_i), -1)
+    Q = np.stack((-cos_an * sin_aop - sin_an * cos_aop * cos_i,
+                  -sin_an * sin_aop + cos_an * cos_aop * cos_i,
+                  cos_aop * sin_i), -1)
+
+    states = np.empty((len(ta), 6))
+    states[:, :3] = (r_normal * cos_ta)[:, None] * P + (r_normal * sin_ta)[:, None] * Q
+    states[:, 3:] = (-v_normal * sin_ta)[:, None] * P + (v_normal * (e + cos_ta))[:, None] * Q
+
+    return states
+
+# Secular rates of RAAN, argument of perigee and mean anomaly [rad/s] due to J2
+def j2_secular_rates(a, e, i, cb=pd.Earth):
+    n = np.sqrt(cb['mu'] / a ** 3)
     p = a * (1 - e ** 2)
-    r_normal = p / (1 + e * np.cos(ta))
+    k = 0.75 * n * cb['J2'] * (cb['radius'] / p) ** 2
+    cos_i2 = np.cos(i) ** 2
+
+    an_dot = -2 * k * np.cos(i)
+    aop_dot = k * (5 * cos_i2 - 1)
+    M_dot = n + k * np.sqrt(1 - e ** 2) * (3 * cos_i2 - 1)
+
+    return an_dot, aop_dot, M_dot
+
+# States at times [s] after the KOE epoch with RAAN, argument of perigee and mean anomaly advancing at fixed rates
+def secular_propagate(koe, times, rates, cb=pd.Earth):
+    a, e, i, an, aop, ta = koe
+    i, an, aop, ta = np.radians([i, an, aop, ta])
+    an_dot, aop_dot, M_dot = rates
+    times = np.asarray(times, dtype=float).ravel()
+
+    M = true2mean(ta, e) + M_dot * times
+    return elements2rv(a, e, i, an + an_dot * times, aop + aop_dot * times, mean2true(M, e), cb['mu'])
+
+# States (N, n, 6) of N element sets at times [s] after their epoch, rates are per set (N,) or shared scalars
+def secular_propagate_array(koes, times, rates, cb=pd.Earth):
+    koes = np.asarray(koes, dtype=float).reshape(-1, 6)
+    times = np.asarray(times, dtype=float).ravel()[None, :]
 
-    # Position in perifocal coordinates
-    r_perifocal = r_normal * np.array([np.cos(ta), np.sin(ta), 0])
+    # Elements as (N, 1) columns so they broadcast against the (1, n) times
+    a, e = koes[:, :1], koes[:, 1:2]
+    i, an, aop, ta = np.radians(koes[:, 2:]).T[:, :, None]
+    an_dot, aop_dot, M_dot = (np.reshape(rate, (-1, 1)) for rate in rates)
 
-    # Velocity in perifocal coordinates
-    v_perifocal = np.sqrt(mu / p) * np.array([-np.sin(ta), e + np.cos(ta), 0])
+    M = true2mean(ta, e) + M_dot * times
+    elements = np.broadcast_arrays(a, e, i, an + an_dot * times, aop + aop_dot * times, mean2true(M, e))
 
-    # Coordinate transformation matrix from perifocal to ECI
-    perifocal2eci = np.transpose(eci2perifocal(an, aop, i))
+    return elements2rv(*(element.ravel() for element in elements), cb['mu']).reshape(len(koes), times.shape[1], 6)
 
-    # Position and velocity in ECI frame
-    r0 = np.dot(perifocal2eci, r_perifocal)
-    v0 = np.dot(perifocal2eci, v_perifocal)
+# Two-body position and velocity at times [s] after the KOE epoch, returns (n, 6) states
+def kepler_propagate(koe, times, cb=pd.Earth):
+    a = koe[0]
+    return secular_propagate(koe, times, (0.0, 0.0, np.sqrt(cb['mu'] / a ** 3)), cb)
 
-    return r0, v0
+# Mean-element J2 propagation, closed form states at times [s] after the KOE epoch
+def secular_j2_propagate(koe, times, cb=pd.Earth):
+    a, e, i = koe[0], koe[1], np.radians(koe[2])
+    return secular_propagate(koe, times, j2_secular_rates(a, e, i, cb), cb)
@@ -1,15 +1,19 @@
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QFormLayout, QLineEdit, \
-    QPushButton, QLabel, QDialog, QListWidget, QFrame, QComboBox, QCheckBox, QDoubleSpinBox
-from PyQt5.QtCore import Qt
+    QPushButton, QLabel, QDialog, QListWidget, QFrame, QComboBox, QCheckBox, QDoubleSpinBox, QProgressBar, \
+    QFileDialog
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
 from PyQt5.QtGui import QPixmap
+from multiprocessing import cpu_count
 from matplotlib import pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import sys
+import numpy as np
 import orbital_state as os
 import plotting as pt
 import spiceypy as spice
 import planet_data as pd
-from OrbitCode.plotting import plot_orbits
+import scheduler as sch
+import tle
 
 #Style
 STYLE = """
@@ -83,8 +87,44 @@ except Exception as e:
     https://naif.jpl.nasa.gov/pub/naif/generic_kernels/spk/planets/""")
     sys.exit(0)
 
-# Store all active orbits
-orbits = {}
+# Worker processes used to simulate orbits in parallel
+SIMULATION_WORKERS = max(cpu_count() - 1, 1)
+
+# Quiet time after the last parameter edit before the scenario is re-simulated [ms]
+EDIT_DEBOUNCE_MS = 300
+
+# Element sets further than this from the scenario window are extrapolated too far by SGP4 to be trusted [s]
+CATALOG_EPOCH_TOLERANCE = 3 * 86400
+
+# Store all active orbits, the scheduler simulates each one once per change
+orbits = sch.SimulationScheduler(SIMULATION_WORKERS)
+
+class SimulationSignals(QObject):
+    """Signals sent by a background simulation job, tagged with the job's generation"""
+    progress = pyqtSignal(int, int, int)  # generation, orbits done, orbits total
+    finished = pyqtSignal(int, object)  # generation, simulated orbits by name
+    failed = pyqtSignal(int, str)  # generation, error message
+
+class SimulationJob(QRunnable):
+    """Simulates prepared orbit copies in worker processes from a pool thread, stopping early once cancelled"""
+    def __init__(self, generation, jobs):
+        super().__init__()
+        self.generation = generation
+        self.jobs = jobs
+        self.cancelled = False
+        self.signals = SimulationSignals()
+
+    # Runs on the pool thread, results only reach the GUI through the finished signal
+    def run(self):
+        try:
+            orbits.simulate(self.jobs.values(),
+                            lambda done, total: self.signals.progress.emit(self.generation, done, total),
+                            lambda: self.cancelled, isolated=True)
+            if not self.cancelled:
+                self.signals.finished.emit(self.generation, self.jobs)
+        except Exception as e:
+            print(f" error: {e}")
+            self.signals.failed.emit(self.generation, str(e))
 
 class PlotDisplay2D(QWidget):
     """Control and display the 2D Plots (Groundtracks and Data)"""
@@ -97,7 +137,7 @@ class PlotDisplay2D(QWidget):
         self.drop_down.addItem("Ground Track")
         self.drop_down.addItem("Variable Graphs")
         self.drop_down.currentIndexChanged.connect(self.dropdown_change)
-        self.plot = Plot(self.main_window, pt.plot_groundtracks)
+        self.plot = Plot(self.main_window, pt.GroundTrackView())
 
         # No orbits so nothing to display
         self.drop_down.setDisabled(True)
@@ -112,11 +152,11 @@ class PlotDisplay2D(QWidget):
         index = self.drop_down.currentIndex()
 
         self.main_window.stop_animations()
-        self.main_window.update_3d_plot(pt.plot_orbits)
+        self.main_window.update_3d_plot()
         if index == 0:
-            self.main_window.update_2d_plot(pt.plot_groundtracks)
+            self.main_window.update_2d_plot()
         elif index == 1 and len(orbits) != 0:
-            self.main_window.update_2d_plot(pt.plot_state_space, state_space= True)
+            self.main_window.update_2d_plot(state_space=True)
 
 
 
@@ -251,12 +291,10 @@ class CreateOrbitDialog(QDialog):
             self.args['Cr'] = float(inputs[9])
 
             new_orbit = os.OrbitalState(list(map(float, inputs[1:7])), self.args | self.main_window.simulation_args())
-            new_orbit.propagate_orbit()
-            new_orbit.latlongs()
-            new_orbit.koe_propagation()
             orbits[orbit_name] = new_orbit
+            self.main_window.start_simulation()
 
-            # Update graphs and orbit list
+            # Update graphs and orbit list, the new orbit is drawn once its simulation finishes
             self.main_window.reset_gui()
             self.main_window.enable_dropdown(False)
             self.main_window.parameter_display.orbit_list.addItem(orbit_name)
@@ -301,15 +339,21 @@ class ParameterDisplay(QWidget):
         button_layout = QHBoxLayout()
         self.create_button = QPushButton("Create Orbit")
         self.delete_button = QPushButton("Delete Orbit")
+        self.load_button = QPushButton("Load Catalog")
         self.create_button.clicked.connect(self.create_orbit)
         self.delete_button.clicked.connect(self.delete_orbit)
+        self.load_button.clicked.connect(self.load_catalog)
         button_layout.addWidget(self.create_button)
         button_layout.addWidget(self.delete_button)
+        button_layout.addWidget(self.load_button)
 
         # Animation and Time Settings
         settings_layout = QFormLayout()
         self.animate_checkbox = QCheckBox("Animate")
         self.animate_checkbox.stateChanged.connect(self.on_animate)
+        self.startdate_input = QLineEdit("2020-01-01")
+        self.startdate_input.setToolTip("Scenario start, any UTC date SPICE can read")
+        self.startdate_input.editingFinished.connect(self.focus_lost)
         self.timespan_input = QDoubleSpinBox()
         self.timespan_input.setPrefix("Timespan (days): ")
         self.timespan_input.setRange(0.01, 365.0)
@@ -332,6 +376,12 @@ class ParameterDisplay(QWidget):
         self.lunar_checkbox = QCheckBox("Lunar Gravity")
         self.lunar_checkbox.stateChanged.connect(self.focus_lost)
 
+        # Propagator Settings
+        self.propagator_input = QComboBox()
+        self.propagator_input.addItem("Numerical", 'numerical')
+        self.propagator_input.addItem("Secular J2", 'secular_j2')
+        self.propagator_input.currentIndexChanged.connect(self.propagator_changed)
+
         # Layout
         settings_box = QHBoxLayout()
         settings_box.addWidget(self.animate_checkbox)
@@ -340,13 +390,20 @@ class ParameterDisplay(QWidget):
         settings_box.addWidget(self.lunar_checkbox)
 
         settings_layout.addRow(settings_box)
+        settings_layout.addRow("Start (UTC):", self.startdate_input)
         settings_layout.addRow(self.timespan_input)
         settings_layout.addRow(self.timestep_input)
+        settings_layout.addRow("Propagator:", self.propagator_input)
+
+        # Background simulation progress
+        self.progress_bar = QProgressBar()
+        self.progress_bar.hide()
 
         layout.addWidget(title)
         layout.addWidget(self.orbit_list)
         layout.addLayout(button_layout)
         layout.addLayout(settings_layout)
+        layout.addWidget(self.progress_bar)
 
         self.setLayout(layout)
 
@@ -358,11 +415,19 @@ class ParameterDisplay(QWidget):
                     'solar': False,
                     'lunar': False
                 },
+            'propagator': 'numerical',
 
             'startDate': '2020-01-01',  # J2000
             'tSpan': 86400,  # One Day
             'dt': 60.0,  # Every minute
         }
+        orbits.update_args(self.args)
+
+        # Parameter edits are coalesced, the scenario is re-simulated once edits stop for EDIT_DEBOUNCE_MS
+        self.edit_timer = QTimer(self)
+        self.edit_timer.setSingleShot(True)
+        self.edit_timer.setInterval(EDIT_DEBOUNCE_MS)
+        self.edit_timer.timeout.connect(self.apply_parameters)
 
     #currently selected item
     def current_item(self):
@@ -374,6 +439,57 @@ class ParameterDisplay(QWidget):
         orbit = CreateOrbitDialog(self.main_window)
         orbit.exec_()
 
+    # TLE, 3LE or OMM catalog loaded from a file, objects already in the simulation keep their current elements
+    def load_catalog(self):
+        self.main_window.stop_animations()
+        path, _ = QFileDialog.getOpenFileName(self, "Load Catalog", "",
+                                              "Element sets (*.tle *.3le *.txt *.json *.xml *.kvn *.csv);;All files (*)")
+        if not path:
+            return
+
+        try:
+            names, elements = tle.read_catalog(path)
+        except Exception as e:
+            print(f" error: {e}")
+            self.main_window.showAlert("Catalog could not be read.")
+            return
+
+        # Catalogs can list an object more than once, the first element set is used
+        rows = {}
+        for row, name in enumerate(names):
+            if name not in orbits and name not in rows:
+                rows[name] = row
+        if not rows:
+            self.main_window.showAlert("No new objects in catalog.")
+            return
+
+        orbits.add_elements(list(rows), elements[list(rows.values())])
+
+        # SGP4 states far from an element set's epoch are meaningless, so a scenario away from the catalog is moved
+        # to start at its median epoch
+        message = ""
+        median = np.median(elements[list(rows.values()), tle.EPOCH])
+        start = spice.utc2et(self.args['startDate'])
+        if median < start - CATALOG_EPOCH_TOLERANCE or median > start + self.args['tSpan'] + CATALOG_EPOCH_TOLERANCE:
+            self.args['startDate'] = spice.et2utc(median, 'ISOC', 0)
+            self.startdate_input.setText(self.args['startDate'])
+            orbits.update_args(self.args)
+            message = f"Scenario start moved to the catalog's median epoch, {self.args['startDate']}. "
+
+        self.main_window.catalog_added(rows)
+        message += self.distant_epochs_message()
+        if message:
+            self.main_window.showAlert(message.strip())
+
+    # Warning for element sets far outside the scenario window, empty when every epoch is close enough
+    def distant_epochs_message(self):
+        distant = orbits.catalog.distant_epochs(spice.utc2et(self.args['startDate']), self.args['tSpan'],
+                                                CATALOG_EPOCH_TOLERANCE)
+        if distant == 0:
+            return ""
+        return f"{distant} catalog objects have epochs more than {CATALOG_EPOCH_TOLERANCE / 86400:.0f} days " \
+               f"from the scenario, their states are extrapolated."
+
     # orbit removed from simulation
     def delete_orbit(self):
         item = self.orbit_list.currentRow()
@@ -385,8 +501,10 @@ class ParameterDisplay(QWidget):
 
     # Update simulations when the parameters are changed
     def focus_lost(self):
-        self.main_window.stop_animations()
+        self.edit_timer.start()  # Restarts the quiet period if it is already running
 
+    # Read every parameter once edits have settled, re-simulating only when the net change alters the args
+    def apply_parameters(self):
         # Validate input fields for timespan and timestep
         try:
             time_span_value = self.timespan_input.value()
@@ -397,6 +515,16 @@ class ParameterDisplay(QWidget):
             self.main_window.showAlert("Simulation parameters out of bounds.")
             return
 
+        # Validate the start date, SPICE parses it for every scenario
+        start_date = self.startdate_input.text().strip()
+        try:
+            spice.utc2et(start_date)
+        except Exception as e:
+            print(f" error: {e}")
+            self.main_window.showAlert("Start date not recognised.")
+            return
+        self.args['startDate'] = start_date
+
         # Update args dictionary
         if time_span_value != self.args['tSpan'] / (86400):  # Convert to days for comparison
             self.args['tSpan'] = time_span_value * 86400  # Convert days to seconds
@@ -408,28 +536,49 @@ class ParameterDisplay(QWidget):
         else:
             self.args['perturbations']['j2'] = False
 
-        if self.solar_checkbox.isChecked(): # Update Solar
+        if self.solar_checkbox.isChecked() and self.solar_checkbox.isEnabled(): # Update Solar
             self.args['perturbations']['solar'] = True
         else:
             self.args['perturbations']['solar'] = False
 
-        if self.lunar_checkbox.isChecked(): # Update Lunar
+        if self.lunar_checkbox.isChecked() and self.lunar_checkbox.isEnabled(): # Update Lunar
             self.args['perturbations']['lunar'] = True
         else:
             self.args['perturbations']['lunar'] = False
 
-        # Update plots with re-simulation
-        self.main_window.update_3d_plot(pt.plot_orbits, re_simulate=True)
-        self.main_window.update_2d_plot(pt.plot_groundtracks, re_simulate=True)
+        self.args['propagator'] = self.propagator_input.currentData() # Update propagation mode
 
-        # If "Variable Graphs" is selected in the dropdown, update state space plot
-        if len(orbits) != 0 and self.main_window.plot_display_2d.drop_down.currentIndex() == 1:
-            self.main_window.update_2d_plot(pt.plot_state_space, state_space=True)
+        # Re-simulate every orbit in the background, plots update when the results are swapped in
+        if orbits.update_args(self.args):
+            self.main_window.stop_animations()
+            self.main_window.start_simulation()
+
+            message = self.distant_epochs_message()
+            if message:
+                self.main_window.showAlert(message)
+
+    # The secular J2 propagator has no third body terms, their checkboxes are disabled while it is selected
+    def propagator_changed(self):
+        analytic = self.propagator_input.currentData() == 'secular_j2'
+        for checkbox in (self.solar_checkbox, self.lunar_checkbox):
+            checkbox.setDisabled(analytic)
+            checkbox.setToolTip("Not modelled by the Secular J2 propagator" if analytic else "")
+        self.focus_lost()
+
+    # Show simulation progress, a busy bar when only whole orbit steps are known
+    def show_progress(self, done, total):
+        self.progress_bar.setRange(0, total if total > 1 else 0)
+        self.progress_bar.setValue(done)
+        self.progress_bar.show()
+
+    # Hide the progress bar once a simulation is done
+    def hide_progress(self):
+        self.progress_bar.hide()
 
     # Handles responses to user clicking or unchecking the checkbox
     def on_animate(self, state):
         if self.animate_checkbox.isChecked():
-            if len(orbits.keys()) <= 0:
+            if len(pt.drawable(orbits.simulated())) <= 0:
                 self.main_window.showAlert("No orbits to animate")
                 self.animate_checkbox.setChecked(False)
                 return
@@ -442,12 +591,16 @@ class ParameterDisplay(QWidget):
 
 class Plot(QWidget):
     """Matplotlib canvas handler"""
-    def __init__(self, main_window, plotting_function):
+    def __init__(self, main_window, view):
         super().__init__()
         self.main_window = main_window
         self.setMinimumSize(610, 410)
-        self.plotting_function = plotting_function
-        self.canvas = PlotCanvas(self.plotting_function(orbits, args=self.main_window.simulation_args()))
+
+        # Persistent view, its canvas is kept while animations or other figures are shown in its place
+        self.view = view
+        self.view_canvas = PlotCanvas(self.view.fig)
+        self.canvas = self.view_canvas
+        self.view.update(orbits.simulated())
 
         # Create Layout
         self.layout = QVBoxLayout()
@@ -455,28 +608,42 @@ class Plot(QWidget):
         self.setLayout(self.layout)
         self.animation = None  # Placeholder for animation object
 
-    # Call the provided animation function to start the FuncAnimation
+    # Call the provided animation function to start its animation engine
     def start_animation(self, animation_function):
-        anim, fig = animation_function(orbits, False)
-        self.animation = anim
+        engine, fig = animation_function(orbits.simulated())
+        self.animation = engine
         self.change_plot(fig)
 
     # Stop animation
     def stop_animation(self):
         if self.animation:
-            self.animation.event_source.stop()
-
-    #Redraw the canvas
+            self.animation.stop()
+
+    # Show the persistent view and push the current orbits into its artists
+    def update_view(self):
+        if self.canvas is not self.view_canvas:
+            self.remove_canvas()
+            self.canvas = self.view_canvas
+            self.layout.addWidget(self.canvas)
+            self.canvas.show()
+        self.view.update(orbits.simulated())
+
+    # Show a one-off figure (animations, state space) in place of the view
     def change_plot(self, fig):
-        # Remove old canvas and clear previous animation if it exists
-        self.canvas.wipe()
-        plt.close(self.canvas.fig)
-        self.layout.removeWidget(self.canvas)
-
-        # Assign new canvas
+        self.remove_canvas()
         self.canvas = PlotCanvas(fig)
         self.layout.addWidget(self.canvas)
 
+    # Take the shown canvas out of the layout, one-off figures are closed and the view's canvas is kept
+    def remove_canvas(self):
+        self.layout.removeWidget(self.canvas)
+        if self.canvas is self.view_canvas:
+            self.canvas.hide()
+        else:
+            self.canvas.wipe()
+            plt.close(self.canvas.fig)
+            self.canvas.deleteLater()
+
 class PlotCanvas(FigureCanvas):
     """Matplotlib canvas object"""
     def __init__(self, fig, parent=None):
@@ -533,6 +700,11 @@ class MainWindow(QMainWindow):
         # Apply the stylesheet in MainWindow __init__
         self.setStyleSheet(STYLE)
 
+        # Background simulation, one job at a time, a new request waits for the cancelled one to stop first
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(1)
+        self.simulation_job = None
+
         # Create the central widget and Main layout
         central_widget = QWidget(self)
         self.setCentralWidget(central_widget)
@@ -558,7 +730,7 @@ class MainWindow(QMainWindow):
 
         # Create left display
         left_layout = QHBoxLayout()
-        self.plot_display_3d = Plot(self, plot_orbits)
+        self.plot_display_3d = Plot(self, pt.OrbitView())
         left_layout.addWidget(self.plot_display_3d)
 
         # Add layouts to the main layout
@@ -567,17 +739,72 @@ class MainWindow(QMainWindow):
         layout.addLayout(right_layout)
         main_layout.addLayout(layout)
 
-    # Update 2d plot
-    def update_2d_plot(self, plotting_function, re_simulate = False, state_space = False):
+    # Simulate every dirty orbit in the background, cancelling the job in progress
+    def start_simulation(self):
+        self.cancel_simulation()
+
+        generation, jobs = orbits.prepare()
+        job = SimulationJob(generation, jobs)
+        job.signals.progress.connect(self.simulation_progress)
+        job.signals.finished.connect(self.simulation_finished)
+        job.signals.failed.connect(self.simulation_failed)
+
+        self.simulation_job = job
+        self.parameter_display.show_progress(0, len(jobs))
+        self.thread_pool.start(job)
+
+    # List catalog objects just added to the scheduler and simulate them in the background with the other orbits
+    def catalog_added(self, names):
+        self.stop_animations()
+        self.parameter_display.orbit_list.addItems(list(names))
+        self.start_simulation()
+        self.reset_gui()
+        self.enable_dropdown(False)
+
+    # Cancel the running simulation and wait for its thread to return, it stops waiting on its workers at once
+    def cancel_simulation(self):
+        if self.simulation_job is not None:
+            self.simulation_job.cancelled = True
+            self.simulation_job = None
+            self.thread_pool.waitForDone()
+
+    # Progress of the current job, stale jobs are ignored
+    def simulation_progress(self, generation, done, total):
+        if self.simulation_job is not None and generation == self.simulation_job.generation:
+            self.parameter_display.show_progress(done, total)
+
+    # Swap the simulated orbits in and redraw, results of a stale job are dropped
+    def simulation_finished(self, generation, simulated):
+        if orbits.commit(generation, simulated):
+            self.simulation_job = None
+            self.parameter_display.hide_progress()
+            self.stop_animations()
+            self.update_3d_plot()
+            self.update_2d_plot()
+
+            # If "Variable Graphs" is selected in the dropdown, update state space plot
+            if self.plot_display_2d.drop_down.currentIndex() == 1 and self.parameter_display.current_item():
+                self.update_2d_plot(state_space=True)
+
+    # Report a failed simulation, the previous results stay on screen
+    def simulation_failed(self, generation, message):
+        if self.simulation_job is not None and generation == self.simulation_job.generation:
+            self.simulation_job = None
+            self.parameter_display.hide_progress()
+            self.showAlert(f"Simulation failed: {message}")
+
+    # Update 2d plot, ground tracks reuse their view, the state space of the selected orbit is a new figure
+    def update_2d_plot(self, state_space = False):
         if state_space:
             orbit = self.parameter_display.current_item().text()
-            self.plot_display_2d.plot.change_plot(plotting_function(orbits[orbit], re_simulate, self.simulation_args()))
+            if orbit in orbits.simulated():
+                self.plot_display_2d.plot.change_plot(pt.plot_state_space(orbits[orbit]))
         else:
-            self.plot_display_2d.plot.change_plot(plotting_function(orbits, re_simulate, self.simulation_args()))
+            self.plot_display_2d.plot.update_view()
 
     # Update 3d plot
-    def update_3d_plot(self, plotting_function, re_simulate = False):
-        self.plot_display_3d.change_plot(plotting_function(orbits, re_simulate, self.simulation_args()))
+    def update_3d_plot(self):
+        self.plot_display_3d.update_view()
 
     # Controls logic for changing UI when new orbit is selected
     def element_display_selected(self):
@@ -586,7 +813,7 @@ class MainWindow(QMainWindow):
             orbit_name = self.parameter_display.current_item().text()
             self.orbital_element_display.display_values(orbits[orbit_name])
             if self.plot_display_2d.drop_down.currentIndex() == 1:
-                self.update_2d_plot(pt.plot_state_space, state_space=True)
+                self.update_2d_plot(state_space=True)
         else:
             self.orbital_element_display.clear_values()
 
@@ -604,8 +831,8 @@ class MainWindow(QMainWindow):
     # Resets the dropdown to ground tracks and re-plots all plots in presses
     def reset_gui(self):
         if self.plot_display_2d.drop_down.currentIndex() == 0:
-            self.update_3d_plot(plot_orbits)
-            self.update_2d_plot(pt.plot_groundtracks)
+            self.update_3d_plot()
+            self.update_2d_plot()
         else:
             self.plot_display_2d.drop_down.setCurrentIndex(0)
 
@@ -627,4 +854,8 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
     main_window = MainWindow()
     main_window.show()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    main_window.cancel_simulation()
+    main_window.thread_pool.waitForDone()
+    orbits.shutdown()
+    sys.exit(exit_code)
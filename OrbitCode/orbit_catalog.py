@@ -0,0 +1,379 @@
+import copy
+import numpy as np
+from collections.abc import Mapping
+import frames as ft
+import orbital_state as orb
+import planet_data as pd
+import propagation_cache as pc
+import scenario as sc
+import sgp4_batch as sg
+import tle
+
+# Rows allocated the first time a catalog grows, capacity doubles after that
+CATALOG_MIN_CAPACITY = 64
+
+# Columns of the packed physical parameters
+MASS, ASRP, CR = range(3)
+
+# Element set rows propagated and rotated to J2000 at once
+SGP4_CATALOG_BLOCK = 1024
+
+# Per-object result channels with their number of columns
+CATALOG_CHANNELS = {'state': 6, 'latlong': 3, 'r_ecef': 3}
+
+
+class CatalogOrbit:
+    """Read-only view of one catalog object, shaped like an OrbitalState for the plotting functions"""
+    def __init__(self, catalog, name):
+        self.catalog = catalog
+        self.name = name
+
+    # Row of this object, looked up on every access because removals move rows
+    @property
+    def row(self):
+        return self.catalog.index[self.name]
+
+    @property
+    def koe(self):
+        return list(self.catalog.koe[self.row])
+
+    @property
+    def info(self):
+        return self.koe + list(self.catalog.params[self.row])
+
+    @property
+    def state(self):
+        return self.catalog.state[self.row]
+
+    @property
+    def latlong(self):
+        return self.catalog.latlong[self.row]
+
+    @property
+    def r_ecef(self):
+        return self.catalog.r_ecef[self.row]
+
+    @property
+    def koe_t(self):
+        return ft.rv2koe_array(self.state, self.catalog.args['centralBody']['mu'], self.catalog.args['degrees'])
+
+    @property
+    def t_steps(self):
+        return self.catalog.t_steps
+
+    @property
+    def et0(self):
+        return self.catalog.et0
+
+    @property
+    def step_n(self):
+        return self.catalog.step_n
+
+    @property
+    def args(self):
+        return self.catalog.args
+
+    # Hash identifying this object's results, for the decimation cache
+    def cache_key(self):
+        return pc.PropagationCache.key((self.catalog.config_key(), tuple(self.catalog.koe[self.row]),
+                                        tuple(self.catalog.params[self.row]), tuple(self.catalog.elements[self.row])))
+
+
+class OrbitCatalog(Mapping):
+    """Struct-of-arrays store of many orbits sharing one time grid and one set of third body ephemerides"""
+    def __init__(self, user_args = {}, capacity=0):
+
+        #Default Arguments
+        self.args = {
+            'perturbations' :
+                {
+                'j2' : False,
+                'solar' : False,
+                'lunar' : False
+                },
+            'centralBody' : pd.Earth,
+            'degrees' : True,
+            'propagator' : 'numerical', # 'numerical' or 'secular_j2', unperturbed catalogs are always closed form
+            'earthRotation' : 'spice', # 'spice', 'interpolated' or 'analytic'
+            'rtol' : 1e-10, # Integrator relative tolerance
+            'atol' : 1e-8, # Integrator absolute tolerance [km, km/s]
+
+            'startDate' : '2020-01-01', #J2000
+            'tSpan' : 86400, # One Day
+            'dt' : 60.0, # Every minute
+        }
+
+        # Object names by row and rows by name, rows [0, n) are live
+        self.names = []
+        self.index = {}
+        self.n = 0
+        self.capacity = 0
+
+        # Packed per-object columns
+        self.koe = np.zeros((0, 6))  # [a, e, i, an, aop, ta]
+        self.states0 = np.zeros((0, 6))
+        self.params = np.zeros((0, 3))  # [Mass, Asrp, Cr]
+        self.dirty = np.zeros(0, dtype=bool)  # Rows whose results are out of date
+        self.ready = np.zeros(0, dtype=bool)  # Rows holding results, possibly out of date ones
+        self.elements = np.zeros((0, tle.ELEMENT_COLUMNS))  # TLE/OMM mean elements of SGP4 rows
+        self.sgp4 = np.zeros(0, dtype=bool)  # Rows propagated from their element set with SGP4/SDP4
+        self.state = None  # Results, allocated for the grid by update_args
+
+        # Update default with passed args
+        self.update_args(user_args)
+        self.reserve(capacity)
+
+    # Mapping access by object name, values are read-only views of the packed rows
+    def __getitem__(self, name):
+        if name not in self.index:
+            raise KeyError(name)
+        return CatalogOrbit(self, name)
+
+    def __iter__(self):
+        return iter(list(self.names))
+
+    def __len__(self):
+        return self.n
+
+    # Update args, the shared time grid and ephemerides are rebuilt and every object needs propagating again
+    def update_args(self, user_args):
+        for key in self.args:
+            if user_args.get(key) is not None:
+                self.args[key] = user_args[key]
+
+        # Shared time grid, from the context of this time window
+        self.context = sc.get_context(self.args['startDate'], self.args['tSpan'], self.args['dt'])
+        self.span = self.context.span
+        self.step_n = self.context.step_n
+        self.t_steps = self.context.t_steps
+        self.et0 = self.context.et0
+
+        # Shared third body ephemerides, fitted once for the whole catalog
+        self.solor, self.lunar = self.context.third_body_ephemerides(self.args['perturbations'])
+
+        # Results for the new grid, the buffers and their old results are kept while the grid length is unchanged
+        if self.state is None or self.state.shape[1] != self.step_n:
+            self.state = np.full((self.capacity, self.step_n, 6), np.nan)
+            self.latlong = np.full((self.capacity, self.step_n, 3), np.nan)
+            self.r_ecef = np.full((self.capacity, self.step_n, 3), np.nan)
+            self.ready[:] = False
+        self.dirty[:] = True
+
+    # Everything the results depend on apart from each object's own elements and parameters
+    def config_key(self):
+        return (tuple(sorted(self.args['perturbations'].items())), self.args['propagator'],
+                self.args['centralBody']['name'], self.args['startDate'], self.span, self.args['dt'],
+                self.args['earthRotation'], self.args['rtol'], self.args['atol'])
+
+    # Grow every packed array to hold at least capacity rows, live rows are copied once per growth
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+
+        def grow(array, fill):
+            grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[:self.n] = array[:self.n]
+            return grown
+
+        self.koe = grow(self.koe, 0.0)
+        self.states0 = grow(self.states0, 0.0)
+        self.params = grow(self.params, 0.0)
+        self.dirty = grow(self.dirty, True)
+        self.ready = grow(self.ready, False)
+        self.elements = grow(self.elements, 0.0)
+        self.sgp4 = grow(self.sgp4, False)
+        self.state = grow(self.state, np.nan)
+        self.latlong = grow(self.latlong, np.nan)
+        self.r_ecef = grow(self.r_ecef, np.nan)
+        self.capacity = capacity
+
+    # Add objects from (k, 6) KOE [a, e, i, an, aop, ta] in degrees, with scalar or per-object Mass/Asrp/Cr
+    def add(self, names, koes, mass=0.1, asrp=10.0, cr=1.4):
+        names = [names] if isinstance(names, str) else list(names)
+        koes = np.asarray(koes, dtype=float).reshape(-1, 6)
+        if len(names) != len(koes):
+            raise ValueError("One name is needed for every KOE")
+        if len(set(names)) != len(names) or any(name in self.index for name in names):
+            raise ValueError("Catalog object names must be unique")
+
+        count = len(names)
+        if self.n + count > self.capacity:
+            self.reserve(max(self.n + count, 2 * self.capacity, CATALOG_MIN_CAPACITY))
+
+        rows = slice(self.n, self.n + count)
+        self.koe[rows] = koes
+        self.states0[rows] = ft.koe2rv_array(koes, self.args['centralBody'])
+        for column, value in ((MASS, mass), (ASRP, asrp), (CR, cr)):
+            self.params[rows, column] = value
+        self.dirty[rows] = True
+        self.ready[rows] = False
+        self.sgp4[rows] = False
+
+        for row, name in enumerate(names, self.n):
+            self.index[name] = row
+        self.names.extend(names)
+        self.n += count
+
+    # Add objects from a packed (k, tle.ELEMENT_COLUMNS) array of TLE/OMM mean elements, such as tle.read_catalog
+    # returns, they are propagated with SGP4/SDP4 and their KOE are the mean elements at each set's own epoch
+    def add_elements(self, names, elements):
+        elements = np.asarray(elements, dtype=float).reshape(-1, tle.ELEMENT_COLUMNS)
+        e = elements[:, tle.ECCO]
+        a = (sg.WGS72['mu'] / (elements[:, tle.NO_KOZAI] / 60) ** 2) ** (1 / 3)
+        ta = ft.mean2true(elements[:, tle.MO], e)
+        koes = np.column_stack((a, e, np.degrees(elements[:, [tle.INCLO, tle.NODEO, tle.ARGPO]]), np.degrees(ta)))
+
+        self.add(names, koes)
+        rows = slice(self.n - len(elements), self.n)
+        self.elements[rows] = elements
+        self.sgp4[rows] = True
+
+    # Remove an object, the last row moves into its place so nothing else is copied
+    def remove(self, name):
+        row = self.index.pop(name)
+        last = self.n - 1
+
+        if row != last:
+            for array in (self.koe, self.states0, self.params, self.dirty, self.ready, self.elements, self.sgp4,
+                          self.state, self.latlong, self.r_ecef):
+                array[row] = array[last]
+            moved = self.names[last]
+            self.names[row] = moved
+            self.index[moved] = row
+
+        self.names.pop()
+        self.n -= 1
+
+    # Propagate every out of date object in one batch, closed form when the dynamics allow it
+    # Element set rows use SGP4/SDP4, spread over the worker processes of a ParallelPropagator when one is given
+    def propagate(self, pool=None):
+        rows = np.nonzero(self.dirty[:self.n])[0]
+        if len(rows) == 0 or self.step_n == 0:
+            return
+
+        self.propagate_koes(rows[~self.sgp4[rows]])
+        self.propagate_elements(rows[self.sgp4[rows]], pool)
+
+        self.latlongs(rows)
+        self.dirty[rows] = False
+        self.ready[rows] = True
+
+    # Rows that need propagating
+    def pending(self):
+        return np.nonzero(self.dirty[:self.n])[0]
+
+    # Names of the objects holding results
+    def simulated(self):
+        return [self.names[row] for row in np.nonzero(self.ready[:self.n])[0]]
+
+    # Number of element set objects whose epoch lies more than tolerance [s] outside the window [et0, et0 + span]
+    def distant_epochs(self, et0, span, tolerance):
+        epochs = self.elements[:self.n][self.sgp4[:self.n], tle.EPOCH]
+        return int(np.count_nonzero((epochs < et0 - tolerance) | (epochs > et0 + span + tolerance)))
+
+    # Packed inputs of rows, enough to rebuild those objects in another catalog with add_columns
+    def columns(self, rows):
+        return {'names': [self.names[row] for row in rows], 'koe': self.koe[rows], 'params': self.params[rows],
+                'elements': self.elements[rows], 'sgp4': self.sgp4[rows]}
+
+    # Add the objects of columns taken from another catalog
+    def add_columns(self, columns):
+        params = columns['params']
+        self.add(columns['names'], columns['koe'], params[:, MASS], params[:, ASRP], params[:, CR])
+        rows = slice(self.n - len(columns['names']), self.n)
+        self.elements[rows] = columns['elements']
+        self.sgp4[rows] = columns['sgp4']
+
+    # Copy results propagated elsewhere into the rows of names, objects removed since are skipped
+    def store_results(self, names, results):
+        found = [(position, self.index[name]) for position, name in enumerate(names) if name in self.index]
+        if not found:
+            return
+        positions, rows = (np.array(column) for column in zip(*found))
+
+        for channel in CATALOG_CHANNELS:
+            getattr(self, channel)[rows] = results[channel][positions]
+        self.dirty[rows] = False
+        self.ready[rows] = True
+
+    # Propagate rows defined by their KOE
+    def propagate_koes(self, rows):
+        if len(rows) == 0:
+            return
+
+        cb = self.args['centralBody']
+        times = self.t_steps[:, 0]
+        koes = self.koe[rows]
+        a, e, i = koes[:, 0], koes[:, 1], np.radians(koes[:, 2])
+
+        # Secular J2 only drifts the elements when J2 is enabled, otherwise it is two-body motion
+        if self.args['propagator'] == 'secular_j2':
+            if self.args['perturbations']['solar'] or self.args['perturbations']['lunar']:
+                print(" error: secular_j2 propagator ignores solar and lunar perturbations")
+            rates = ft.j2_secular_rates(a, e, i, cb) if self.args['perturbations']['j2'] \
+                else (0.0, 0.0, np.sqrt(cb['mu'] / a ** 3))
+            self.state[rows] = ft.secular_propagate_array(koes, times, rates, cb)
+        elif not any(self.args['perturbations'].values()) and np.all(e < 1):
+            self.state[rows] = ft.secular_propagate_array(koes, times, (0.0, 0.0, np.sqrt(cb['mu'] / a ** 3)), cb)
+        else:
+            batch = orb.OrbitalBatch(self.states0[rows], self.params[rows, MASS], self.params[rows, ASRP],
+                                     self.params[rows, CR], dict(self.args, tSpan=self.span))
+            batch.propagate_orbit()
+            self.state[rows] = batch.state
+
+    # Propagate element set rows from each set's own epoch onto the shared grid, TEME states are rotated to J2000
+    def propagate_elements(self, rows, pool=None):
+        if len(rows) == 0:
+            return
+
+        et = self.context.et
+        if pool is not None:
+            def store(start, stop, states):
+                self.state[rows[start:stop]] = states
+            pool.propagate_elements(self.elements[rows], et, store)
+            return
+
+        batch = sg.SGP4Batch(self.elements[rows])
+        for start in range(0, len(rows), SGP4_CATALOG_BLOCK):
+            block = np.arange(start, min(start + SGP4_CATALOG_BLOCK, len(rows)))
+            self.state[rows[block]] = ft.teme2j2000(batch.states(et, block), et)
+
+    # Ground tracks of rows, every object shares the grid so one set of rotation matrices serves them all
+    def latlongs(self, rows):
+        matrices = self.context.rotation_matrices(self.args['earthRotation'])
+        for row in rows:
+            np.einsum('nij,nj->ni', matrices, self.state[row, :, :3], out=self.r_ecef[row])
+            ft.rec2lat(self.r_ecef[row], out=self.latlong[row])
+
+    # Read-only views of every live object's results, (n, step_n, 6) states and (n, step_n, 3) ground tracks
+    def results(self):
+        views = {'state': self.state[:self.n], 'latlong': self.latlong[:self.n], 't_steps': self.t_steps}
+        for view in views.values():
+            view.flags.writeable = False
+        return views
+
+
+class CatalogJob:
+    """Out of date objects of a catalog with the args to propagate them with, results are merged back by name"""
+    def __init__(self, args, columns):
+        self.args = args
+        self.columns = columns
+        self.step_n = sc.get_context(args['startDate'], args['tSpan'], args['dt']).step_n
+        self.results = None  # (k, step_n, width) arrays by channel once propagated
+
+    def __len__(self):
+        return len(self.columns['names'])
+
+    # Job for objects [start, stop) only
+    def slice(self, start, stop):
+        job = copy.copy(self)
+        job.columns = {name: column[start:stop] for name, column in self.columns.items()}
+        job.results = None
+        return job
+
+    # Propagate in this process
+    def simulate(self):
+        catalog = OrbitCatalog(self.args, capacity=len(self))
+        catalog.add_columns(self.columns)
+        catalog.propagate()
+        self.results = {channel: getattr(catalog, channel)[:catalog.n] for channel in CATALOG_CHANNELS}
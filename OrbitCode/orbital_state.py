@@ -1,10 +1,55 @@
 import numpy as np
-from scipy.integrate import ode
-import spiceypy as spice
-import spice_tools as s
+from scipy.integrate import solve_ivp
+import scenario as sc
+import propagation_cache as pc
+import trajectory_store as ts
 import planet_data as pd
 import frames as ft
 
+# Steps per chunk yielded by OrbitalState.propagate_chunks
+STREAM_CHUNK = 10000
+
+# Acceleration on positions r (..., 3) from central body gravity and the enabled perturbations
+# mass, asrp and cr must broadcast against r[..., :1] (scalars for one orbit, (N, 1) for a batch)
+def accelerations(r, args, mass, asrp, cr, r_sun, r_moon):
+    cb = args['centralBody']
+
+    # Newtons Law of Gravitation
+    normal_r = np.linalg.norm(r, axis=-1, keepdims=True)
+    a = -r * cb['mu'] / normal_r ** 3
+
+    # J2 Perturbation
+    if args['perturbations']['j2']:
+        z2 = r[..., 2:3] ** 2
+        r2 = normal_r ** 2
+        t = r / normal_r * (5 * z2 / r2 - np.array([1.0, 1.0, 3.0]))
+        a = a + 1.5 * cb['J2'] * cb['mu'] * cb['radius'] ** 2 / normal_r ** 4 * t
+
+    # Solar radiation pressure
+    if args['perturbations']['solar']:
+        # Vector from sun to satellite
+        r_sun_sat = r_sun + r
+        normal_sun_sat = np.linalg.norm(r_sun_sat, axis=-1, keepdims=True)
+
+        a = a + (1 + cr) * pd.Sun['G1'] * asrp / mass / normal_sun_sat ** 3 * r_sun_sat
+
+    # Lunar gravity
+    if args['perturbations']['lunar']:
+        # vector from satellite to moon
+        r_moon_sat = r_moon - r
+        normal_moon_sat = np.linalg.norm(r_moon_sat, axis=-1, keepdims=True)
+
+        a = a + pd.Moon['mu'] * (r_moon_sat / normal_moon_sat ** 3 - r_moon / np.linalg.norm(r_moon) ** 3)
+
+    return a
+
+
+# Third body positions at epoch et from the fitted ephemerides
+def third_body_positions(solar, lunar, et):
+    r_sun = solar.positions(et) if solar is not None else None
+    r_moon = lunar.positions(et) if lunar is not None else None
+    return r_sun, r_moon
+
 
 class OrbitalState:
     def __init__(self, koe, user_args = {}):
@@ -22,6 +67,12 @@ class OrbitalState:
             'Mass': 0.1, #kg
             'Asrp' : 10, #m^2
             'Cr': 1.4, #
+            'propagator' : 'numerical', # 'numerical' or 'secular_j2'
+            'earthRotation' : 'spice', # 'spice', 'interpolated' or 'analytic'
+            'storage' : 'memory', # 'memory', or 'disk' for memory-mapped results streamed to the trajectory store
+            'compact' : False, # Keep display only results (latlong, r_ecef) as float32 on disk
+            'rtol' : 1e-10, # Integrator relative tolerance
+            'atol' : 1e-8, # Integrator absolute tolerance [km, km/s]
 
             'startDate' : '2020-01-01', #J2000
             'tSpan' : 86400, # One Day
@@ -31,6 +82,12 @@ class OrbitalState:
         self.r0, self.v0 = ft.koe2rv(self.koe, self.args['centralBody'])
         self.step = 0
 
+        # Continuous solution kept between propagations, dense is the numerical one (picklable, unlike interpolant)
+        self.interpolant = None
+        self.interpolant_key = None
+        self.dense = None
+        self.t_end = 0.0
+
         # Update default with passed args
         self.update_args(user_args)
 
@@ -40,100 +97,350 @@ class OrbitalState:
             if user_args.get(key) is not None:
                 self.args[key] = user_args[key]
 
-        # Propagate Setup
-        self.step_n = int(self.args['tSpan'] / self.args['dt'])
-        self.t_steps = np.zeros((self.step_n, 1))
-        self.state = np.zeros((self.step_n, 6))
+        # Time window shared with every orbit simulated over the same start date, span and step
+        self.context = sc.get_context(self.args['startDate'], self.args['tSpan'], self.args['dt'])
 
-        # Convert to Epoch Time
-        self.et0 = spice.utc2et(self.args['startDate'])
-        self.args['tSpan'] = np.linspace(self.et0, self.et0 + self.args['tSpan'], self.step_n)
+        # Propagate Setup, result arrays are allocated by propagate_orbit, streamed runs never hold the full span
+        self.step_n = self.context.step_n
+        self.t_steps = None
+        self.state = None
 
-        # Get Central Body's location with respect to the sun for solar radiation pressure calculations
-        self.solor = s.get_ephemeris_states('EARTH', self.args['tSpan'], 'J2000', 'SUN')
+        # Convert to Epoch Time
+        self.span = self.context.span
+        self.et0 = self.context.et0
 
-        # Get Central Body's location with respect to the moon for solar radiation pressure calculations
-        self.lunar = s.get_ephemeris_states('MOON', self.args['tSpan'], 'J2000', 'EARTH')
+        # Continuous third body ephemerides from the context, only fitted when their perturbation is enabled
+        self.solor, self.lunar = self.context.third_body_ephemerides(self.args['perturbations'])
 
         # Orbit information
         self.info = self.koe + [self.args['Mass']] + [self.args['Asrp']] + [self.args['Cr']]
 
     # KOE with respect to time
     def koe_propagation(self):
-        self.koe_t = np.zeros((self.step_n, 6))
-        cb = self.args['centralBody']
-
-        for step in range(self.step_n):
-            if self.args['degrees']:
-                self.koe_t[step, :] = ft.rv2koe(self.state[step, :3], self.state[step, 3:6], cb['mu'], True)
-            else:
-                self.koe_t[step, :] = ft.rv2koe(self.state[step, :3], self.state[step, 3:6], cb['mu'])
+        self.koe_t = ft.rv2koe_array(self.state, self.args['centralBody']['mu'], self.args['degrees'])
 
     # Get LatLongs for ground map plotting
     def latlongs(self):
-        self.latlong, self.r_ecef = ft.ecef2latlong(self.state[:, :3], self.et0 + self.args['tSpan'])
+        matrices = self.context.rotation_matrices(self.args['earthRotation'])
+        self.r_ecef = np.einsum('nij,nj->ni', matrices, self.state[:, :3])
+        self.latlong = ft.rec2lat(self.r_ecef)
 
     # Differential Equation Governing Dynamics
     def two_body(self, t, s, mu):
         # unpack the state vector
-        rx, ry, rz, vx, vy, vz = s
-        r = np.array([rx, ry, rz])
+        r = s[:3]
+        r_sun, r_moon = third_body_positions(self.solor, self.lunar, self.et0 + t)
+        a = accelerations(r, self.args, self.args['Mass'], self.args['Asrp'], self.args['Cr'], r_sun, r_moon)
 
-        # Newtons Law of Gravitation
-        normal_r = np.linalg.norm(r)
-        a = -r * mu / normal_r ** 3
+        return [s[3], s[4], s[5], a[0], a[1], a[2]]
 
-        # J2 Perturbation
-        if self.args['perturbations']['j2']:
-            z2 = r[2] ** 2
-            r2 = normal_r ** 2
-            tx = r[0] / normal_r * (5 * z2 / r2 - 1)
-            ty = r[1] / normal_r * (5 * z2 / r2 - 1)
-            tz = r[2] / normal_r * (5 * z2 / r2 - 3)
-            j2 = (1.5 * self.args['centralBody']['J2'] * self.args['centralBody']['mu'] *
-                  self.args['centralBody']['radius'] ** 2 / normal_r ** 4 * np.array([tx, ty, tz]))
+    # True when no perturbation is enabled and the orbit is closed, so two-body motion is exact
+    def is_keplerian(self):
+        return not any(self.args['perturbations'].values()) and self.koe[1] < 1
 
-            a += j2
+    # Everything the continuous solution depends on, the output grid (dt, tSpan) is deliberately left out
+    def dynamics_key(self):
+        return (tuple(self.koe), self.args['Mass'], self.args['Asrp'], self.args['Cr'],
+                tuple(sorted(self.args['perturbations'].items())), self.args['propagator'],
+                self.args['centralBody']['name'], self.et0, self.args['rtol'], self.args['atol'])
 
-        # Solar radiation pressure
-        if self.args['perturbations']['solar']:
-            # Vector from sun to satellite
-            r_sun_sat = self.solor[self.step, :3] + r
+    # Build the continuous solution out to t_end seconds, closed form when possible, otherwise dense output
+    def build_interpolant(self, t_end):
+        cb = self.args['centralBody']
+        koe = list(self.koe)
+        self.interpolant_key = self.dynamics_key()
+        self.dense = None
 
-            a += (1 + self.args['Cr'])*pd.Sun['G1']*self.args['Asrp']/self.args['Mass']/np.linalg.norm(r_sun_sat)**3*r_sun_sat
+        # Mean-element propagation with only the secular J2 drift of RAAN, argument of perigee and mean anomaly,
+        # plain two-body motion when J2 is off, solar and lunar perturbations cannot be honoured in this mode
+        if self.args['propagator'] == 'secular_j2':
+            if self.args['perturbations']['solar'] or self.args['perturbations']['lunar']:
+                print(" error: secular_j2 propagator ignores solar and lunar perturbations")
+            if self.args['perturbations']['j2']:
+                self.interpolant = lambda times: ft.secular_j2_propagate(koe, times, cb)
+            else:
+                self.interpolant = lambda times: ft.kepler_propagate(koe, times, cb)
+            self.t_end = np.inf
+            return
 
-        # Solar radiation pressure
-        if self.args['perturbations']['lunar']:
-            # vector from earth to moon
-            r_moon_earth = self.lunar[self.step, :3]
+        # Analytic two-body propagation, solves Kepler's equation for every epoch at once
+        if self.is_keplerian():
+            self.interpolant = lambda times: ft.kepler_propagate(koe, times, cb)
+            self.t_end = np.inf
+            return
 
-            # vector from satellite to moon
-            r_moon_sat = r_moon_earth - r
+        # Adaptive integration that keeps its piecewise polynomial between steps
+        state0 = np.concatenate((self.r0, self.v0), axis=None)
+        self.interpolant = lambda times: np.tile(state0, (len(times), 1))
+        self.t_end = 0.0
+
+        if t_end <= 0:
+            return
+
+        try:
+            solution = solve_ivp(self.two_body, (0.0, t_end), state0, method='DOP853', dense_output=True,
+                                 rtol=self.args['rtol'], atol=self.args['atol'], args=(cb['mu'],))
+            if not solution.success:
+                print(f" error: {solution.message}")
+
+            self.adopt_dense_output((self.interpolant_key, solution.sol, solution.t[-1]))
+        except Exception as e:
+            print(f" error: {e}")
 
-            a += pd.Moon['mu'] * (r_moon_sat / np.linalg.norm(r_moon_sat) ** 3 - r_moon_earth / np.linalg.norm(r_moon_earth) ** 3)
+    # Numerical continuous solution as (dynamics key, OdeSolution, t_end), None when there is none to hand on
+    def dense_output(self):
+        if self.dense is None:
+            return None
+        return self.interpolant_key, self.dense, self.t_end
 
-        return [vx, vy, vz, a[0], a[1], a[2]]
+    # Take over another copy's numerical solution (from dense_output) if it was built for the same dynamics,
+    # so only a re-sample is needed when the output grid or display args changed
+    def adopt_dense_output(self, dense_output):
+        if dense_output is None:
+            return
+        key, dense, t_end = dense_output
+        if key != self.dynamics_key():
+            return
+
+        self.interpolant_key, self.dense, self.t_end = key, dense, t_end
+        self.interpolant = lambda times: dense(times).T
+
+    # Rebuild the continuous solution when the dynamics changed or it does not reach t_end
+    def ensure_interpolant(self, t_end):
+        if self.interpolant is None or self.interpolant_key != self.dynamics_key() or t_end > self.t_end:
+            self.build_interpolant(t_end)
+
+    # State at t seconds after the start epoch, evaluated without re-integrating
+    def state_at(self, t):
+        return self.states_at([t])[0]
+
+    # States (n, 6) at an array of times [s] after the start epoch, NaN outside the propagated span
+    def states_at(self, times):
+        self.ensure_interpolant(self.span if self.step_n > 1 else 0.0)
+
+        times = np.asarray(times, dtype=float).ravel()
+        states = np.full((len(times), 6), np.nan)
+        valid = (times >= 0) & (times <= self.t_end)
+        if valid.any():
+            states[valid] = self.interpolant(times[valid])
+
+        return states
 
     # Propagate the orbit through time, Defines orbital state
     def propagate_orbit(self):
+        self.t_steps = (np.arange(self.step_n) * self.args['dt']).reshape(-1, 1)
+        t_end = self.span if self.step_n > 1 else 0.0
 
-        # Set up state vector
-        state0 = np.concatenate((self.r0, self.v0), axis=None)
-        self.state[0] = state0  #set initial conditions
+        # Only integrate again when the dynamics changed or the span grew, otherwise re-sample the solution
+        self.ensure_interpolant(t_end)
 
-        self.step = 1  # set starting step
+        self.state = self.states_at(self.t_steps)
+        self.step = self.step_n
 
-        # set up ODE solver
-        solver = ode(self.two_body)
-        solver.set_integrator('dopri5')
-        solver.set_initial_value(state0, 0)
-        solver.set_f_params(self.args['centralBody']['mu'])
+    # Stream the propagation as (t (m,), state (m, 6)) chunks of at most chunk_size steps, nothing is stored on
+    # the orbit so memory is bounded by the chunk rather than the span
+    def propagate_chunks(self, chunk_size=STREAM_CHUNK):
+        cb = self.args['centralBody']
+        closed_form = self.args['propagator'] == 'secular_j2' or self.is_keplerian()
+        if closed_form:
+            self.ensure_interpolant(self.span)
 
-        try:
-            while solver.successful() and self.step < self.step_n:
-                solver.integrate(solver.t + self.args['dt'])
-                self.t_steps[self.step] = solver.t
-                self.state[self.step] = solver.y
-                self.step += 1
-        except Exception as e:
-            print(f" error: {e}")
+        state = np.concatenate((self.r0, self.v0), axis=None)
+        t_last = 0.0
+
+        for start in range(0, self.step_n, chunk_size):
+            t = np.arange(start, min(start + chunk_size, self.step_n)) * self.args['dt']
+
+            if closed_form:
+                yield t, self.interpolant(t)
+                continue
+
+            # Integrate on from the end of the previous chunk, the context's ephemerides are fitted once for the
+            # whole window and are only evaluated at this chunk's epochs
+            states = np.tile(state, (len(t), 1))
+            if t[-1] > t_last:
+                try:
+                    solution = solve_ivp(self.two_body, (t_last, t[-1]), state, method='DOP853', t_eval=t,
+                                         rtol=self.args['rtol'], atol=self.args['atol'], args=(cb['mu'],))
+                    if not solution.success:
+                        print(f" error: {solution.message}")
+                    states[:solution.y.shape[1]] = solution.y.T
+                except Exception as e:
+                    print(f" error: {e}")
+
+            state, t_last = states[-1], t[-1]
+            yield t, states
+
+    # Everything the simulation results depend on, including the output grid
+    def config_key(self):
+        return self.dynamics_key() + (self.args['startDate'], self.span, self.args['dt'], self.args['degrees'],
+                                      self.args['earthRotation'])
+
+    # Hash identifying this orbit's simulation results
+    def cache_key(self):
+        return pc.PropagationCache.key(self.config_key())
+
+    # Result arrays produced by simulate
+    def results(self):
+        return {'state': self.state, 't_steps': self.t_steps, 'latlong': self.latlong,
+                'r_ecef': self.r_ecef, 'koe_t': self.koe_t}
+
+    # Load result arrays computed elsewhere (the cache or a worker process)
+    def load_results(self, results):
+        for name, array in results.items():
+            setattr(self, name, array)
+        self.step = self.step_n
+
+    # Simulate chunk by chunk straight into a new trajectory store entry, only one chunk is ever held in memory
+    def simulate_to_disk(self, key):
+        compact = self.args['compact']
+        tmp_path, arrays = ts.store.create(key, self.step_n, compact)
+
+        for t, state in self.propagate_chunks():
+            step = int(round(t[0] / self.args['dt']))
+            rows = slice(step, step + len(t))
+
+            arrays['t_steps'][rows, 0] = t
+            arrays['state'][rows] = state
+            arrays['latlong'][rows], arrays['r_ecef'][rows] = ft.ecef2latlong(
+                state[:, :3], self.et0 + t, fidelity=self.args['earthRotation'])
+            arrays['koe_t'][rows] = ft.rv2koe_array(state, self.args['centralBody']['mu'], self.args['degrees'])
+
+        return ts.store.commit(key, tmp_path, arrays, compact)
+
+    # Propagate, compute ground tracks and KOE history, reusing cached results for a configuration seen before
+    def simulate(self):
+        key = self.cache_key()
+
+        # Disk backed results are mapped, not loaded, so reopening a stored configuration is instant
+        if self.args['storage'] == 'disk':
+            results = ts.store.open(key, self.args['compact'])
+            if results is None:
+                results = self.simulate_to_disk(key)
+            if results is not None:
+                self.load_results(results)
+                return
+            # Removed from the store before it could be mapped, the results are kept in memory instead
+
+        results = pc.cache.get(key)
+
+        if results is not None:
+            self.load_results(results)
+            return
+
+        self.propagate_orbit()
+        self.latlongs()
+        self.koe_propagation()
+        pc.cache.put(key, self.results())
+
+
+class OrbitalBatch:
+    """Propagates many orbits at once through a single vectorized right-hand side"""
+    def __init__(self, states0, mass, asrp, cr, user_args = {}):
+
+        #Default Arguments
+        self.args = {
+            'perturbations' :
+                {
+                'j2' : False,
+                'solar' : False,
+                'lunar' : False
+                },
+            'centralBody' : pd.Earth,
+            'rtol' : 1e-10, # Integrator relative tolerance
+            'atol' : 1e-8, # Integrator absolute tolerance [km, km/s]
+
+            'startDate' : '2020-01-01', #J2000
+            'tSpan' : 86400, # One Day
+            'dt' : 60.0, # Every minute
+        }
+
+        # (N, 6) initial states, one row per object
+        self.states0 = np.asarray(states0, dtype=float).reshape(-1, 6)
+        self.n = self.states0.shape[0]
+
+        # Per-object satellite information as (N, 1) columns so they broadcast against positions
+        self.mass = np.broadcast_to(np.asarray(mass, dtype=float), (self.n,)).reshape(-1, 1)
+        self.asrp = np.broadcast_to(np.asarray(asrp, dtype=float), (self.n,)).reshape(-1, 1)
+        self.cr = np.broadcast_to(np.asarray(cr, dtype=float), (self.n,)).reshape(-1, 1)
+        self.step = 0
+        self.interpolant = None
+        self.t_end = 0.0
+
+        # Update default with passed args
+        self.update_args(user_args)
+
+    # Build a batch from a list of KOE, with scalar or per-object Mass/Asrp/Cr
+    @classmethod
+    def from_koes(cls, koes, mass, asrp, cr, user_args = {}):
+        cb = user_args.get('centralBody') or pd.Earth
+        states0 = ft.koe2rv_array(koes, cb)
+        return cls(states0, mass, asrp, cr, user_args)
+
+    # Update args
+    def update_args(self, user_args):
+        for key in self.args:
+            if user_args.get(key) is not None:
+                self.args[key] = user_args[key]
+
+        # Time window shared with every orbit simulated over the same start date, span and step
+        self.context = sc.get_context(self.args['startDate'], self.args['tSpan'], self.args['dt'])
+
+        # Propagate Setup, result arrays are allocated by propagate_orbit
+        self.step_n = self.context.step_n
+        self.t_steps = None
+        self.state = None
+
+        # Convert to Epoch Time
+        self.span = self.context.span
+        self.et0 = self.context.et0
+
+        # Continuous third body ephemerides from the context, only fitted when their perturbation is enabled
+        self.solor, self.lunar = self.context.third_body_ephemerides(self.args['perturbations'])
+
+    # Differential Equation Governing Dynamics for every object, s is the flattened (N * 6) state
+    def two_body(self, t, s, mu):
+        y = s.reshape(self.n, 6)
+        r_sun, r_moon = third_body_positions(self.solor, self.lunar, self.et0 + t)
+        a = accelerations(y[:, :3], self.args, self.mass, self.asrp, self.cr, r_sun, r_moon)
+
+        return np.concatenate((y[:, 3:], a), axis=1).ravel()
+
+    # States (N, n, 6) of every object at an array of times [s] after the start epoch
+    def states_at(self, times):
+        if self.interpolant is None:
+            raise ValueError("Batch has not been propagated")
+
+        times = np.asarray(times, dtype=float).ravel()
+        states = np.full((self.n, len(times), 6), np.nan)
+        valid = (times >= 0) & (times <= self.t_end)
+        if valid.any():
+            states[:, valid] = self.interpolant(times[valid])
+
+        return states
+
+    # Propagate every orbit through time, fills state with shape (N, step_n, 6)
+    def propagate_orbit(self):
+        self.t_steps = (np.arange(self.step_n) * self.args['dt']).reshape(-1, 1)
+        t_end = self.span if self.step_n > 1 else 0.0
+
+        state0 = self.states0.ravel()
+        self.interpolant = lambda times: np.repeat(self.states0[:, None], len(times), axis=1)
+        self.t_end = 0.0
+
+        if self.n != 0 and t_end > 0:
+            try:
+                solution = solve_ivp(self.two_body, (0.0, t_end), state0, method='DOP853', dense_output=True,
+                                     rtol=self.args['rtol'], atol=self.args['atol'],
+                                     args=(self.args['centralBody']['mu'],))
+                if not solution.success:
+                    print(f" error: {solution.message}")
+
+                # The dense output is (N * 6, n), regroup it per object
+                self.interpolant = lambda times: solution.sol(times).reshape(self.n, 6, -1).transpose(0, 2, 1)
+                self.t_end = solution.t[-1]
+            except Exception as e:
+                print(f" error: {e}")
+
+        self.state = self.states_at(self.t_steps)
+        self.step = self.step_n
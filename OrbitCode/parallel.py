@@ -0,0 +1,279 @@
+import numpy as np
+import spiceypy as spice
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+import orbital_state as orb
+import orbit_catalog as oc
+import sgp4_batch as sg
+import frames as ft
+import propagation_cache as pc
+import trajectory_store as ts
+
+# How often a wait for a worker checks whether the simulation was cancelled [s]
+CANCEL_POLL = 0.05
+
+# Numerical solutions each worker keeps between jobs, keyed by OrbitalState.dynamics_key
+WORKER_SOLUTIONS = 8
+worker_solutions = OrderedDict()
+
+# Result arrays written back by a worker, with their number of columns
+RESULT_FIELDS = (('state', 6), ('t_steps', 1), ('latlong', 3), ('r_ecef', 3), ('koe_t', 6))
+
+
+# Size in bytes of the shared block holding one orbit's results
+def result_nbytes(step_n):
+    return step_n * sum(width for _, width in RESULT_FIELDS) * np.dtype(np.float64).itemsize
+
+
+# Views of every result array laid out back to back in a shared memory buffer
+def result_views(buffer, step_n):
+    views = {}
+    offset = 0
+    for name, width in RESULT_FIELDS:
+        views[name] = np.ndarray((step_n, width), dtype=np.float64, buffer=buffer, offset=offset)
+        offset += step_n * width * np.dtype(np.float64).itemsize
+    return views
+
+
+# Copy an orbit's results into a shared block (the views must be gone before the block is closed)
+def write_results(shm, orbit):
+    for name, view in result_views(shm.buf, orbit.step_n).items():
+        view[:] = getattr(orbit, name)
+
+
+# Copy an orbit's results out of a shared block
+def read_results(shm, step_n):
+    return {name: view.copy() for name, view in result_views(shm.buf, step_n).items()}
+
+
+# Size in bytes of the shared block holding the results of total catalog objects
+def catalog_nbytes(total, step_n):
+    return total * step_n * sum(oc.CATALOG_CHANNELS.values()) * np.dtype(np.float64).itemsize
+
+
+# Views (total, step_n, width) of every catalog result channel laid out back to back in a shared memory buffer
+def catalog_views(buffer, total, step_n):
+    views = {}
+    offset = 0
+    for name, width in oc.CATALOG_CHANNELS.items():
+        views[name] = np.ndarray((total, step_n, width), dtype=np.float64, buffer=buffer, offset=offset)
+        offset += total * step_n * width * np.dtype(np.float64).itemsize
+    return views
+
+
+# Runs once in every worker, SPICE is not thread-safe so each process keeps its own kernel pool
+def init_worker(kernel):
+    spice.kclear()
+    spice.furnsh(kernel)
+
+
+# Simulate one orbit in a worker and write the results into the shared block named shm_name
+# Disk backed orbits pass no block, their results are already in the trajectory store
+# The numerical solution stays in the worker, a later job with the same dynamics landing here only re-samples it
+def simulate_worker(koe, args, shm_name):
+    orbit = orb.OrbitalState(koe, args)
+    key = orbit.dynamics_key()
+    orbit.adopt_dense_output(worker_solutions.get(key))
+    orbit.simulate()
+
+    solution = orbit.dense_output()
+    if solution is not None:
+        worker_solutions[key] = solution
+        worker_solutions.move_to_end(key)
+        if len(worker_solutions) > WORKER_SOLUTIONS:
+            worker_solutions.popitem(last=False)
+
+    if shm_name is not None:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            write_results(shm, orbit)
+        finally:
+            shm.close()
+
+    return orbit.step_n
+
+
+# Propagate the objects of a catalog job slice in a worker, writing them into rows [start, start + k) of the block
+def catalog_worker(job, shm_name, start, total):
+    job.simulate()
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        for name, view in catalog_views(shm.buf, total, job.step_n).items():
+            view[start:start + len(job)] = job.results[name]
+        del view
+    finally:
+        shm.close()
+
+    return len(job)
+
+
+# Evaluate SGP4 for element sets [start, stop) of a catalog in a worker, their TEME states are rotated to J2000
+# block by block straight into the shared block
+def sgp4_worker(elements, et, shm_name, start, stop, total):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        states = np.ndarray((total, len(et), 6), dtype=np.float64, buffer=shm.buf)
+        batch = sg.SGP4Batch(elements)
+        for first in range(0, stop - start, oc.SGP4_CATALOG_BLOCK):
+            block = np.arange(first, min(first + oc.SGP4_CATALOG_BLOCK, stop - start))
+            states[start + block] = ft.teme2j2000(batch.states(et, block), et)
+        del states
+    finally:
+        shm.close()
+
+    return stop - start
+
+
+class ParallelPropagator:
+    """Simulates independent orbits across a pool of worker processes"""
+    def __init__(self, workers, kernel='kernal.mk'):
+        self.workers = workers
+        self.kernel = kernel
+        self.executor = None
+
+    # Start the worker pool on first use, spawned so workers never inherit Qt or SPICE state
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context('spawn'),
+                                                initializer=init_worker, initargs=(self.kernel,))
+
+    # Stop the worker pool
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    # Wait for a worker's future, False as soon as cancelled() returns True, the worker then finishes on its own
+    @staticmethod
+    def wait(future, cancelled=None):
+        if cancelled is not None:
+            while not future.done():
+                if cancelled():
+                    future.cancel()
+                    return False
+                wait([future], timeout=CANCEL_POLL)
+        return True
+
+    # Start simulating an orbit in a worker, returns the shared block its results are written to (None when they
+    # go to the trajectory store) and the worker's future
+    def submit(self, orbit, disk):
+        # Workers get plain arguments and the name of a block sized for their results
+        shm = None if disk else shared_memory.SharedMemory(create=True, size=max(result_nbytes(orbit.step_n), 1))
+        args = dict(orbit.args, tSpan=orbit.span, storage='disk' if disk else 'memory')
+        future = self.executor.submit(simulate_worker, list(orbit.koe), args, shm.name if shm else None)
+        return shm, future
+
+    # Simulate every orbit (already set up with update_args), cached configurations never leave this process
+    # progress(done, total) is called as orbits finish, unstarted orbits are cancelled once cancelled() returns True
+    def simulate(self, orbits, progress=None, cancelled=None):
+        self.start()
+        done = 0
+
+        jobs = []
+        for orbit in orbits:
+            key = orbit.cache_key()
+            disk = orbit.args['storage'] == 'disk'
+            results = ts.store.open(key, orbit.args['compact']) if disk else pc.cache.get(key)
+            if results is not None:
+                orbit.load_results(results)
+                done += 1
+                if progress is not None:
+                    progress(done, len(orbits))
+                continue
+
+            shm, future = self.submit(orbit, disk)
+            jobs.append((orbit, key, shm, future))
+
+        for orbit, key, shm, future in jobs:
+            try:
+                if not self.wait(future, cancelled):
+                    continue
+
+                step_n = future.result()
+                if shm is None:
+                    results = ts.store.open(key, orbit.args['compact'])
+                    if results is None:
+                        # Removed from the store before it could be mapped, simulate again into shared memory
+                        shm, future = self.submit(orbit, disk=False)
+                        if not self.wait(future, cancelled):
+                            continue
+                        results = read_results(shm, future.result())
+                    orbit.load_results(results)
+                else:
+                    results = read_results(shm, step_n)
+                    orbit.load_results(results)
+                    pc.cache.put(key, results)
+
+                done += 1
+                if progress is not None:
+                    progress(done, len(orbits))
+            except BrokenProcessPool as e:
+                print(f" error: {e}")
+                self.shutdown()
+            except Exception as e:
+                print(f" error: {e}")
+            finally:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+
+    # Propagate a catalog job, its objects are split evenly over the workers (each slice is one vectorized batch)
+    # Results stay None when cancelled() returns True first
+    def simulate_catalog(self, job, cancelled=None):
+        self.start()
+        total = len(job)
+        shm = shared_memory.SharedMemory(create=True, size=max(catalog_nbytes(total, job.step_n), 1))
+
+        try:
+            size = max(-(-total // self.workers), 1)
+            futures = [self.executor.submit(catalog_worker, job.slice(start, start + size), shm.name, start, total)
+                       for start in range(0, total, size)]
+            for future in futures:
+                if not self.wait(future, cancelled):
+                    for rest in futures:
+                        rest.cancel()
+                    return
+                future.result()
+
+            job.results = {name: view.copy() for name, view in catalog_views(shm.buf, total, job.step_n).items()}
+        except BrokenProcessPool as e:
+            print(f" error: {e}")
+            self.shutdown()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    # J2000 states of a packed (N, tle.ELEMENT_COLUMNS) element array at ET epochs, workers write them into one shared
+    # block and store(start, stop, states) is handed each slice of objects in place as it finishes (states is only
+    # valid during the call). Objects are split into a few slices per worker so the pool stays busy when deep-space
+    # slices run slower
+    def propagate_elements(self, elements, et, store):
+        self.start()
+        et = np.asarray(et, dtype=float).ravel()
+        total = len(elements)
+        shm = shared_memory.SharedMemory(create=True, size=max(total * len(et) * 6 * np.dtype(np.float64).itemsize, 1))
+
+        try:
+            size = max(-(-total // (4 * self.workers)), 1)
+            futures = [(start, min(start + size, total),
+                        self.executor.submit(sgp4_worker, elements[start:start + size], et, shm.name, start,
+                                             min(start + size, total), total))
+                       for start in range(0, total, size)]
+
+            states = np.ndarray((total, len(et), 6), dtype=np.float64, buffer=shm.buf)
+            try:
+                for start, stop, future in futures:
+                    future.result()
+                    store(start, stop, states[start:stop])
+            finally:
+                del states
+        except BrokenProcessPool as e:
+            print(f" error: {e}")
+            self.shutdown()
+            store(0, total, np.full((total, len(et), 6), np.nan))
+        finally:
+            shm.close()
+            shm.unlink()
@@ -37,6 +37,8 @@ Earth = {
     'name': 'Earth',
     'mass': 5.972e24,  # in kg
     'radius': 6371.0,  # in kilometers
+    'equatorial_radius': 6378.137,  # WGS84 semi-major axis in kilometers
+    'flattening': 1 / 298.257223563,  # WGS84 flattening
     'distance_from_sun': 149.6e6,  # in kilometers
     'orbital_period': 365.25 * 24 * 3600,  # in seconds (1 Earth year)
     'mu': G * 5.972e24,  # gravitational parameter in km^3/s^2
@@ -1,15 +1,28 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib import animation
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
 import frames as ft
 import planet_data as pd
+import coastlines as cl
+import animation_engine as ae
+import decimation as dc
+
+# Scenarios with more orbits than this get one aggregated legend entry
+LEGEND_LIMIT = 10
+
+# Most orbits a view or animation draws, larger scenarios (catalogs) show an evenly spread sample so redraws stay
+# interactive
+PLOT_LIMIT = 250
 
 # Plots a central body in a 3d plot
 def plot_central_body(ax, user_args = {}):
     args = {
         'centralBody' : pd.Earth,
         'tSpan' : [631108869.1839073],
-        'map' : True
+        'map' : True,
+        'detail' : 0 # Coastline level of detail, every 2^detail-th point
     }
 
     for key in args:
@@ -30,14 +43,7 @@ def plot_central_body(ax, user_args = {}):
 
     # Plot coastlines on body
     if args['map']:
-        coastline_latlong = np.genfromtxt('Spice/coastlines.csv', delimiter=',')
-        coastline_latlong = coastline_latlong[:, [1, 0]]  # Now columns are [Latitude, Longitude]
-        n = len(coastline_latlong)
-        states = np.full(n, args['centralBody']['radius'])
-
-        # Create r_states with columns [Latitude, Longitude, Radius]
-        r_states = np.column_stack((coastline_latlong[:, 0], coastline_latlong[:, 1], states))
-        ecef_states = ft.latlong2ecef(r_states)
+        ecef_states = cl.ecef(args['detail'], args['centralBody']['radius'])
 
         # Use the appropriate time
         current_time = args['tSpan'][0]  # Or another time if desired
@@ -48,78 +54,153 @@ def plot_central_body(ax, user_args = {}):
 
         return coastlines
 
-# Returns a groundtrack plot of a list of orbits
-def plot_groundtracks(orbits, reSimulate = False, args = {}):
-    plt.style.use('dark_background')
-    fig = plt.figure(figsize=(8, 4))
-    ax = fig.add_subplot()
-
-    ax.set_title('Ground Tracks')
-    ax.set_xlabel('Longitude [Deg]')
-    ax.set_ylabel('Latitude [Deg]')
-
-    tracks = []
-    for key in orbits:
-        if reSimulate:
-            orbits[key].update_args(args)
-            orbits[key].propagate_orbit() # Simulate new parameters
-            orbits[key].latlongs() # Simulate tracks
-        tracks.append(orbits[key].latlong)
-    tracks = np.array(tracks)
+# Pack variable length paths into one array, rows offsets[k]:offsets[k + 1] belong to path k
+def pack_paths(paths, width=3):
+    paths = [np.asarray(path)[:, :width] for path in paths]
+    offsets = np.zeros(len(paths) + 1, dtype=int)
+    np.cumsum([len(path) for path in paths], out=offsets[1:])
+    packed = np.concatenate(paths) if paths else np.zeros((0, width))
+    return packed, offsets
+
+# Views of the first stops[k] rows of every packed path, all rows when stops is None
+def packed_segments(packed, offsets, stops=None):
+    starts = offsets[:-1]
+    ends = offsets[1:] if stops is None else starts + np.minimum(stops, offsets[1:] - starts)
+    return [packed[start:end] for start, end in zip(starts, ends)]
+
+# Orbits to draw, at most limit of them spread evenly through the scenario, SGP4 rows of objects that decayed or
+# failed are NaN and never drawn
+def drawable(orbits, limit=PLOT_LIMIT):
+    keys = list(orbits)
+    if limit is not None and len(keys) > limit:
+        keys = [keys[index] for index in np.linspace(0, len(keys) - 1, limit).astype(int)]
+    return {key: orbits[key] for key in keys if np.isfinite(orbits[key].state[:, 0]).any()}
+
+# Largest absolute position coordinate of orbits for the axis limits, NaN steps are skipped
+def position_extent(orbits):
+    return max((np.nanmax(np.abs(orbits[key].state[:, :3])) for key in orbits), default=pd.Earth['radius'])
+
+# One color per orbit from the current style's color cycle
+def orbit_colors(count):
+    cycle = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    return [cycle[k % len(cycle)] for k in range(count)]
+
+# Legend for collection drawn orbits, one entry per orbit or one aggregated entry for large scenarios
+# total is the scenario's number of orbits when only a sample of them is drawn
+def orbit_legend(ax, names, colors, total=None):
+    if len(names) == 0:
+        return None
+    if len(names) <= LEGEND_LIMIT:
+        handles = [Line2D([], [], color=color, label=name) for name, color in zip(names, colors)]
+        return ax.legend(handles=handles)
+
+    # A fixed corner, 'best' placement scans every drawn point on each redraw
+    label = f"{len(names)} orbits" if total is None or total <= len(names) else f"{len(names)} of {total} orbits"
+    handles = [Line2D([], [], color=colors[0], label=label)]
+    return ax.legend(handles=handles, loc='upper right')
+
+class GroundTrackView:
+    """Ground track map whose axes and coastlines are built once, updates only replace the track data"""
+    def __init__(self, budget=None):
+        self.budget = budget  # Points shared by every drawn orbit, None sizes it from the axes on each update
+
+        plt.style.use('dark_background')
+        self.fig = plt.figure(figsize=(8, 4))
+        self.ax = self.fig.add_subplot()
+
+        self.ax.set_title('Ground Tracks')
+        self.ax.set_xlabel('Longitude [Deg]')
+        self.ax.set_ylabel('Latitude [Deg]')
+
+        # [point, [log, lat]]
+        coastline_longlat = cl.longlat()
+        self.ax.plot(coastline_longlat[:, 0], coastline_longlat[:, 1], 'mo', markersize=0.3)
+
+        self.tracks = LineCollection([], lw=0.8)
+        self.ax.add_collection(self.tracks)
+        self.legend = None
+
+    # Replace the drawn tracks with those of orbits and schedule a redraw
+    def update(self, orbits):
+        total = len(orbits)
+        orbits = drawable(orbits)
+
+        # Decimated tracks broken where they wrap at +-180 deg, drawn as one collection of [long, lat] paths, orbits
+        # sharing a time grid are decimated together
+        per_orbit = max((self.budget or dc.view_budget(self.ax)) // max(len(orbits), 1), dc.MIN_BUDGET)
+        decimated = dc.decimated_orbits([orbits[key] for key in orbits], 'latlong', per_orbit)
+        tracks, offsets = pack_paths([track[:, ::-1] for track in decimated], 2)
+        colors = orbit_colors(len(orbits))
+        self.tracks.set_segments(packed_segments(tracks, offsets))
+        self.tracks.set_color(colors)
+
+        if self.legend is not None:
+            self.legend.remove()
+        self.legend = orbit_legend(self.ax, list(orbits), colors, total)
+
+        self.fig.canvas.draw_idle()
+
+class OrbitView:
+    """3D trajectory view whose axes, central body and coastlines are built once, updates only replace the trajectories"""
+    def __init__(self, budget=None):
+        self.budget = budget  # Points shared by every drawn orbit, None sizes it from the axes on each update
+
+        plt.style.use('dark_background')
+        self.fig = plt.figure(figsize=(8, 8))
+        self.ax = self.fig.add_subplot(111, projection='3d')
+
+        # Set Graph Parameters
+        self.ax.set_xlabel('X [km]')
+        self.ax.set_ylabel('Y [km]')
+        self.ax.set_zlabel('Z [km]')
+        self.ax.set_aspect('equal')
+        self.ax.set_title('Orbital Trajectory\'s')
+
+        #Plot Earth
+        plot_central_body(self.ax)
+
+        self.trajectories = Line3DCollection([], lw=2, zorder=100)
+        self.ax.add_collection(self.trajectories)
+        self.legend = None
+
+    # Replace the drawn trajectories with those of orbits and schedule a redraw
+    def update(self, orbits):
+        total = len(orbits)
+        orbits = drawable(orbits)
+
+        # Find max value of positions, the full propagation is only used for the axis limits
+        max_val = position_extent(orbits)
+        self.ax.set_xlim(-max_val, max_val)
+        self.ax.set_ylim(-max_val, max_val)
+        self.ax.set_zlim(-max_val, max_val)
+
+        # Decimated trajectories drawn as one collection, orbits sharing a time grid are decimated together
+        per_orbit = max((self.budget or dc.view_budget(self.ax)) // max(len(orbits), 1), dc.MIN_BUDGET)
+        trajectory, offsets = pack_paths(dc.decimated_orbits([orbits[key] for key in orbits], 'state', per_orbit))
+        colors = orbit_colors(len(orbits))
+        self.trajectories.set_segments(packed_segments(trajectory, offsets))
+        self.trajectories.set_color(colors)
+
+        if self.legend is not None:
+            self.legend.remove()
+        self.legend = orbit_legend(self.ax, list(orbits), colors, total)
+
+        self.fig.canvas.draw_idle()
 
-    # [point, [log, lat]]
-    coastline_latlong = np.genfromtxt('Spice/coastlines.csv', delimiter=',')
-    ax.plot(coastline_latlong[:, 0], coastline_latlong[:, 1], 'mo', markersize=0.3)
-
-    for track, key in zip(tracks, orbits.keys()):
-        path, = ax.plot(track[:, 1], track[:, 0], 'o', markersize=0.5)
-        path.set_label(key)
-    ax.legend()
-
-    return fig
+# Returns a groundtrack plot of a list of orbits
+def plot_groundtracks(orbits, budget=None):
+    view = GroundTrackView(budget)
+    view.update(orbits)
+    return view.fig
 
 # Returns a plot of a list of orbits
-def plot_orbits(orbits, reSimulate = False, args = {}):
-    plt.style.use('dark_background')
-    fig = plt.figure(figsize=(8, 8))
-    ax = fig.add_subplot(111, projection='3d')
-
-    # Set Graph Parameters
-    ax.set_xlabel('X [km]')
-    ax.set_ylabel('Y [km]')
-    ax.set_zlabel('Z [km]')
-    ax.set_aspect('equal')
-    ax.set_title('Orbital Trajectory\'s')
-
-    #Plot Earth
-    plot_central_body(ax)
-
-    #Propgate Orbits
-    trajectory = []
-    for key in orbits:
-        if reSimulate:
-            orbits[key].update_args(args)
-            orbits[key].propagate_orbit() # simulate new parameters
-        trajectory.append(orbits[key].state)
-    trajectory = np.array(trajectory)
-
-    if len(orbits) >= 1:
-        # Find max value of positions
-        max_val = np.max(np.abs(trajectory[:,:,:3]))
-        ax.set_xlim(-max_val, max_val)
-        ax.set_ylim(-max_val, max_val)
-        ax.set_zlim(-max_val, max_val)
-
-
-        for key, traj in zip(orbits.keys(), trajectory):
-            traj, = ax.plot(traj[:,0], traj[:,1], traj[:,2], lw=2, zorder=100)
-            traj.set_label(key)
-        ax.legend()
-
-    return fig
+def plot_orbits(orbits, budget=None):
+    view = OrbitView(budget)
+    view.update(orbits)
+    return view.fig
 
 # Returns the KOE over time for a orbit
-def plot_vars(orbit, reSimulate = False, args = {}, title='Kepler\'s Elements'):
+def plot_vars(orbit, title='Kepler\'s Elements'):
     fig, axs = plt.subplots(nrows=2, ncols=3, figsize=(10, 5))
     fig.suptitle(title)
     width = 0.8
@@ -131,40 +212,37 @@ def plot_vars(orbit, reSimulate = False, args = {}, title='Kepler\'s Elements'):
         ax.set_title('', fontsize=size_font)
 
     # [a, normal_e, i, ta, aop, an]
-    orbit.t_steps /= 3600 # per hour
-
-    if reSimulate:
-        orbit.koe_propagation()
+    t_hours = orbit.t_steps / 3600 # per hour
 
     # plot true anomaly
-    axs[0, 0].plot(orbit.t_steps, orbit.koe_t[:, 3], lw=width)
+    axs[0, 0].plot(t_hours, orbit.koe_t[:, 3], lw=width)
     axs[0, 0].grid(True)
     axs[0, 0].set_title('True Anomaly vs Time')
     axs[0, 0].set_ylabel('Angle (Deg)')
 
     # plot semi major
-    axs[1, 2].plot(orbit.t_steps, orbit.koe_t[:, 0], lw=width)
+    axs[1, 2].plot(t_hours, orbit.koe_t[:, 0], lw=width)
     axs[1, 2].grid(True)
     axs[1, 2].set_title('Semi-Major Axis vs Time')
     axs[1, 2].set_ylabel('Semi-Major Axis (KM)')
 
     # plot eccentricity
-    axs[0, 1].plot(orbit.t_steps, orbit.koe_t[:, 1], lw=width)
+    axs[0, 1].plot(t_hours, orbit.koe_t[:, 1], lw=width)
     axs[0, 1].grid(True)
     axs[0, 1].set_title('Eccentricity vs Time')
 
     # plot argument of periapsis
-    axs[0, 2].plot(orbit.t_steps, orbit.koe_t[:, 4], lw=width)
+    axs[0, 2].plot(t_hours, orbit.koe_t[:, 4], lw=width)
     axs[0, 2].grid(True)
     axs[0, 2].set_title('Argument of Periapsis vs Time')
 
     # plot inclination
-    axs[1, 1].plot(orbit.t_steps, orbit.koe_t[:, 2], lw=width)
+    axs[1, 1].plot(t_hours, orbit.koe_t[:, 2], lw=width)
     axs[1, 1].grid(True)
     axs[1, 1].set_title('Inclination vs Time')
 
     # plot Ascending Node
-    axs[1, 0].plot(orbit.t_steps, orbit.koe_t[:, 5], lw=width)
+    axs[1, 0].plot(t_hours, orbit.koe_t[:, 5], lw=width)
     axs[1, 0].grid(True)
     axs[1, 0].set_title('Ascending Node vs Time')
     axs[1, 0].set_ylabel('Angle (Deg)')
@@ -172,15 +250,10 @@ def plot_vars(orbit, reSimulate = False, args = {}, title='Kepler\'s Elements'):
     return fig
 
 # Return the orbital state space plot of an orbit
-def plot_state_space(orbit, reSimulate = False, args=None):
-    if args is None:
-        args = {}
+def plot_state_space(orbit):
     fig, axs = plt.subplots(nrows=1, ncols=3, figsize=(10, 6))
     fig.suptitle('Orbital State Space')
 
-    if reSimulate:
-        orbit.propagate_orbit()
-
     # Plot angular Momentum vs Time
     angular_momentum = np.cross(orbit.state[:, :3], orbit.state[:, 3:6], axis=1)
     axs[0].plot(orbit.t_steps, np.round(np.linalg.norm(angular_momentum, axis=1)))
@@ -209,32 +282,21 @@ def plot_state_space(orbit, reSimulate = False, args=None):
     fig.tight_layout()
     return fig
 
-# Animate coastlines based on time
+# Animate coastlines based on time, returns a function giving the coastline positions for a frame
+# Each frame applies a single rotation to the cached ECEF points, so memory does not grow with the time span
 def animate_coastlines(orbit):
-    coastline_latlong = np.genfromtxt('Spice/coastlines.csv', delimiter=',')
-    coastline_latlong = coastline_latlong[:, [1, 0]]  # Columns are [Latitude, Longitude]
-    n_points = len(coastline_latlong)
-    states = np.full(n_points, pd.Earth['radius'])
-
-    # Convert lat-long to ecef coordinates
-    r_states = np.column_stack((coastline_latlong[:, 0], coastline_latlong[:, 1], states))
-    ecef_states = ft.latlong2ecef(r_states)
-
-    # Initialize eci array with correct shape: (step_n, n_points, 3)
-    eci = np.zeros((orbit.step_n, n_points, 3))
+    # Precomputed ecef coordinates of the coastlines
+    ecef_states = np.ascontiguousarray(cl.ecef(radius=pd.Earth['radius']))
+    eci = np.empty_like(ecef_states)  # Reused by every frame
 
-    # Calculate time steps for each frame
-    timesteps = np.linspace(orbit.args['tSpan'][0], orbit.args['tSpan'][-1], orbit.step_n)
+    def coastline_frame(i):
+        return ft.ecef2eci(ecef_states, orbit.et0 + orbit.t_steps[i, 0], fidelity=orbit.args['earthRotation'], out=eci)
 
-    # Convert ecef to eci for each timestep
-    for i, t in enumerate(timesteps):
-        eci[i] = ft.ecef2eci(ecef_states, orbit.et0 + t)
-
-    return eci
+    return coastline_frame
 
 
 # Animate Orbits and Coastlines
-def animate_Orbits(orbits, reSimulate=False, args={}):
+def animate_Orbits(orbits, fps=ae.ANIMATION_FPS):
     plt.style.use('dark_background')
     fig = plt.figure(figsize=(8, 8))
     ax = fig.add_subplot(111, projection='3d')
@@ -246,18 +308,14 @@ def animate_Orbits(orbits, reSimulate=False, args={}):
     ax.set_aspect('equal')
     ax.set_title('Orbital Trajectories')
 
-    # Propagate Orbits and setup trajectories
-    trajectory = []
-    for key in orbits:
-        if reSimulate:
-            orbits[key].update_args(args)
-            orbits[key].propagate_orbit()
-        trajectory.append(orbits[key].state)
-    trajectory = np.array(trajectory)
-
+    total = len(orbits)
+    orbits = drawable(orbits)
     if len(orbits) >= 1:
+        # Setup trajectories, packed so orbits may have different lengths
+        trajectory, offsets = pack_paths([orbits[key].state for key in orbits])
+
         # Find max value of positions
-        max_val = np.max(np.abs(trajectory[:,:,:3]))
+        max_val = position_extent(orbits)
         ax.set_xlim(-max_val, max_val)
         ax.set_ylim(-max_val, max_val)
         ax.set_zlim(-max_val, max_val)
@@ -269,46 +327,38 @@ def animate_Orbits(orbits, reSimulate=False, args={}):
         first_key = next(iter(orbits))
         refOrbit = orbits[first_key]
 
-        eci = animate_coastlines(refOrbit)
+        coastline_frame = animate_coastlines(refOrbit)
+        eci = coastline_frame(0)
 
-        # Setup lines for orbits
-        coastlines, = ax.plot(eci[0, :, 0], eci[0, :, 1], eci[0, :, 2], 'ko',markersize=0.3, zorder=-10, alpha=0.5)
-        lines = [ax.plot([], [], [], lw=2, zorder=10)[0] for _ in range(len(orbits))]
-        title = ax.set_title("Time: 0 s")
+        # Artists and legend are created once, frames only move their data
+        coastlines, = ax.plot(eci[:, 0], eci[:, 1], eci[:, 2], 'ko',markersize=0.3, zorder=-10, alpha=0.5)
+        colors = orbit_colors(len(orbits))
+        lines = Line3DCollection([], colors=colors, lw=2, zorder=10)
+        ax.add_collection(lines)
+        orbit_legend(ax, list(orbits), colors, total)
+        status = ax.text2D(0.02, 0.95, '', transform=ax.transAxes)
 
         def init():
-            for line in lines:
-                line.set_data([], [])
-                line.set_3d_properties([])
-            return lines + [coastlines]
+            lines.set_segments([])
+            status.set_text('')
+            return [lines, coastlines, status]
 
         def animate(i):
-            #Update orbit trajectories
-            for key, traj, line in zip(orbits.keys(), trajectory, lines):
-                x, y, z = traj[:i, 0], traj[:i, 1], traj[:i, 2]
-                line.set_data(x, y)
-                line.set_3d_properties(z)
-                line.set_label(key)
-                ax.legend()
-                ax.set_title("Time: " + str(refOrbit.args['dt'] * i))
+            # Trajectories up to step i, segments are views of the packed array so nothing is copied
+            lines.set_segments(packed_segments(trajectory, offsets, i + 1))
 
             # Update coastlines to simulate Earth's rotation
-            coastlines.set_data(eci[i, :, 0], eci[i, :, 1])
-            coastlines.set_3d_properties(eci[i, :, 2])
+            eci = coastline_frame(i)
+            coastlines.set_data(eci[:, 0], eci[:, 1])
+            coastlines.set_3d_properties(eci[:, 2])
 
-            # Update title
-            current_time = refOrbit.args['dt'] * i
-            print(current_time / 86400)
-            ax.set_title(current_time)
+            status.set_text(f"Time: {refOrbit.t_steps[i, 0] / 86400:.2f} days   {engine.report()}")
+            return [lines, coastlines, status]
 
-            return lines + [coastlines]
+        engine = ae.AnimationEngine(fig, refOrbit.step_n, animate, init, fps)
+        return engine, fig
 
-        anim = animation.FuncAnimation(fig, animate, init_func=init, frames=refOrbit.step_n, interval=50, blit=True)
-        return anim, fig
-
-def animate_groundtracks(orbits, reSimulate=False, args=None):
-    if args is None:
-        args = {}
+def animate_groundtracks(orbits, fps=ae.ANIMATION_FPS):
     fig = plt.figure(figsize=(8, 4))
     ax = fig.add_subplot()
 
@@ -316,38 +366,40 @@ def animate_groundtracks(orbits, reSimulate=False, args=None):
     ax.set_xlabel('Longitude [Deg]')
     ax.set_ylabel('Latitude [Deg]')
 
+    total = len(orbits)
+    orbits = drawable(orbits)
     first_key = next(iter(orbits))
     refOrbit = orbits[first_key]
 
-    tracks = []
-    for key in orbits:
-        if reSimulate:
-            orbits[key].update_args(args)
-            orbits[key].propagate_orbit()  # Simulate new parameters
-            orbits[key].latlongs()  # Simulate tracks
-        tracks.append(orbits[key].latlong)
-    tracks = np.array(tracks)
+    # Tracks as [long, lat] broken where they wrap, rows[k] is the packed row holding sample k of its orbit
+    broken = [dc.break_wraps(orbits[key].latlong[:, :2]) for key in orbits]
+    tracks, offsets = pack_paths([track[:, ::-1] for track, _ in broken], 2)
+    rows, row_offsets = pack_paths([moved[:, None] for _, moved in broken], 1)
+    rows, last = rows[:, 0], row_offsets[1:] - 1
 
     # [point, [log, lat]]
-    coastline_latlong = np.genfromtxt('Spice/coastlines.csv', delimiter=',')
-    ax.plot(coastline_latlong[:, 0], coastline_latlong[:, 1], 'mo', markersize=0.3)
+    coastline_longlat = cl.longlat()
+    ax.plot(coastline_longlat[:, 0], coastline_longlat[:, 1], 'mo', markersize=0.3)
 
-    # Setup lines for orbits
-    lines = [ax.plot([], [], 'o', markersize=0.5)[0] for _ in range(len(orbits))]
+    # Artists and legend are created once, frames only move their data
+    colors = orbit_colors(len(orbits))
+    lines = LineCollection([], colors=colors, lw=0.8)
+    ax.add_collection(lines)
+    orbit_legend(ax, list(orbits), colors, total)
+    status = ax.text(0.02, 0.95, '', transform=ax.transAxes)
 
     def init():
-        for line in lines:
-            line.set_data([], [])
-        return lines
+        lines.set_segments([])
+        status.set_text('')
+        return [lines, status]
 
     def animate(i):
-        # Update groundtracks
-        for track, key, line in zip(tracks, orbits.keys(), lines):
-            x, y = track[:i, 1], track[:i, 0]
-            line.set_data(x, y)
-            line.set_label(key)
-            ax.legend()
-        return lines
-
-    anim = animation.FuncAnimation(fig, animate, init_func=init, frames=refOrbit.step_n, interval=50, blit=True)
-    return  anim, fig
\ No newline at end of file
+        # Update groundtracks, each up to the row of its sample i
+        samples = np.minimum(row_offsets[:-1] + i, last)
+        lines.set_segments(packed_segments(tracks, offsets, rows[samples] + 1))
+
+        status.set_text(engine.report())
+        return [lines, status]
+
+    engine = ae.AnimationEngine(fig, refOrbit.step_n, animate, init, fps)
+    return engine, fig
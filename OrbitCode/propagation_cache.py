@@ -0,0 +1,68 @@
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+
+class PropagationCache:
+    """LRU cache of propagation results, bounded by a memory budget in bytes"""
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    # Hash of a simulation configuration tuple
+    @staticmethod
+    def key(config):
+        return hashlib.sha1(repr(config).encode()).hexdigest()
+
+    # Copies of the cached arrays for key, or None on a miss
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return {name: array.copy() for name, array in entry.items()}
+
+    # Store copies of a dict of result arrays under key
+    def put(self, key, arrays):
+        self.discard(key)
+
+        entry = {name: np.array(array, copy=True) for name, array in arrays.items()}
+        size = sum(array.nbytes for array in entry.values())
+        if size > self.max_bytes:
+            return  # Larger than the whole budget, never worth keeping
+
+        self.entries[key] = entry
+        self.nbytes += size
+        self.evict()
+
+    # Drop a single entry if present
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= sum(array.nbytes for array in entry.values())
+
+    # Drop least recently used entries until the cache fits its budget
+    def evict(self):
+        while self.nbytes > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.nbytes -= sum(array.nbytes for array in entry.values())
+
+    # Change the memory budget, evicting immediately if it shrank
+    def resize(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.evict()
+
+    # Remove every entry
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+# Cache shared by every OrbitalState
+cache = PropagationCache()
@@ -0,0 +1,83 @@
+import numpy as np
+import spiceypy as spice
+from collections import OrderedDict
+import earth_orientation as eo
+import ephemeris as eph
+
+# Time windows kept, each holds its ephemerides and Earth rotation matrices
+SCENARIO_CACHE_SIZE = 8
+context_cache = OrderedDict()
+
+
+class ScenarioContext:
+    """Time grid, third body ephemerides and Earth rotation shared by every orbit simulated over one time window"""
+    def __init__(self, start_date, span, dt):
+        self.start_date = start_date
+        self.span = float(span)
+        self.dt = float(dt)
+
+        # Shared time grid, the full length arrays are only built once something needs them in memory, streamed
+        # runs make their own per chunk
+        self.et0 = spice.utc2et(start_date)
+        self.step_n = int(self.span / self.dt)
+        self.grid = None
+
+        # Filled the first time an orbit needs them, then handed to every later orbit
+        self.ephemerides = {}
+        self.rotations = {}
+
+    # Window this context covers
+    def key(self):
+        return (self.start_date, self.span, self.dt)
+
+    # Read-only (step_n, 1) seconds after the start epoch and (step_n,) matching ET epochs
+    def time_grid(self):
+        if self.grid is None:
+            t_steps = (np.arange(self.step_n) * self.dt).reshape(-1, 1)
+            et = self.et0 + t_steps[:, 0]
+            t_steps.flags.writeable = False
+            et.flags.writeable = False
+            self.grid = t_steps, et
+        return self.grid
+
+    @property
+    def t_steps(self):
+        return self.time_grid()[0]
+
+    @property
+    def et(self):
+        return self.time_grid()[1]
+
+    # Fitted Sun (Earth wrt Sun) and Moon (wrt Earth) ephemerides over the window, None when not needed
+    def third_body_ephemerides(self, perturbations):
+        if perturbations['solar'] and 'solar' not in self.ephemerides:
+            self.ephemerides['solar'] = eph.get_ephemeris('EARTH', self.et0, self.et0 + self.span, 'J2000', 'SUN')
+        if perturbations['lunar'] and 'lunar' not in self.ephemerides:
+            self.ephemerides['lunar'] = eph.get_ephemeris('MOON', self.et0, self.et0 + self.span, 'J2000', 'EARTH')
+
+        solar = self.ephemerides['solar'] if perturbations['solar'] else None
+        lunar = self.ephemerides['lunar'] if perturbations['lunar'] else None
+        return solar, lunar
+
+    # Read-only J2000 to Earth fixed rotation matrices (step_n, 3, 3) on the grid, computed once per fidelity
+    def rotation_matrices(self, fidelity=None):
+        fidelity = eo.rotation.check_fidelity(fidelity, 'J2000')
+        if fidelity not in self.rotations:
+            self.rotations[fidelity] = eo.rotation.matrices(self.et, 'J2000', fidelity)
+        return self.rotations[fidelity]
+
+
+# Returns the shared context of a time window, a new one is only built when the window changes
+def get_context(start_date, span, dt):
+    key = (start_date, float(span), float(dt))
+
+    if key in context_cache:
+        context_cache.move_to_end(key)
+        return context_cache[key]
+
+    context = ScenarioContext(start_date, span, dt)
+    context_cache[key] = context
+    if len(context_cache) > SCENARIO_CACHE_SIZE:
+        context_cache.popitem(last=False)
+
+    return context
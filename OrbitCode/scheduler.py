@@ -0,0 +1,211 @@
+import copy
+from collections.abc import MutableMapping
+from itertools import chain
+import orbital_state as orb
+import orbit_catalog as oc
+import parallel as par
+
+# Key of the catalog's job among the prepared jobs, never a valid orbit name
+CATALOG = ('catalog',)
+
+
+class SimulationScheduler(MutableMapping):
+    """Owns the scenario's orbits and runs each needed simulation exactly once per change"""
+    def __init__(self, workers=1, kernel='kernal.mk'):
+        self.orbits = {}
+        self.dirty = set()
+        self.ready = set()  # Orbits holding results, the rest were added since the last finished run
+        self.args = None  # Simulation wide args applied to every orbit before it is simulated
+        self.prepared_args = None  # Args the latest prepare used
+        self.committed_args = None  # Args of the last run whose results were swapped in
+
+        # Catalog-scale objects (bulk KOE or TLE/OMM element sets) kept as packed rows and propagated in one batch
+        self.catalog = oc.OrbitCatalog()
+
+        # Incremented by every prepare, results are only committed by the latest one
+        self.generation = 0
+
+        # Worker processes used when more than one orbit needs simulating, 1 keeps everything in process unless
+        # the simulation is isolated
+        self.workers = workers
+        self.kernel = kernel
+        self.pool = None
+
+    # Dict access by orbit name, catalog objects are read-only views, adding or replacing an orbit marks it dirty
+    def __getitem__(self, name):
+        if name in self.orbits:
+            return self.orbits[name]
+        return self.catalog[name]
+
+    def __setitem__(self, name, orbit):
+        if name in self.catalog:
+            self.catalog.remove(name)
+        self.orbits[name] = orbit
+        self.dirty.add(name)
+        self.ready.discard(name)
+
+    def __delitem__(self, name):
+        if name in self.orbits:
+            del self.orbits[name]
+            self.dirty.discard(name)
+            self.ready.discard(name)
+        else:
+            self.catalog.remove(name)
+
+    def __iter__(self):
+        return chain(self.orbits, self.catalog)
+
+    def __len__(self):
+        return len(self.orbits) + len(self.catalog)
+
+    # Add catalog objects from (k, 6) KOE in degrees with scalar or per-object Mass/Asrp/Cr
+    def add_koes(self, names, koes, mass=0.1, asrp=10.0, cr=1.4):
+        self.check_names(names)
+        self.catalog.add(names, koes, mass, asrp, cr)
+
+    # Add catalog objects from packed TLE/OMM mean elements, such as tle.read_catalog returns
+    def add_elements(self, names, elements):
+        self.check_names(names)
+        self.catalog.add_elements(names, elements)
+
+    # Catalog names must not shadow single orbits
+    def check_names(self, names):
+        names = [names] if isinstance(names, str) else names
+        if any(name in self.orbits for name in names):
+            raise ValueError("Catalog object names must be unique")
+
+    # Mark one orbit, or every orbit, as needing a new simulation
+    def mark_dirty(self, name=None):
+        if name is None:
+            self.dirty.update(self.orbits)
+            self.catalog.dirty[:] = True
+        elif name in self.orbits:
+            self.dirty.add(name)
+        else:
+            self.catalog.dirty[self.catalog.index[name]] = True
+
+    # New simulation wide args, every orbit is re-simulated on the next run, returns False if nothing changed
+    # since the last committed run, so args whose run failed or was cancelled are run again when re-applied
+    def update_args(self, args):
+        if args == self.args and args == self.committed_args:
+            return False
+
+        self.args = copy.deepcopy(args)  # Later edits by the caller never reach a running simulation
+        self.mark_dirty()
+        return True
+
+    # Names of the orbits that still need simulating
+    def pending(self):
+        return [name for name in self.orbits if name in self.dirty] + \
+               [self.catalog.names[row] for row in self.catalog.pending()]
+
+    # Orbits with results to show, by name
+    def simulated(self):
+        orbits = {name: orbit for name, orbit in self.orbits.items() if name in self.ready}
+        orbits.update((name, self.catalog[name]) for name in self.catalog.simulated())
+        return orbits
+
+    # Change the number of worker processes, the pool restarts on the next parallel run
+    def set_workers(self, workers):
+        if workers != self.workers:
+            self.shutdown()
+        self.workers = workers
+
+    # Stop the worker pool if one is running
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    # Simulation wide args laid over an orbit's (or the catalog's) own
+    def job_args(self, args, span):
+        args = dict(args, tSpan=span)
+        if self.args is not None:
+            args.update({key: value for key, value in self.args.items() if value is not None})
+        return copy.deepcopy(args)
+
+    # Fresh copies of the dirty orbits set up with the current args, the orbits being shown are left untouched
+    # Copies whose dynamics did not change keep the shown orbit's numerical solution and are only re-sampled
+    # Out of date catalog rows are copied into one CatalogJob under the CATALOG key
+    def prepare(self):
+        self.generation += 1
+        self.prepared_args = copy.deepcopy(self.args)
+
+        jobs = {}
+        for name in self.orbits:
+            if name in self.dirty:
+                orbit = self.orbits[name]
+                jobs[name] = orb.OrbitalState(list(orbit.koe), self.job_args(orbit.args, orbit.span))
+                jobs[name].adopt_dense_output(orbit.dense_output())
+
+        rows = self.catalog.pending()
+        if len(rows):
+            jobs[CATALOG] = oc.CatalogJob(self.job_args(self.catalog.args, self.catalog.span),
+                                          self.catalog.columns(rows))
+
+        return self.generation, jobs
+
+    # Simulate prepared orbits, progress(done, total) is called as orbits finish and the remaining orbits are
+    # skipped once cancelled() returns True
+    # Isolated runs always propagate in worker processes so nothing calls SPICE or fills the module caches on this
+    # thread, that is what makes them safe off the main thread (CSPICE is not re-entrant)
+    def simulate(self, orbits, progress=None, cancelled=None, isolated=False):
+        orbits = list(orbits)
+        catalog_jobs = [job for job in orbits if isinstance(job, oc.CatalogJob)]
+        orbits = [orbit for orbit in orbits if not isinstance(orbit, oc.CatalogJob)]
+        total = len(orbits) + len(catalog_jobs)
+        report = None if progress is None else lambda done, _: progress(done, total)
+
+        pooled = isolated or self.workers > 1
+        if pooled and self.pool is None:
+            self.pool = par.ParallelPropagator(self.workers, self.kernel)
+
+        if isolated or (self.workers > 1 and len(orbits) > 1):
+            self.pool.simulate(orbits, report, cancelled)
+        else:
+            for done, orbit in enumerate(orbits, 1):
+                if cancelled is not None and cancelled():
+                    return
+                orbit.simulate()
+                if report is not None:
+                    report(done, total)
+
+        for done, job in enumerate(catalog_jobs, len(orbits) + 1):
+            if cancelled is not None and cancelled():
+                return
+            if pooled:
+                self.pool.simulate_catalog(job, cancelled)
+            else:
+                job.simulate()
+            if report is not None:
+                report(done, total)
+
+    # Swap simulated orbits in, all at once, if they come from the latest prepare, returns whether they were used
+    def commit(self, generation, simulated):
+        if generation != self.generation:
+            return False
+        self.committed_args = self.prepared_args
+
+        for name, orbit in simulated.items():
+            if name == CATALOG:
+                self.commit_catalog(orbit)
+            elif name in self.orbits:  # Deleted while simulating
+                self.orbits[name] = orbit
+                self.dirty.discard(name)
+                self.ready.add(name)
+
+        return True
+
+    # Merge a catalog job's results back, the catalog's buffers are kept when the grid length did not change
+    def commit_catalog(self, job):
+        if job.results is None:
+            return
+        if job.args != dict(self.catalog.args, tSpan=self.catalog.span):
+            self.catalog.update_args(job.args)
+        self.catalog.store_results(job.columns['names'], job.results)
+
+    # Simulate every dirty orbit once, plots only read the results afterwards
+    def run(self):
+        generation, orbits = self.prepare()
+        self.simulate(orbits.values())
+        self.commit(generation, orbits)
@@ -0,0 +1,709 @@
+import numpy as np
+import earth_orientation as eo
+import tle
+
+# WGS-72 constants, the ones two-line element sets are generated with
+WGS72 = {
+    'mu': 398600.8,  # in km^3/s^2
+    'radius': 6378.135,  # in kilometers
+    'J2': 0.001082616,
+    'J3': -0.00000253881,
+    'J4': -0.00000165597,
+}
+
+# Objects with a period of at least this many minutes use the deep-space (SDP4) terms
+DEEP_SPACE_PERIOD = 225.0
+
+# Samples (objects x epochs) evaluated at once, large enough to vectorize well and small enough to stay in cache
+SGP4_BLOCK = 1 << 16
+
+TWOPI = 2 * np.pi
+X2O3 = 2.0 / 3.0
+
+# Lunar-solar constants of the deep-space theory
+ZNS, ZES, ZNL, ZEL = 1.19459e-5, 0.01675, 1.5835218e-4, 0.05490
+C1SS, C1L = 2.9864797e-6, 4.7968065e-7
+ZSINIS, ZCOSIS = 0.39785416, 0.91744867
+ZCOSGS, ZSINGS = 0.1945905, -0.98088458
+
+# Resonance constants
+Q22, Q31, Q33 = 1.7891679e-6, 2.1460748e-6, 2.2123015e-7
+ROOT22, ROOT32, ROOT44, ROOT52, ROOT54 = 1.7891679e-6, 3.7393792e-7, 7.3636953e-9, 1.1428639e-7, 2.1765803e-9
+RPTIM = 4.37526908801129966e-3  # Earth rotation rate [rad/min]
+FASX2, FASX4, FASX6 = 0.13130908, 2.8843198, 0.37448087
+G22, G32, G44, G52, G54 = 5.7686396, 0.95240898, 1.8014998, 1.0508330, 4.4108898
+STEPP, STEP2 = 720.0, 259200.0
+
+
+# Greenwich mean sidereal time [rad] (IAU 1982) from a UT1 Julian date, the SGP4 form of earth_orientation.gmst
+def gstime(jdut1):
+    tut1 = (jdut1 - 2451545.0) / 36525.0
+    seconds = -6.2e-6 * tut1 ** 3 + 0.093104 * tut1 ** 2 + (876600.0 * 3600 + 8640184.812866) * tut1 + 67310.54841
+    return np.mod(np.radians(seconds) / 240.0, TWOPI)
+
+
+# Lunar and solar coefficients of the deep-space theory at days since 1950 Jan 0 (Vallado's dscom), one per object
+def dscom(day, ep, argpp, inclp, nodep, nm):
+    c = {}
+    snodm, cnodm = np.sin(nodep), np.cos(nodep)
+    sinomm, cosomm = np.sin(argpp), np.cos(argpp)
+    sinim, cosim = np.sin(inclp), np.cos(inclp)
+    emsq = ep ** 2
+    betasq = 1 - emsq
+    rtemsq = np.sqrt(betasq)
+
+    # Lunar node, inclination and longitude
+    xnodce = np.fmod(4.5236020 - 9.2422029e-4 * day, TWOPI)
+    stem, ctem = np.sin(xnodce), np.cos(xnodce)
+    zcosil = 0.91375164 - 0.03568096 * ctem
+    zsinil = np.sqrt(1 - zcosil ** 2)
+    zsinhl = 0.089683511 * stem / zsinil
+    zcoshl = np.sqrt(1 - zsinhl ** 2)
+    gam = 5.8351514 + 0.0019443680 * day
+    zx = np.arctan2(0.39785416 * stem / zsinil, zcoshl * ctem + 0.91744867 * zsinhl * stem)
+    zx = gam + zx - xnodce
+    zcosgl, zsingl = np.cos(zx), np.sin(zx)
+
+    # Solar terms first, then lunar terms
+    zcosg, zsing, zcosi, zsini, zcosh, zsinh = ZCOSGS, ZSINGS, ZCOSIS, ZSINIS, cnodm, snodm
+    cc = C1SS
+    xnoi = 1 / nm
+
+    for body in ('s', 'l'):
+        a1 = zcosg * zcosh + zsing * zcosi * zsinh
+        a3 = -zsing * zcosh + zcosg * zcosi * zsinh
+        a7 = -zcosg * zsinh + zsing * zcosi * zcosh
+        a8 = zsing * zsini
+        a9 = zsing * zsinh + zcosg * zcosi * zcosh
+        a10 = zcosg * zsini
+        a2 = cosim * a7 + sinim * a8
+        a4 = cosim * a9 + sinim * a10
+        a5 = -sinim * a7 + cosim * a8
+        a6 = -sinim * a9 + cosim * a10
+
+        x1 = a1 * cosomm + a2 * sinomm
+        x2 = a3 * cosomm + a4 * sinomm
+        x3 = -a1 * sinomm + a2 * cosomm
+        x4 = -a3 * sinomm + a4 * cosomm
+        x5 = a5 * sinomm
+        x6 = a6 * sinomm
+        x7 = a5 * cosomm
+        x8 = a6 * cosomm
+
+        z31 = 12 * x1 ** 2 - 3 * x3 ** 2
+        z32 = 24 * x1 * x2 - 6 * x3 * x4
+        z33 = 12 * x2 ** 2 - 3 * x4 ** 2
+        z1 = 3 * (a1 ** 2 + a2 ** 2) + z31 * emsq
+        z2 = 6 * (a1 * a3 + a2 * a4) + z32 * emsq
+        z3 = 3 * (a3 ** 2 + a4 ** 2) + z33 * emsq
+        z11 = -6 * a1 * a5 + emsq * (-24 * x1 * x7 - 6 * x3 * x5)
+        z12 = -6 * (a1 * a6 + a3 * a5) + emsq * (-24 * (x2 * x7 + x1 * x8) - 6 * (x3 * x6 + x4 * x5))
+        z13 = -6 * a3 * a6 + emsq * (-24 * x2 * x8 - 6 * x4 * x6)
+        z21 = 6 * a2 * a5 + emsq * (24 * x1 * x5 - 6 * x3 * x7)
+        z22 = 6 * (a4 * a5 + a2 * a6) + emsq * (24 * (x2 * x5 + x1 * x6) - 6 * (x4 * x7 + x3 * x8))
+        z23 = 6 * a4 * a6 + emsq * (24 * x2 * x6 - 6 * x4 * x8)
+        z1 = z1 + z1 + betasq * z31
+        z2 = z2 + z2 + betasq * z32
+        z3 = z3 + z3 + betasq * z33
+
+        s3 = cc * xnoi
+        s2 = -0.5 * s3 / rtemsq
+        s4 = s3 * rtemsq
+        s1 = -15 * ep * s4
+        s5 = x1 * x3 + x2 * x4
+        s6 = x2 * x3 + x1 * x4
+        s7 = x2 * x4 - x1 * x3
+
+        # Solar values are kept with an 's' prefix, lunar values are the plain names
+        prefix = 's' if body == 's' else ''
+        for name, value in (('1', s1), ('2', s2), ('3', s3), ('4', s4), ('5', s5), ('6', s6), ('7', s7)):
+            c[('ss' if prefix else 's') + name] = value
+        for name, value in (('1', z1), ('2', z2), ('3', z3), ('11', z11), ('12', z12), ('13', z13), ('21', z21),
+                            ('22', z22), ('23', z23), ('31', z31), ('32', z32), ('33', z33)):
+            c[('sz' if prefix else 'z') + name] = value
+
+        zcosg, zsing, zcosi, zsini = zcosgl, zsingl, zcosil, zsinil
+        zcosh = zcoshl * cnodm + zsinhl * snodm
+        zsinh = snodm * zcoshl - cnodm * zsinhl
+        cc = C1L
+
+    c['zmol'] = np.fmod(4.7199672 + 0.22997150 * day - gam, TWOPI)
+    c['zmos'] = np.fmod(6.2565837 + 0.017201977 * day, TWOPI)
+
+    # Solar periodic coefficients
+    c['se2'] = 2 * c['ss1'] * c['ss6']
+    c['se3'] = 2 * c['ss1'] * c['ss7']
+    c['si2'] = 2 * c['ss2'] * c['sz12']
+    c['si3'] = 2 * c['ss2'] * (c['sz13'] - c['sz11'])
+    c['sl2'] = -2 * c['ss3'] * c['sz2']
+    c['sl3'] = -2 * c['ss3'] * (c['sz3'] - c['sz1'])
+    c['sl4'] = -2 * c['ss3'] * (-21 - 9 * emsq) * ZES
+    c['sgh2'] = 2 * c['ss4'] * c['sz32']
+    c['sgh3'] = 2 * c['ss4'] * (c['sz33'] - c['sz31'])
+    c['sgh4'] = -18 * c['ss4'] * ZES
+    c['sh2'] = -2 * c['ss2'] * c['sz22']
+    c['sh3'] = -2 * c['ss2'] * (c['sz23'] - c['sz21'])
+
+    # Lunar periodic coefficients
+    c['ee2'] = 2 * c['s1'] * c['s6']
+    c['e3'] = 2 * c['s1'] * c['s7']
+    c['xi2'] = 2 * c['s2'] * c['z12']
+    c['xi3'] = 2 * c['s2'] * (c['z13'] - c['z11'])
+    c['xl2'] = -2 * c['s3'] * c['z2']
+    c['xl3'] = -2 * c['s3'] * (c['z3'] - c['z1'])
+    c['xl4'] = -2 * c['s3'] * (-21 - 9 * emsq) * ZEL
+    c['xgh2'] = 2 * c['s4'] * c['z32']
+    c['xgh3'] = 2 * c['s4'] * (c['z33'] - c['z31'])
+    c['xgh4'] = -18 * c['s4'] * ZEL
+    c['xh2'] = -2 * c['s2'] * c['z22']
+    c['xh3'] = -2 * c['s2'] * (c['z23'] - c['z21'])
+
+    return c
+
+
+# Lunar-solar periodics (Vallado's dpper) applied to mean elements at t minutes, improved operation mode
+def dpper(c, t, ep, inclp, nodep, argpp, mp):
+    # Solar terms
+    zm = c['zmos'] + ZNS * t
+    zf = zm + 2 * ZES * np.sin(zm)
+    sinzf = np.sin(zf)
+    f2 = 0.5 * sinzf ** 2 - 0.25
+    f3 = -0.5 * sinzf * np.cos(zf)
+    ses = c['se2'] * f2 + c['se3'] * f3
+    sis = c['si2'] * f2 + c['si3'] * f3
+    sls = c['sl2'] * f2 + c['sl3'] * f3 + c['sl4'] * sinzf
+    sghs = c['sgh2'] * f2 + c['sgh3'] * f3 + c['sgh4'] * sinzf
+    shs = c['sh2'] * f2 + c['sh3'] * f3
+
+    # Lunar terms
+    zm = c['zmol'] + ZNL * t
+    zf = zm + 2 * ZEL * np.sin(zm)
+    sinzf = np.sin(zf)
+    f2 = 0.5 * sinzf ** 2 - 0.25
+    f3 = -0.5 * sinzf * np.cos(zf)
+    sel = c['ee2'] * f2 + c['e3'] * f3
+    sil = c['xi2'] * f2 + c['xi3'] * f3
+    sll = c['xl2'] * f2 + c['xl3'] * f3 + c['xl4'] * sinzf
+    sghl = c['xgh2'] * f2 + c['xgh3'] * f3 + c['xgh4'] * sinzf
+    shll = c['xh2'] * f2 + c['xh3'] * f3
+
+    # The periodics at epoch (peo, pinco, ...) are zero, so nothing is subtracted
+    pe = ses + sel
+    pinc = sis + sil
+    pl = sls + sll
+    pgh = sghs + sghl
+    ph = shs + shll
+
+    inclp = inclp + pinc
+    ep = ep + pe
+    sinip, cosip = np.sin(inclp), np.cos(inclp)
+
+    # Direct application above 0.2 rad inclination
+    high = inclp >= 0.2
+    ph_high = ph / np.where(high, sinip, 1.0)
+    argp_high = argpp + pgh - cosip * ph_high
+    node_high = nodep + ph_high
+
+    # Lyddane modification at low inclination
+    sinop, cosop = np.sin(nodep), np.cos(nodep)
+    alfdp = sinip * sinop + (ph * cosop + pinc * cosip * sinop)
+    betdp = sinip * cosop + (-ph * sinop + pinc * cosip * cosop)
+    nodep_low = np.fmod(nodep, TWOPI)
+    xls = mp + argpp + cosip * nodep_low + (pl + pgh - pinc * nodep_low * sinip)
+    xnoh = nodep_low
+    node_low = np.arctan2(alfdp, betdp)
+    wrap = np.abs(xnoh - node_low) > np.pi
+    node_low = np.where(wrap & (node_low < xnoh), node_low + TWOPI, np.where(wrap, node_low - TWOPI, node_low))
+    argp_low = xls - (mp + pl) - cosip * node_low
+
+    nodep = np.where(high, node_high, node_low)
+    argpp = np.where(high, argp_high, argp_low)
+    mp = mp + pl
+
+    return ep, inclp, nodep, argpp, mp
+
+
+# Solve Kepler's equation in the equinoctial form u = E - axnl sin E + aynl cos E with Newton steps limited to 0.95 rad
+# Every sample stops once its step is under 1e-12, returns sin E and cos E of its last iteration like Vallado's loop
+def kepler(u, axnl, aynl):
+    u, axnl, aynl = np.broadcast_arrays(u, axnl, aynl)
+    shape = u.shape
+    u, axnl, aynl = u.ravel(), axnl.ravel(), aynl.ravel()
+    eo1 = u.copy()
+    sineo1, coseo1 = np.empty_like(u), np.empty_like(u)
+    active = np.arange(len(u))
+
+    for _ in range(10):
+        e, a, b = eo1[active], axnl[active], aynl[active]
+        sin_e, cos_e = np.sin(e), np.cos(e)
+        sineo1[active], coseo1[active] = sin_e, cos_e
+
+        tem5 = np.clip((u[active] - b * cos_e + a * sin_e - e) / (1 - cos_e * a - sin_e * b), -0.95, 0.95)
+        eo1[active] = e + tem5
+        active = active[np.abs(tem5) >= 1e-12]
+        if len(active) == 0:
+            break
+
+    return sineo1.reshape(shape), coseo1.reshape(shape)
+
+
+class SGP4Batch:
+    """SGP4/SDP4 for a packed array of element sets, every object is evaluated at every epoch in batched NumPy"""
+    def __init__(self, elements, constants=WGS72):
+        elements = np.asarray(elements, dtype=float).reshape(-1, tle.ELEMENT_COLUMNS)
+        self.n = len(elements)
+        self.epoch = elements[:, tle.EPOCH]
+
+        # Model constants in Earth radii and minutes
+        self.radius = constants['radius']
+        self.xke = 60.0 / np.sqrt(constants['radius'] ** 3 / constants['mu'])
+        self.j2 = constants['J2']
+        self.j3oj2 = constants['J3'] / constants['J2']
+        j2, j4 = constants['J2'], constants['J4']
+
+        ecco, inclo = elements[:, tle.ECCO], elements[:, tle.INCLO]
+        nodeo, argpo, mo = elements[:, tle.NODEO], elements[:, tle.ARGPO], elements[:, tle.MO]
+        bstar, no_kozai = elements[:, tle.BSTAR], elements[:, tle.NO_KOZAI]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Recover the original mean motion and semi-major axis from the Kozai mean motion (initl)
+            eccsq = ecco ** 2
+            omeosq = 1 - eccsq
+            rteosq = np.sqrt(omeosq)
+            cosio = np.cos(inclo)
+            cosio2 = cosio ** 2
+            ak = (self.xke / no_kozai) ** X2O3
+            d1 = 0.75 * j2 * (3 * cosio2 - 1) / (rteosq * omeosq)
+            delta = d1 / ak ** 2
+            adel = ak * (1 - delta ** 2 - delta * (1 / 3 + 134 * delta ** 2 / 81))
+            delta = d1 / adel ** 2
+            no = no_kozai / (1 + delta)
+            ao = (self.xke / no) ** X2O3
+            sinio = np.sin(inclo)
+            po = ao * omeosq
+            con42 = 1 - 5 * cosio2
+            con41 = -con42 - cosio2 - cosio2
+            posq = po ** 2
+            rp = ao * (1 - ecco)
+
+            # UT1 Julian date of each epoch and its sidereal time
+            jd = 2451545.0 + (self.epoch - eo.delta_ets(self.epoch)) / 86400.0
+            gsto = gstime(jd)
+
+            # Atmospheric density parameters, lowered for perigees under 156 km
+            deep = TWOPI / no >= DEEP_SPACE_PERIOD
+            isimp = (rp < 220 / self.radius + 1) | deep
+            perige = (rp - 1) * self.radius
+            sfour = np.where(perige < 98, 20.0, perige - 78)
+            qzms24 = np.where(perige < 156, ((120 - sfour) / self.radius) ** 4, ((120 - 78) / self.radius) ** 4)
+            sfour = np.where(perige < 156, sfour / self.radius + 1, 78 / self.radius + 1)
+
+            pinvsq = 1 / posq
+            tsi = 1 / (ao - sfour)
+            eta = ao * ecco * tsi
+            etasq = eta ** 2
+            eeta = ecco * eta
+            psisq = np.abs(1 - etasq)
+            coef = qzms24 * tsi ** 4
+            coef1 = coef / psisq ** 3.5
+            cc2 = coef1 * no * (ao * (1 + 1.5 * etasq + eeta * (4 + etasq))
+                                + 0.375 * j2 * tsi / psisq * con41 * (8 + 3 * etasq * (8 + etasq)))
+            cc1 = bstar * cc2
+            cc3 = np.where(ecco > 1e-4, -2 * coef * tsi * self.j3oj2 * no * sinio / ecco, 0.0)
+            x1mth2 = 1 - cosio2
+            cc4 = 2 * no * coef1 * ao * omeosq * (
+                eta * (2 + 0.5 * etasq) + ecco * (0.5 + 2 * etasq)
+                - j2 * tsi / (ao * psisq) * (-3 * con41 * (1 - 2 * eeta + etasq * (1.5 - 0.5 * eeta))
+                                             + 0.75 * x1mth2 * (2 * etasq - eeta * (1 + etasq)) * np.cos(2 * argpo)))
+            cc5 = 2 * coef1 * ao * omeosq * (1 + 2.75 * (etasq + eeta) + eeta * etasq)
+
+            # Secular rates from J2 and J4
+            cosio4 = cosio2 ** 2
+            temp1 = 1.5 * j2 * pinvsq * no
+            temp2 = 0.5 * temp1 * j2 * pinvsq
+            temp3 = -0.46875 * j4 * pinvsq ** 2 * no
+            mdot = no + 0.5 * temp1 * rteosq * con41 + 0.0625 * temp2 * rteosq * (13 - 78 * cosio2 + 137 * cosio4)
+            argpdot = (-0.5 * temp1 * con42 + 0.0625 * temp2 * (7 - 114 * cosio2 + 395 * cosio4)
+                       + temp3 * (3 - 36 * cosio2 + 49 * cosio4))
+            xhdot1 = -temp1 * cosio
+            nodedot = xhdot1 + (0.5 * temp2 * (4 - 19 * cosio2) + 2 * temp3 * (3 - 7 * cosio2)) * cosio
+
+            # Drag terms, zeroed for simplified (low perigee and deep-space) objects so one formula serves all
+            omgcof = np.where(isimp, 0.0, bstar * cc3 * np.cos(argpo))
+            xmcof = np.where(isimp | (ecco <= 1e-4), 0.0, -X2O3 * coef * bstar / eeta)
+            nodecf = 3.5 * omeosq * xhdot1 * cc1
+            t2cof = 1.5 * cc1
+            xlcof = -0.25 * self.j3oj2 * sinio * (3 + 5 * cosio) / np.where(np.abs(cosio + 1) > 1.5e-12, 1 + cosio, 1.5e-12)
+            aycof = -0.5 * self.j3oj2 * sinio
+            delmo = (1 + eta * np.cos(mo)) ** 3
+            sinmao = np.sin(mo)
+            x7thm1 = 7 * cosio2 - 1
+
+            cc1sq = cc1 ** 2
+            d2 = 4 * ao * tsi * cc1sq
+            temp = d2 * tsi * cc1 / 3
+            d3 = (17 * ao + sfour) * temp
+            d4 = 0.5 * temp * ao * tsi * (221 * ao + 31 * sfour) * cc1
+            t3cof = d2 + 2 * cc1sq
+            t4cof = 0.25 * (3 * d3 + cc1 * (12 * d2 + 10 * cc1sq))
+            t5cof = 0.2 * (3 * d4 + 12 * cc1 * d3 + 6 * d2 ** 2 + 15 * cc1sq * (2 * d2 + cc1sq))
+            simple = np.where(isimp, 0.0, 1.0)
+
+        # Per-object coefficients, indexed by row when a block is evaluated
+        self.coeffs = {
+            'ecco': ecco, 'inclo': inclo, 'nodeo': nodeo, 'argpo': argpo, 'mo': mo, 'bstar': bstar, 'no': no,
+            'con41': con41, 'x1mth2': x1mth2, 'x7thm1': x7thm1, 'cc1': cc1, 'cc4': cc4, 'cc5': cc5 * simple,
+            'eta': eta, 'mdot': mdot, 'argpdot': argpdot, 'nodedot': nodedot, 'omgcof': omgcof, 'xmcof': xmcof,
+            'nodecf': nodecf, 't2cof': t2cof, 'xlcof': xlcof, 'aycof': aycof, 'delmo': delmo, 'sinmao': sinmao,
+            'd2': d2 * simple, 'd3': d3 * simple, 'd4': d4 * simple, 't3cof': t3cof * simple,
+            't4cof': t4cof * simple, 't5cof': t5cof * simple, 'gsto': gsto,
+        }
+
+        # Deep-space objects, their lunar-solar and resonance coefficients are kept for their rows only
+        self.deep = deep
+        self.deep_rows = np.nonzero(deep)[0]
+        self.deep_index = np.cumsum(deep) - 1  # Row of each deep-space object within the deep-space coefficients
+        self.deep_coeffs = self.deep_space_init(self.deep_rows, jd - 2433281.5)
+
+    # Deep-space initialization (dscom and dsinit) of rows, epoch_days is days since 1950 Jan 0 for every object
+    def deep_space_init(self, rows, epoch_days):
+        c = {name: value[rows] for name, value in self.coeffs.items()}
+        day = epoch_days[rows] + 18261.5
+        ecco, inclo, no = c['ecco'], c['inclo'], c['no']
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ds = dscom(day, ecco, c['argpo'], inclo, c['nodeo'], no)
+            sinim, cosim = np.sin(inclo), np.cos(inclo)
+            emsq = ecco ** 2
+
+            # Resonances, 1 for synchronous (about one revolution per day) and 2 for eccentric half day orbits
+            irez = np.where((no > 0.0034906585) & (no < 0.0052359877), 1, 0)
+            irez = np.where((no >= 8.26e-3) & (no <= 9.24e-3) & (ecco >= 0.5), 2, irez)
+
+            # Solar and lunar secular rates
+            equatorial = (inclo < 5.2359877e-2) | (inclo > np.pi - 5.2359877e-2)
+            safe_sinim = np.where(sinim != 0, sinim, 1.0)
+            ses = ds['ss1'] * ZNS * ds['ss5']
+            sis = ds['ss2'] * ZNS * (ds['sz11'] + ds['sz13'])
+            sls = -ZNS * ds['ss3'] * (ds['sz1'] + ds['sz3'] - 14 - 6 * emsq)
+            sghs = ds['ss4'] * ZNS * (ds['sz31'] + ds['sz33'] - 6)
+            shs = np.where(equatorial, 0.0, -ZNS * ds['ss2'] * (ds['sz21'] + ds['sz23']))
+            shs = shs / safe_sinim
+            sgs = sghs - cosim * shs
+
+            ds['dedt'] = ses + ds['s1'] * ZNL * ds['s5']
+            ds['didt'] = sis + ds['s2'] * ZNL * (ds['z11'] + ds['z13'])
+            ds['dmdt'] = sls - ZNL * ds['s3'] * (ds['z1'] + ds['z3'] - 14 - 6 * emsq)
+            sghl = ds['s4'] * ZNL * (ds['z31'] + ds['z33'] - 6)
+            shll = np.where(equatorial, 0.0, -ZNL * ds['s2'] * (ds['z21'] + ds['z23']))
+            ds['domdt'] = sgs + sghl - np.where(sinim != 0, cosim / safe_sinim * shll, 0.0)
+            ds['dnodt'] = shs + np.where(sinim != 0, shll / safe_sinim, 0.0)
+
+            theta = np.fmod(c['gsto'], TWOPI)
+            aonv = (no / self.xke) ** X2O3
+
+            # Half day resonance coefficients (irez 2), evaluated with the epoch eccentricity
+            em = ecco
+            eoc = em * emsq
+            low = em <= 0.65
+            g201 = -0.306 - (em - 0.64) * 0.440
+            g211 = np.where(low, 3.616 - 13.2470 * em + 16.2900 * emsq,
+                            -72.099 + 331.819 * em - 508.738 * emsq + 266.724 * eoc)
+            g310 = np.where(low, -19.302 + 117.3900 * em - 228.4190 * emsq + 156.5910 * eoc,
+                            -346.844 + 1582.851 * em - 2415.925 * emsq + 1246.113 * eoc)
+            g322 = np.where(low, -18.9068 + 109.7927 * em - 214.6334 * emsq + 146.5816 * eoc,
+                            -342.585 + 1554.908 * em - 2366.899 * emsq + 1215.972 * eoc)
+            g410 = np.where(low, -41.122 + 242.6940 * em - 471.0940 * emsq + 313.9530 * eoc,
+                            -1052.797 + 4758.686 * em - 7193.992 * emsq + 3651.957 * eoc)
+            g422 = np.where(low, -146.407 + 841.8800 * em - 1629.014 * emsq + 1083.4350 * eoc,
+                            -3581.690 + 16178.110 * em - 24462.770 * emsq + 12422.520 * eoc)
+            g520 = np.where(low, -532.114 + 3017.977 * em - 5740.032 * emsq + 3708.2760 * eoc,
+                            np.where(em > 0.715, -5149.66 + 29936.92 * em - 54087.36 * emsq + 31324.56 * eoc,
+                                     1464.74 - 4664.75 * em + 3763.64 * emsq))
+            below = em < 0.7
+            g533 = np.where(below, -919.22770 + 4988.6100 * em - 9064.7700 * emsq + 5542.21 * eoc,
+                            -37995.780 + 161616.52 * em - 229838.20 * emsq + 109377.94 * eoc)
+            g521 = np.where(below, -822.71072 + 4568.6173 * em - 8491.4146 * emsq + 5337.524 * eoc,
+                            -51752.104 + 218913.95 * em - 309468.16 * emsq + 146349.42 * eoc)
+            g532 = np.where(below, -853.66600 + 4690.2500 * em - 8624.7700 * emsq + 5341.4 * eoc,
+                            -40023.880 + 170470.89 * em - 242699.48 * emsq + 115605.82 * eoc)
+
+            cosisq = cosim ** 2
+            sini2 = sinim ** 2
+            f220 = 0.75 * (1 + 2 * cosim + cosisq)
+            f221 = 1.5 * sini2
+            f321 = 1.875 * sinim * (1 - 2 * cosim - 3 * cosisq)
+            f322 = -1.875 * sinim * (1 + 2 * cosim - 3 * cosisq)
+            f441 = 35 * sini2 * f220
+            f442 = 39.3750 * sini2 ** 2
+            f522 = 9.84375 * sinim * (sini2 * (1 - 2 * cosim - 5 * cosisq) + 0.33333333 * (-2 + 4 * cosim + 6 * cosisq))
+            f523 = sinim * (4.92187512 * sini2 * (-2 - 4 * cosim + 10 * cosisq) + 6.56250012 * (1 + 2 * cosim - 3 * cosisq))
+            f542 = 29.53125 * sinim * (2 - 8 * cosim + cosisq * (-12 + 8 * cosim + 10 * cosisq))
+            f543 = 29.53125 * sinim * (-2 - 8 * cosim + cosisq * (12 + 8 * cosim - 10 * cosisq))
+
+            temp1 = 3 * no ** 2 * aonv ** 2
+            temp = temp1 * ROOT22
+            ds['d2201'] = temp * f220 * g201
+            ds['d2211'] = temp * f221 * g211
+            temp1 = temp1 * aonv
+            temp = temp1 * ROOT32
+            ds['d3210'] = temp * f321 * g310
+            ds['d3222'] = temp * f322 * g322
+            temp1 = temp1 * aonv
+            temp = 2 * temp1 * ROOT44
+            ds['d4410'] = temp * f441 * g410
+            ds['d4422'] = temp * f442 * g422
+            temp1 = temp1 * aonv
+            temp = temp1 * ROOT52
+            ds['d5220'] = temp * f522 * g520
+            ds['d5232'] = temp * f523 * g532
+            temp = 2 * temp1 * ROOT54
+            ds['d5421'] = temp * f542 * g521
+            ds['d5433'] = temp * f543 * g533
+
+            # Synchronous resonance coefficients (irez 1)
+            g200 = 1 + emsq * (-2.5 + 0.8125 * emsq)
+            g310 = 1 + 2 * emsq
+            g300 = 1 + emsq * (-6 + 6.60937 * emsq)
+            f220 = 0.75 * (1 + cosim) ** 2
+            f311 = 0.9375 * sinim ** 2 * (1 + 3 * cosim) - 0.75 * (1 + cosim)
+            f330 = 1.875 * (1 + cosim) ** 3
+            del1 = 3 * no ** 2 * aonv ** 2
+            ds['del2'] = 2 * del1 * f220 * g200 * Q22
+            ds['del3'] = 3 * del1 * f330 * g300 * Q33 * aonv
+            ds['del1'] = del1 * f311 * g310 * Q31 * aonv
+
+            xpidot = c['argpdot'] + c['nodedot']
+            ds['xlamo'] = np.where(irez == 2, np.fmod(c['mo'] + c['nodeo'] + c['nodeo'] - theta - theta, TWOPI),
+                                   np.fmod(c['mo'] + c['nodeo'] + c['argpo'] - theta, TWOPI))
+            ds['xfact'] = np.where(irez == 2, c['mdot'] + ds['dmdt'] + 2 * (c['nodedot'] + ds['dnodt'] - RPTIM) - no,
+                                   c['mdot'] + xpidot - RPTIM + ds['dmdt'] + ds['domdt'] + ds['dnodt'] - no)
+
+        ds['irez'] = irez
+        return ds
+
+    # Rates of the resonant mean motion (xndt, xnddt) and longitude (xldot) at atime minutes from epoch
+    @staticmethod
+    def resonance_rates(ds, c, xli, xni, atime):
+        # Synchronous resonance
+        xndt_sync = (ds['del1'] * np.sin(xli - FASX2) + ds['del2'] * np.sin(2 * (xli - FASX4))
+                     + ds['del3'] * np.sin(3 * (xli - FASX6)))
+        xnddt_sync = (ds['del1'] * np.cos(xli - FASX2) + 2 * ds['del2'] * np.cos(2 * (xli - FASX4))
+                      + 3 * ds['del3'] * np.cos(3 * (xli - FASX6)))
+
+        # Half day resonance
+        xomi = c['argpo'] + c['argpdot'] * atime
+        x2omi = xomi + xomi
+        x2li = xli + xli
+        xndt_half = (ds['d2201'] * np.sin(x2omi + xli - G22) + ds['d2211'] * np.sin(xli - G22)
+                     + ds['d3210'] * np.sin(xomi + xli - G32) + ds['d3222'] * np.sin(-xomi + xli - G32)
+                     + ds['d4410'] * np.sin(x2omi + x2li - G44) + ds['d4422'] * np.sin(x2li - G44)
+                     + ds['d5220'] * np.sin(xomi + xli - G52) + ds['d5232'] * np.sin(-xomi + xli - G52)
+                     + ds['d5421'] * np.sin(xomi + x2li - G54) + ds['d5433'] * np.sin(-xomi + x2li - G54))
+        xnddt_half = (ds['d2201'] * np.cos(x2omi + xli - G22) + ds['d2211'] * np.cos(xli - G22)
+                      + ds['d3210'] * np.cos(xomi + xli - G32) + ds['d3222'] * np.cos(-xomi + xli - G32)
+                      + ds['d5220'] * np.cos(xomi + xli - G52) + ds['d5232'] * np.cos(-xomi + xli - G52)
+                      + 2 * (ds['d4410'] * np.cos(x2omi + x2li - G44) + ds['d4422'] * np.cos(x2li - G44)
+                             + ds['d5421'] * np.cos(xomi + x2li - G54) + ds['d5433'] * np.cos(-xomi + x2li - G54)))
+
+        half_day = ds['irez'] == 2
+        xndt = np.where(half_day, xndt_half, xndt_sync)
+        xldot = xni + ds['xfact']
+        xnddt = np.where(half_day, xnddt_half, xnddt_sync) * xldot
+        return xndt, xldot, xnddt
+
+    # Resonance integration (Vallado's dspace) from epoch to t minutes, returns the resonant mean motion and longitude
+    # The integrator takes whole 720 minute steps from epoch, so the state at each step is found once per object and
+    # every sample only adds its own final partial step
+    @classmethod
+    def resonance(cls, ds, c, t):
+        steps = np.floor(np.abs(t) / STEPP).astype(int)
+        count = steps.max() + 1
+
+        # Integrator state and rates at every step, forward steps then backward steps
+        nodes = np.empty((5, len(t), 2 * count))
+        for direction, delt in enumerate((STEPP, -STEPP)):
+            xli, xni, atime = ds['xlamo'], c['no'], 0.0
+            for step in range(count):
+                xndt, xldot, xnddt = cls.resonance_rates(ds, c, xli, xni, atime)
+                nodes[:, :, direction * count + step] = np.hstack((xli, xni, xndt, xldot, xnddt)).T
+                xli = xli + xldot * delt + xndt * STEP2
+                xni = xni + xndt * delt + xnddt * STEP2
+                atime = atime + delt
+
+        # Each sample continues from its last whole step
+        backward = t <= 0
+        index = steps + count * backward
+        xli, xni, xndt, xldot, xnddt = (np.take_along_axis(node, index, axis=1) for node in nodes)
+        ft = t - np.where(backward, -STEPP, STEPP) * steps
+        nm = xni + xndt * ft + xnddt * ft * ft * 0.5
+        xl = xli + xldot * ft + xndt * ft * ft * 0.5
+        return nm, xl
+
+    # TEME states (k, n, 6) of rows at tsince (k, n) minutes from each object's epoch, deep is True when every row is
+    def evaluate(self, rows, tsince, deep=False):
+        c = {name: value[rows, None] for name, value in self.coeffs.items()}
+        t = tsince
+
+        # Secular gravity and atmospheric drag
+        xmdf = c['mo'] + c['mdot'] * t
+        argpdf = c['argpo'] + c['argpdot'] * t
+        nodedf = c['nodeo'] + c['nodedot'] * t
+        t2 = t * t
+        nodem = nodedf + c['nodecf'] * t2
+        delomg = c['omgcof'] * t
+        delm = c['xmcof'] * ((1 + c['eta'] * np.cos(xmdf)) ** 3 - c['delmo'])
+        temp = delomg + delm
+        mm = xmdf + temp
+        argpm = argpdf - temp
+        t3 = t2 * t
+        t4 = t3 * t
+        tempa = 1 - c['cc1'] * t - c['d2'] * t2 - c['d3'] * t3 - c['d4'] * t4
+        tempe = c['bstar'] * c['cc4'] * t + c['bstar'] * c['cc5'] * (np.sin(mm) - c['sinmao'])
+        templ = c['t2cof'] * t2 + c['t3cof'] * t3 + t4 * (c['t4cof'] + t * c['t5cof'])
+
+        nm = c['no']
+        em = c['ecco']
+        inclm = c['inclo']
+
+        if deep:
+            ds = {name: value[self.deep_index[rows], None] for name, value in self.deep_coeffs.items()}
+
+            # Lunar-solar secular rates, then the resonance integration for resonant objects
+            em = em + ds['dedt'] * t
+            inclm = inclm + ds['didt'] * t
+            argpm = argpm + ds['domdt'] * t
+            nodem = nodem + ds['dnodt'] * t
+            mm = mm + ds['dmdt'] * t
+
+            resonant = ds['irez'][:, 0] != 0
+            if resonant.any():
+                rds = {name: value[resonant] for name, value in ds.items()}
+                rc = {name: value[resonant] for name, value in c.items()}
+                theta = np.fmod(rc['gsto'] + t[resonant] * RPTIM, TWOPI)
+                nm_res, xl = self.resonance(rds, rc, t[resonant])
+                mm_res = np.where(rds['irez'] == 1, xl - nodem[resonant] - argpm[resonant] + theta,
+                                  xl - 2 * nodem[resonant] + 2 * theta)
+                nm = np.broadcast_to(nm, t.shape).copy()
+                nm[resonant] = nm_res
+                mm[resonant] = mm_res
+
+        error = np.zeros(t.shape, dtype=bool) | (nm <= 0)
+        am = (self.xke / nm) ** X2O3 * tempa ** 2
+        nm = self.xke / am ** 1.5
+        em = em - tempe
+        error |= (em >= 1) | (em < -0.001)
+        em = np.maximum(em, 1e-6)
+
+        mm = mm + c['no'] * templ
+        xlm = mm + argpm + nodem
+        nodem = np.fmod(nodem, TWOPI)
+        argpm = np.fmod(argpm, TWOPI)
+        xlm = np.fmod(xlm, TWOPI)
+        mm = np.fmod(xlm - argpm - nodem, TWOPI)
+
+        ep, xincp, nodep, argpp, mp = em, inclm, nodem, argpm, mm
+        aycof, xlcof = c['aycof'], c['xlcof']
+        con41, x1mth2, x7thm1 = c['con41'], c['x1mth2'], c['x7thm1']
+
+        if deep:
+            # Lunar-solar periodics, the long period and short period terms then use the perturbed inclination
+            ep, xincp, nodep, argpp, mp = dpper(ds, t, ep, xincp, nodep, argpp, mp)
+            negative = xincp < 0
+            xincp = np.where(negative, -xincp, xincp)
+            nodep = np.where(negative, nodep + np.pi, nodep)
+            argpp = np.where(negative, argpp - np.pi, argpp)
+            error |= (ep < 0) | (ep > 1)
+
+            sinip, cosip = np.sin(xincp), np.cos(xincp)
+            aycof = -0.5 * self.j3oj2 * sinip
+            xlcof = -0.25 * self.j3oj2 * sinip * (3 + 5 * cosip) / np.where(np.abs(cosip + 1) > 1.5e-12, 1 + cosip, 1.5e-12)
+            cosisq = cosip ** 2
+            con41 = 3 * cosisq - 1
+            x1mth2 = 1 - cosisq
+            x7thm1 = 7 * cosisq - 1
+        else:
+            sinip, cosip = np.sin(xincp), np.cos(xincp)
+
+        # Long period periodics
+        axnl = ep * np.cos(argpp)
+        temp = 1 / (am * (1 - ep * ep))
+        aynl = ep * np.sin(argpp) + temp * aycof
+        xl = mp + argpp + nodep + temp * xlcof * axnl
+
+        # Kepler's equation in the equinoctial form
+        sineo1, coseo1 = kepler(np.fmod(xl - nodep, TWOPI), axnl, aynl)
+
+        # Short period periodics
+        ecose = axnl * coseo1 + aynl * sineo1
+        esine = axnl * sineo1 - aynl * coseo1
+        el2 = axnl ** 2 + aynl ** 2
+        pl = am * (1 - el2)
+        error |= pl < 0
+        rl = am * (1 - ecose)
+        rdotl = np.sqrt(am) * esine / rl
+        rvdotl = np.sqrt(pl) / rl
+        betal = np.sqrt(1 - el2)
+        temp = esine / (1 + betal)
+        sinu = am / rl * (sineo1 - aynl - axnl * temp)
+        cosu = am / rl * (coseo1 - axnl + aynl * temp)
+        su = np.arctan2(sinu, cosu)
+        sin2u = (cosu + cosu) * sinu
+        cos2u = 1 - 2 * sinu * sinu
+        temp = 1 / pl
+        temp1 = 0.5 * self.j2 * temp
+        temp2 = temp1 * temp
+
+        mrt = rl * (1 - 1.5 * temp2 * betal * con41) + 0.5 * temp1 * x1mth2 * cos2u
+        su = su - 0.25 * temp2 * x7thm1 * sin2u
+        xnode = nodep + 1.5 * temp2 * cosip * sin2u
+        xinc = xincp + 1.5 * temp2 * cosip * sinip * cos2u
+        mvt = rdotl - nm * temp1 * x1mth2 * sin2u / self.xke
+        rvdot = rvdotl + nm * temp1 * (x1mth2 * cos2u + 1.5 * con41) / self.xke
+        error |= mrt < 1  # Decayed
+
+        # Orientation vectors, position in Earth radii and velocity in Earth radii per minute
+        sinsu, cossu = np.sin(su), np.cos(su)
+        snod, cnod = np.sin(xnode), np.cos(xnode)
+        sini, cosi = np.sin(xinc), np.cos(xinc)
+        xmx = -snod * cosi
+        xmy = cnod * cosi
+        ux = xmx * sinsu + cnod * cossu
+        uy = xmy * sinsu + snod * cossu
+        uz = sini * sinsu
+        vx = xmx * cossu - cnod * sinsu
+        vy = xmy * cossu - snod * sinsu
+        vz = sini * cossu
+
+        vkmpersec = self.radius * self.xke / 60.0
+        states = np.empty(t.shape + (6,))
+        states[..., 0] = mrt * ux * self.radius
+        states[..., 1] = mrt * uy * self.radius
+        states[..., 2] = mrt * uz * self.radius
+        states[..., 3] = (mvt * ux + rvdot * vx) * vkmpersec
+        states[..., 4] = (mvt * uy + rvdot * vy) * vkmpersec
+        states[..., 5] = (mvt * uz + rvdot * vz) * vkmpersec
+        states[error] = np.nan
+
+        return states
+
+    # TEME states (k, n, 6) [km, km/s] of rows (default all) at ET epochs, NaN where SGP4 fails or the object decayed
+    # out may be a preallocated (k, n, 6) array to write into, such as a shared memory block
+    def states(self, et, rows=None, out=None):
+        et = np.asarray(et, dtype=float).ravel()
+        rows = np.arange(self.n) if rows is None else np.asarray(rows).ravel()
+        states = np.empty((len(rows), len(et), 6)) if out is None else out
+        block = max(SGP4_BLOCK // max(len(et), 1), 1)
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for start in range(0, len(rows), block):
+                block_rows = rows[start:start + block]
+                deep = self.deep[block_rows]
+
+                # Near-Earth and deep-space objects of the block are evaluated separately
+                for subset, is_deep in ((~deep, False), (deep, True)):
+                    if subset.any():
+                        tsince = (et[None, :] - self.epoch[block_rows[subset], None]) / 60.0
+                        states[start + np.nonzero(subset)[0]] = self.evaluate(block_rows[subset], tsince, is_deep)
+
+        return states
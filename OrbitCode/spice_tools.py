@@ -1,5 +1,12 @@
 import spiceypy as spice
 import numpy as np
+import hashlib
+import os
+import tempfile
+
+# On-disk ephemeris cache, shared by every process running from this directory
+EPHEMERIS_CACHE_DIR = os.path.join('Spice', 'cache')
+EPHEMERIS_CACHE_MAX_BYTES = 256 * 1024 ** 2
 
 # Fetches Objects from SPK files to be used in program
 def get_objects(filename, display=False):
@@ -57,6 +64,93 @@ def tc2array(tcs, steps):
     return arr
 
 
+# Checksum of the loaded kernel pool, from each kernel's path, size and modification time
+def kernel_checksum():
+    digest = hashlib.sha1()
+    for i in range(spice.ktotal('ALL')):
+        file = spice.kdata(i, 'ALL')[0]
+        try:
+            stat = os.stat(file)
+            digest.update(f'{os.path.abspath(file)}|{stat.st_size}|{stat.st_mtime_ns};'.encode())
+        except OSError:
+            digest.update(f'{file};'.encode())
+    return digest.hexdigest()
+
+
+# Cache file name for a state query, uniform grids are keyed by start/stop/step, anything else by a digest of the times
+def ephemeris_cache_key(target, times, frame, observer):
+    times = np.asarray(times, dtype=float).ravel()
+    start, stop = (times[0], times[-1]) if len(times) else (0.0, 0.0)
+    steps = np.diff(times)
+
+    if len(steps) and np.allclose(steps, steps[0], rtol=0, atol=1e-6):
+        step = repr(float(steps[0]))
+    else:
+        step = hashlib.sha1(times.tobytes()).hexdigest()
+
+    key = '|'.join((target, observer, frame, repr(float(start)), repr(float(stop)), str(len(times)), step,
+                    kernel_checksum()))
+    return f'{target}_{observer}_{frame}_{hashlib.sha1(key.encode()).hexdigest()}.npy'
+
+
+# Remove the least recently used cache files until the cache fits in its size budget, keep (the file just written)
+# is never removed even when it alone is over the budget
+def evict_ephemeris_cache(cache_dir=None, max_bytes=None, keep=None):
+    cache_dir = cache_dir or EPHEMERIS_CACHE_DIR
+    max_bytes = EPHEMERIS_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    files = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npy'):
+            try:
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                continue  # Removed by another process
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            continue  # Already evicted, or still mapped on platforms that forbid it
+
+
 # Return State vector of an ephemeris (body) in relation to another
-def get_ephemeris_states(target, times, frame, observer):
-    return np.array(spice.spkezr(target, times, frame, 'NONE', observer)[0])
+# Results are kept as memory-mapped .npy files so repeated queries skip SPICE entirely
+def get_ephemeris_states(target, times, frame, observer, cache=True):
+    if not cache:
+        return np.array(spice.spkezr(target, times, frame, 'NONE', observer)[0])
+
+    path = os.path.join(EPHEMERIS_CACHE_DIR, ephemeris_cache_key(target, times, frame, observer))
+
+    # Cache hit, touch the file so eviction sees it as recently used
+    try:
+        states = np.load(path, mmap_mode='r')
+        os.utime(path)
+        return states
+    except (OSError, ValueError):
+        pass
+
+    states = np.array(spice.spkezr(target, times, frame, 'NONE', observer)[0])
+
+    # Write to a private temporary file and rename it into place so other processes never see a partial file
+    tmp_path = None
+    try:
+        os.makedirs(EPHEMERIS_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=EPHEMERIS_CACHE_DIR)
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, states)
+        os.replace(tmp_path, path)
+        evict_ephemeris_cache(keep=path)
+    except OSError as e:
+        print(f"Ephemeris cache unavailable: {e}")
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return states
@@ -0,0 +1,58 @@
+import numpy as np
+import decimation as dc
+
+
+class TrackOrbit:
+    """Stand-in for an OrbitalState, only what the decimation reads"""
+    def __init__(self, seed, n=1440):
+        t = np.linspace(0, 8 * np.pi, n) + seed
+        self.state = np.column_stack((7000 * np.cos(t), 7000 * np.sin(t), 100 * np.sin(3 * t), np.zeros((n, 3))))
+        self.latlong = np.column_stack((50 * np.sin(t), np.degrees(t) % 360 - 180, np.zeros(n)))
+        self.seed = seed
+
+    def cache_key(self):
+        return f'orbit {self.seed}'
+
+
+def test_cache_hits_with_more_orbits_than_entries_used_to_fit():
+    dc.decimation_cache.clear()
+    orbits = [TrackOrbit(seed) for seed in range(600)]
+
+    first = [dc.decimated(orbit, channel, dc.MIN_BUDGET) for orbit in orbits for channel in ('state', 'latlong')]
+    misses = dc.decimation_cache.misses
+    second = [dc.decimated(orbit, channel, dc.MIN_BUDGET) for orbit in orbits for channel in ('state', 'latlong')]
+
+    assert dc.decimation_cache.misses == misses
+    assert all(a is b for a, b in zip(first, second))
+    assert dc.decimation_cache.nbytes <= dc.decimation_cache.max_bytes
+
+
+def test_cache_keeps_entry_over_budget():
+    cache = dc.DecimationCache(max_bytes=1)
+    cache.put('old', np.zeros(16))
+    cache.put('new', np.zeros(16))
+
+    assert cache.get('old') is None
+    assert cache.get('new') is not None
+    assert not cache.get('new').flags.writeable
+
+
+def test_lttb_keeps_ends_and_budget():
+    points = np.random.default_rng(0).normal(size=(1000, 3)).cumsum(axis=0)
+    keep = dc.lttb(points, 100)
+
+    assert len(keep) == 100
+    assert keep[0] == 0 and keep[-1] == 999
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_batched_decimation_matches_single_tracks():
+    dc.decimation_cache.clear()
+    orbits = [TrackOrbit(seed / 7) for seed in range(20)]
+
+    paths = dc.decimated_orbits(orbits, 'state', 100)
+    tracks = dc.decimated_orbits(orbits, 'latlong', 100)
+
+    for orbit, path, track in zip(orbits, paths, tracks):
+        assert np.array_equal(path, orbit.state[dc.lttb(orbit.state[:, :3], 100)])
+        assert np.array_equal(track, dc.decimate_groundtrack(orbit.latlong, 100), equal_nan=True)
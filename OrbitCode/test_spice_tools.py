@@ -0,0 +1,37 @@
+import os
+import numpy as np
+import spice_tools as s
+
+
+# Write a cache file of a given size and modification time
+def write_entry(cache_dir, name, size, mtime):
+    path = os.path.join(cache_dir, name)
+    np.save(path, np.zeros(size // 8))
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evict_keeps_entry_over_budget(tmp_path):
+    path = write_entry(str(tmp_path), 'EARTH_SUN_J2000_new.npy', 4096, 2000)
+
+    s.evict_ephemeris_cache(str(tmp_path), max_bytes=1, keep=path)
+
+    assert os.path.exists(path)
+
+
+def test_evict_removes_older_entries_first(tmp_path):
+    old = write_entry(str(tmp_path), 'MOON_EARTH_J2000_old.npy', 4096, 1000)
+    new = write_entry(str(tmp_path), 'EARTH_SUN_J2000_new.npy', 4096, 2000)
+
+    s.evict_ephemeris_cache(str(tmp_path), max_bytes=1, keep=new)
+
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+
+
+def test_evict_without_keep_fits_budget(tmp_path):
+    path = write_entry(str(tmp_path), 'EARTH_SUN_J2000_new.npy', 4096, 2000)
+
+    s.evict_ephemeris_cache(str(tmp_path), max_bytes=1)
+
+    assert not os.path.exists(path)
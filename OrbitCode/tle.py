@@ -0,0 +1,162 @@
+import csv
+import io
+import json
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+import earth_orientation as eo
+
+# Columns of a packed element set array, angles in radians, rates per minute as SGP4 uses them
+EPOCH, NO_KOZAI, ECCO, INCLO, NODEO, ARGPO, MO, BSTAR, NDOT, NDDOT = range(10)
+ELEMENT_COLUMNS = 10
+
+# Minutes per day and radians per revolution, for rev/day mean motions
+MINUTES_PER_DAY = 1440.0
+XPDOTP = MINUTES_PER_DAY / (2 * np.pi)
+
+# OMM keys of the mean elements, every supported OMM encoding uses these names
+OMM_KEYS = ('EPOCH', 'MEAN_MOTION', 'ECCENTRICITY', 'INCLINATION', 'RA_OF_ASC_NODE', 'ARG_OF_PERICENTER',
+            'MEAN_ANOMALY', 'BSTAR', 'MEAN_MOTION_DOT', 'MEAN_MOTION_DDOT')
+
+
+# ET [s] of UTC datetime64 epochs
+def datetimes2et(epochs):
+    utc = (np.asarray(epochs, dtype='datetime64[us]') - np.datetime64('2000-01-01T12:00:00', 'us')) / np.timedelta64(1, 's')
+    return utc + eo.delta_ets(utc, 'UTC')
+
+
+# Value of a TLE field with an implied leading decimal point and a power of ten, ' 12345-3' is 0.12345e-3
+def implied_decimal(field):
+    field = field.strip()
+    if not field:
+        return 0.0
+    sign = -1.0 if field[0] == '-' else 1.0
+    field = field.lstrip('+-')
+    return sign * float('0.' + field[:-2].strip()) * 10.0 ** int(field[-2:])
+
+
+# Catalog number of a TLE, Alpha-5 numbers above 99999 start with a letter (I and O are skipped)
+def catalog_number(field):
+    field = field.strip()
+    if field and field[0].isalpha():
+        letter = field[0].upper()
+        return (ord(letter) - ord('A') + 10 - (letter > 'I') - (letter > 'O')) * 10000 + int(field[1:])
+    return int(field)
+
+
+# True when a TLE line's last digit is the modulo 10 sum of its digits, minus signs counting as 1
+def valid_checksum(line):
+    digits = sum(int(c) if c.isdigit() else c == '-' for c in line[:68])
+    return len(line) >= 69 and line[68].isdigit() and digits % 10 == int(line[68])
+
+
+# Parse two or three line element sets, returns names, catalog numbers and a list of element rows (epoch as datetime64)
+def parse_tle(text):
+    lines = [line.rstrip() for line in text.splitlines() if line.strip()]
+    names, numbers, rows = [], [], []
+
+    for index in range(len(lines) - 1):
+        line1, line2 = lines[index], lines[index + 1]
+        if not (line1.startswith('1 ') and line2.startswith('2 ')):
+            continue
+
+        if not (valid_checksum(line1) and valid_checksum(line2)):
+            print(f" error: bad TLE checksum, skipping '{line1[2:7].strip()}'")
+            continue
+
+        try:
+            number = catalog_number(line1[2:7])
+
+            # Two digit year, 57-99 are 1957-1999, then day of year with a fraction
+            year = int(line1[18:20])
+            year += 1900 if year >= 57 else 2000
+            day = float(line1[20:32])
+            epoch = np.datetime64(f'{year}-01-01', 'us') + np.timedelta64(int(round((day - 1) * 86400e6)), 'us')
+
+            rows.append([epoch, float(line2[52:63]), float('0.' + line2[26:33].strip()), float(line2[8:16]),
+                         float(line2[17:25]), float(line2[34:42]), float(line2[43:51]), implied_decimal(line1[53:61]),
+                         float(line1[33:43]), implied_decimal(line1[44:52])])
+        except ValueError as e:
+            print(f" error: {e}")
+            continue
+
+        # Three line sets carry the name on the line before, '0 ' prefixed in the 3LE format
+        name = ''
+        if index > 0 and not lines[index - 1].startswith(('1 ', '2 ')):
+            name = lines[index - 1][2:] if lines[index - 1].startswith('0 ') else lines[index - 1]
+        names.append(name.strip())
+        numbers.append(number)
+
+    return names, numbers, rows
+
+
+# OMM records (dicts keyed by OMM field names) to names, catalog numbers and element rows
+def parse_omm(records):
+    names, numbers, rows = [], [], []
+
+    for record in records:
+        try:
+            values = [record.get(key) or 0.0 for key in OMM_KEYS]
+            rows.append([np.datetime64(str(values[0]).strip().rstrip('Z'), 'us')] + [float(value) for value in values[1:]])
+            numbers.append(int(record.get('NORAD_CAT_ID') or 0))
+            names.append(str(record.get('OBJECT_NAME') or '').strip())
+        except (TypeError, ValueError) as e:
+            print(f" error: {e}")
+
+    return names, numbers, rows
+
+
+# OMM records from XML, every leaf below an <omm> element is a field
+def omm_xml_records(text):
+    records = []
+    for omm in ElementTree.fromstring(text).iter():
+        if omm.tag.rsplit('}', 1)[-1] == 'omm':
+            records.append({leaf.tag.rsplit('}', 1)[-1]: leaf.text for leaf in omm.iter() if len(leaf) == 0})
+    return records
+
+
+# OMM records from KVN, 'KEY = value' lines with a new record at every CCSDS_OMM_VERS line
+def omm_kvn_records(text):
+    records = []
+    for line in text.splitlines():
+        key, _, value = line.partition('=')
+        key = key.strip()
+        if key == 'CCSDS_OMM_VERS':
+            records.append({})
+        if records and value:
+            records[-1][key] = value.split('[')[0].strip()  # Drop units such as '[rev/day]'
+    return records
+
+
+# Read a local TLE, 3LE or OMM (XML, KVN, JSON or CSV) catalog into names and a packed (n, ELEMENT_COLUMNS) array
+# Names are the catalog number followed by the object name, so they are unique within a catalog
+def read_catalog(path):
+    with open(path) as file:
+        text = file.read()
+    start = text.lstrip()[:1]
+
+    if start in ('[', '{'):
+        records = json.loads(text)
+        names, numbers, rows = parse_omm([records] if isinstance(records, dict) else records)
+    elif start == '<':
+        names, numbers, rows = parse_omm(omm_xml_records(text))
+    elif 'CCSDS_OMM_VERS' in text:
+        names, numbers, rows = parse_omm(omm_kvn_records(text))
+    elif 'MEAN_MOTION' in text.split('\n', 1)[0]:
+        names, numbers, rows = parse_omm(csv.DictReader(io.StringIO(text)))
+    else:
+        names, numbers, rows = parse_tle(text)
+
+    elements = np.zeros((len(rows), ELEMENT_COLUMNS))
+    if rows:
+        columns = list(zip(*rows))
+        elements[:, EPOCH] = datetimes2et(np.array(columns[0]))
+        elements[:, 1:] = np.array(columns[1:], dtype=float).T
+
+        # rev/day, rev/day^2 and rev/day^3 to rad/min, rad/min^2 and rad/min^3, degrees to radians
+        elements[:, NO_KOZAI] /= XPDOTP
+        elements[:, NDOT] /= XPDOTP * MINUTES_PER_DAY
+        elements[:, NDDOT] /= XPDOTP * MINUTES_PER_DAY ** 2
+        elements[:, INCLO:MO + 1] = np.radians(elements[:, INCLO:MO + 1])
+
+    names = [f"{number} {name}".strip() for number, name in zip(numbers, names)]
+    return names, elements
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# On-disk trajectories, one directory of .npy files per simulation configuration
+TRAJECTORY_STORE_DIR = os.path.join('Spice', 'cache', 'trajectories')
+TRAJECTORY_STORE_MAX_BYTES = 8 * 1024 ** 3
+
+# Stored result channels with their number of columns
+CHANNELS = (('state', 6), ('t_steps', 1), ('latlong', 3), ('r_ecef', 3), ('koe_t', 6))
+
+# Channels only used for display, kept as float32 in compact entries
+DISPLAY_CHANNELS = ('latlong', 'r_ecef')
+
+
+class TrajectoryStore:
+    """Simulation results kept in memory-mapped .npy files, mapped instead of recomputed when reopened"""
+    def __init__(self, root=TRAJECTORY_STORE_DIR, max_bytes=TRAJECTORY_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    # Directory of the entry for a results key, compact entries are kept apart from full precision ones
+    def path(self, key, compact=False):
+        return os.path.join(self.root, key + ('_f32' if compact else ''))
+
+    # Data type a channel is stored with
+    @staticmethod
+    def dtype(channel, compact=False):
+        return np.float32 if compact and channel in DISPLAY_CHANNELS else np.float64
+
+    # Read-only maps of every channel of an entry, None when it is missing or incomplete
+    def open(self, key, compact=False):
+        path = self.path(key, compact)
+        try:
+            results = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name, _ in CHANNELS}
+            os.utime(path)  # Recently used, for eviction
+            return results
+        except (OSError, ValueError):
+            return None
+
+    # Writable maps for a new entry of step_n rows, filled by the caller then published with commit
+    def create(self, key, step_n, compact=False):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(suffix='.tmp', dir=self.root)
+        arrays = {name: open_memmap(os.path.join(tmp_path, name + '.npy'), mode='w+',
+                                    dtype=self.dtype(name, compact), shape=(step_n, width))
+                  for name, width in CHANNELS}
+        return tmp_path, arrays
+
+    # Flush a filled entry and rename it into place so readers never see a partial one, returns its read-only maps
+    def commit(self, key, tmp_path, arrays, compact=False):
+        for array in arrays.values():
+            array.flush()
+        arrays.clear()
+
+        path = self.path(key, compact)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)  # Another process stored the same results first
+
+        self.evict(keep=path)
+        return self.open(key, compact)
+
+    # Store results computed in memory, returns their read-only maps
+    def save(self, key, results, compact=False):
+        tmp_path, arrays = self.create(key, len(results['state']), compact)
+        for name, array in arrays.items():
+            array[:] = results[name]
+        return self.commit(key, tmp_path, arrays, compact)
+
+    # Remove an entry
+    def discard(self, key, compact=False):
+        shutil.rmtree(self.path(key, compact), ignore_errors=True)
+
+    # Remove the least recently used entries until the store fits in its size budget, the entry at keep (the one just
+    # committed) is never removed even if it alone is over budget
+    def evict(self, keep=None):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and not entry.name.endswith('.tmp') and entry.path != keep:
+                try:
+                    size = sum(file.stat().st_size for file in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except OSError:
+                    continue  # Removed by another process
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+# Store shared by every orbit
+store = TrajectoryStore()